@@ -5,27 +5,20 @@ import secrets
 import time
 import uuid
 
-import boto3
+from api_helpers import response
 from botocore.exceptions import ClientError
-from jsonschema import validate, ValidationError
-import jwt
+from dynamodb_helpers import get_table, token_key
+from validation_helpers import get_validator, validation_errors
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-
-def read_schema(schema):
-    with open(f"schemas/{schema}.json", "r") as f_obj:
-        return json.load(f_obj)
-
-
 DOMAIN_NAME = os.getenv("DOMAIN_NAME")
 
-schema_definition = read_schema("token")
-
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+# RS256 tokens are signed with the service's private key and are verified by the
+# authorizer without reading the table. HS256 tokens are signed with a secret
+# stored in their token entry.
+API_TOKEN_ALGORITHM = os.getenv("API_TOKEN_ALGORITHM", "RS256")
 
 
 def lambda_handler(event, context):
@@ -42,15 +35,10 @@ def lambda_handler(event, context):
         logger.exception("Bad Request: No JSON content found")
         return response("Bad Request: No JSON content found", 400)
 
-    try:
-        validate(request_body, schema_definition)
-    except ValidationError as error:
-        validation_error = (
-            f"Validation Error {str(error.message)} "
-            f"for item: {'/'.join([str(i) for i in error.path])}"
-        )
-        logger.error(validation_error)
-        return response(validation_error, 400)
+    errors = validation_errors(get_validator("token"), request_body)
+    if errors:
+        logger.error(f"Validation Error: {errors}")
+        return response({"message": "Validation Error", "errors": errors}, 400)
 
     new_api_token = create_api_token(
         contributor_id=authenticated_claims["sub"],
@@ -83,25 +71,32 @@ def get_scope_string(title_ids):
 
 def create_api_token(contributor_id, expires_in, scope):
     token_id = str(uuid.uuid4())
-    token_secret = secrets.token_hex()
 
     issued_time = int(time.time())
     expiration_time = issued_time + expires_in
 
-    api_token = jwt.encode(
-        {
-            "sub": contributor_id,
-            "token_use": "access",
-            "scope": scope,
-            "iss": f"https://contributors.{DOMAIN_NAME}",
-            "aud": f"https://api.{DOMAIN_NAME}",
-            "jti": token_id,
-            "exp": expiration_time,
-            "iat": issued_time,
-        },
-        token_secret,
-        algorithm="HS256",
-    ).decode()
+    claims = {
+        "sub": contributor_id,
+        "token_use": "access",
+        "scope": scope,
+        "iss": f"https://contributors.{DOMAIN_NAME}",
+        "aud": f"https://api.{DOMAIN_NAME}",
+        "jti": token_id,
+        "exp": expiration_time,
+        "iat": issued_time,
+    }
+
+    # Imports cryptography, which only requests that pass validation need
+    if API_TOKEN_ALGORITHM == "RS256":
+        import security_helpers
+
+        api_token, _ = security_helpers.create_token(contributor_id, **claims)
+        token_secret = None
+    else:
+        import jwt
+
+        token_secret = secrets.token_hex()
+        api_token = jwt.encode(claims, token_secret, algorithm="HS256").decode()
 
     return {
         "id": token_id,
@@ -112,26 +107,17 @@ def create_api_token(contributor_id, expires_in, scope):
 
 
 def write_token_to_table(contributor_id, token):
-    communitypatchtable.put_item(
-        Item={
-            "contributor_id": contributor_id,
-            "type": f"TOKEN#{token['id']}",
-            "token_id": token["id"],
-            "token_secret": token["secret"],
-            "ttl": token["expiration"],
-        },
+    item = {
+        **token_key(contributor_id, token["id"]),
+        "token_id": token["id"],
+        "ttl": token["expiration"],
+    }
+    # Tokens signed with the service's key have no secret
+    if token["secret"]:
+        item["token_secret"] = token["secret"]
+
+    get_table().put_item(
+        Item=item,
         ConditionExpression="attribute_not_exists(#type)",
         ExpressionAttributeNames={"#type": "type"},
     )
-
-
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
-
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
-    }
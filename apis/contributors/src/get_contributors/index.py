@@ -1,48 +1,88 @@
+import base64
+import binascii
+import gzip
+import json
 import logging
-from operator import itemgetter
 import os
 
+from api_helpers import response
 from aws_xray_sdk.core import patch
-import boto3
+from dynamodb_helpers import DIRECTORY_SUMMARY_KEY, get_table
+from metrics_helpers import instrumented
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 patch(["boto3"])
 
-CONTRIBUTORS_TABLE = os.getenv("CONTRIBUTORS_TABLE")
 DOMAIN_NAME = os.getenv("DOMAIN_NAME")
-TITLES_TABLE = os.getenv("TITLES_TABLE")
 
-dynamodb = boto3.resource("dynamodb")
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
 
 
+@instrumented
 def lambda_handler(event, context):
-    results = list()
+    """Return a page of the contributor directory, sorted by title count.
+
+    The directory is maintained from the table stream by the regional stream
+    processor's ``contributor_directory`` and is read as a single item.
+    """
+    qs_params = event.get("queryStringParameters") or {}
 
-    for contributor in scan_table(CONTRIBUTORS_TABLE):
+    try:
+        limit = int(qs_params.get("limit") or DEFAULT_PAGE_LIMIT)
+        offset = decode_cursor(qs_params["cursor"]) if qs_params.get("cursor") else 0
+    except ValueError:
+        return response("Bad Request: Invalid 'limit' or 'cursor'", 400)
+
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        return response(
+            f"Bad Request: 'limit' must be between 1 and {MAX_PAGE_LIMIT}", 400
+        )
+
+    directory = read_directory()
+
+    results = list()
+    for contributor in directory[offset : offset + limit]:
         uri = "/".join(["jamf/v1", contributor["id"], "software"])
         results.append(
             {
                 "id": contributor["id"],
-                "display_name": contributor["display_name"],
                 "title_count": contributor["title_count"],
+                "last_published": contributor["last_published"],
                 "urn": uri,
                 "url": f"https://{DOMAIN_NAME}/{uri}",
             }
         )
 
-    return sorted(results, key=itemgetter("title_count"), reverse=True), 200
+    result = {"contributors": results}
+    if offset + limit < len(directory):
+        result["next_cursor"] = encode_cursor(offset + limit)
+
+    return response(result, 200)
+
+
+def read_directory():
+    result = get_table().get_item(Key=DIRECTORY_SUMMARY_KEY)
+    try:
+        return json.loads(gzip.decompress(result["Item"]["body_gzip"].value))
+    except KeyError:
+        logger.warning("The contributor directory has not been written")
+        return list()
+
+
+def encode_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps({"offset": offset}).encode()).decode()
+
 
+def decode_cursor(cursor):
+    try:
+        offset = json.loads(base64.urlsafe_b64decode(cursor.encode()))["offset"]
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError, KeyError, TypeError):
+        raise ValueError("Invalid cursor")
 
-def scan_table(table_name):
-    table = dynamodb.Table(table_name)
+    if not isinstance(offset, int) or offset < 0:
+        raise ValueError("Invalid cursor")
 
-    results = table.scan()
-    while True:
-        for row in results["Items"]:
-            yield row
-        if results.get("LastEvaluatedKey"):
-            results = dynamodb.scan(ExclusiveStartKey=results["LastEvaluatedKey"])
-        else:
-            break
+    return offset
@@ -1,46 +1,62 @@
-import json
 import logging
 import os
 
-import boto3
+from api_helpers import response
 from botocore.exceptions import ClientError
+from dynamodb_helpers import get_table, revocation_key, token_key
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+COMMUNITY_PATCH_TABLE = os.getenv("COMMUNITY_PATCH_TABLE")
 
 
 def lambda_handler(event, context):
+    """Tokens with a secret are revoked by deleting their token entry, which the
+    authorizer reads for every token it verifies.
+
+    Tokens signed with the service's key are verified without reading their
+    entry, so their ID is also written to the revocation partition until the
+    token expires.
+    """
     authenticated_claims = event["requestContext"]["authorizer"]["claims"]
+    key = token_key(authenticated_claims["sub"], event["pathParameters"]["token_id"])
+
+    token_entry = get_table().get_item(Key=key).get("Item")
+    if not token_entry:
+        return response("Not Found", 404)
+
+    operations = [
+        {
+            "Delete": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Key": key,
+                "ConditionExpression": "attribute_exists(#type)",
+                "ExpressionAttributeNames": {"#type": "type"},
+            }
+        }
+    ]
+
+    if "token_secret" not in token_entry:
+        operations.append(
+            {
+                "Put": {
+                    "TableName": COMMUNITY_PATCH_TABLE,
+                    "Item": {
+                        **revocation_key(token_entry["token_id"]),
+                        "ttl": token_entry["ttl"],
+                    },
+                }
+            }
+        )
 
     try:
-        communitypatchtable.delete_item(
-            Key={
-                "contributor_id": authenticated_claims["sub"],
-                "type": f"TOKEN#{event['pathParameters']['token_id']}",
-            },
-            ConditionExpression="attribute_exists(#type)",
-            ExpressionAttributeNames={"#type": "type"},
-        )
+        get_table().meta.client.transact_write_items(TransactItems=operations)
     except ClientError as error:
-        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+        # The token was revoked by another request
+        if error.response["Error"]["Code"] == "TransactionCanceledException":
             return response("Not Found", 404)
         else:
             raise
 
     return {"statusCode": 204}
-
-
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
-
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
-    }
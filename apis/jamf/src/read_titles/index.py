@@ -1,18 +1,46 @@
-import json
+import base64
+import collections
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+import functools
+import gzip
 import logging
 import os
+import time
 
+from api_helpers import accepts_gzip, json_response, response
 import boto3
-from boto3.dynamodb.conditions import Key, Attr
+from botocore.exceptions import ClientError
+from definition_helpers import collect_summaries, content_hash, read_definition
+from dynamodb_helpers import (
+    batch_get_items,
+    get_table,
+    query_summaries,
+    title_key,
+)
+from metrics_helpers import instrumented, phase, set_property
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+FEEDS_BUCKET = os.getenv("FEEDS_BUCKET")
+
+# Feed documents the bucket did not have are answered from the table without
+# asking the bucket again for this many seconds. The renderer writes a title's
+# documents soon after it changes, so a missing document is usually a title that
+# does not exist or has just been created.
+FEED_MISS_TTL = float(os.getenv("FEED_MISS_TTL", 60))
+FEED_MISS_CACHE_SIZE = int(os.getenv("FEED_MISS_CACHE_SIZE", 1024))
+
+feed_misses = collections.OrderedDict()
 
 
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client("s3")
+
+
+@instrumented
 def lambda_handler(event, context):
     # There's an issue with the HTTP API event where the "resource" key is not the route
     # string defined in the template with the parameters but is the same value as the
@@ -22,54 +50,245 @@ def lambda_handler(event, context):
     title_ids = event["pathParameters"].get("title_ids")  # /software
     title_id = event["pathParameters"].get("title_id")  # /patch
 
-    if event["resource"] == f"/v1/{contributor_id}/software":
-        result = communitypatchtable.query(
-            IndexName="ContributorSummaries",
-            KeyConditionExpression=Key("contributor_id").eq(contributor_id),
-        )
+    request_headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    set_property("contributor_id", contributor_id)
 
-        return response([i["summary"] for i in result["Items"]], 200)
+    if event["resource"] == f"/v1/{contributor_id}/software":
+        return feed_response(
+            f"v1/{contributor_id}/software", request_headers
+        ) or summaries_response(query_summaries(contributor_id), request_headers)
 
     elif event["resource"] == f"/v1/{contributor_id}/software/{title_ids}":
-        results = list()
-
-        for i in set(title_ids.split(",")):
-            query_result = communitypatchtable.query(
-                IndexName="ContributorSummaries",
-                KeyConditionExpression=Key("contributor_id").eq(contributor_id)
-                & Key("title_id").eq(i.lower()),
-            )
-            if query_result.get("Items"):
-                results.append(query_result["Items"][0]["summary"])
-
-        return response(results, 200)
+        return summaries_response(
+            batch_read_titles(contributor_id, title_ids.split(",")), request_headers
+        )
 
     elif event["resource"] == f"/v1/{contributor_id}/patch/{title_id}":
         # Returns the full definition body of the selected title for a contributor
+        set_property("title_id", title_id)
 
-        result = communitypatchtable.get_item(
-            Key={"contributor_id": contributor_id, "type": f"TITLE#{title_id.lower()}"}
+        rendered_feed = feed_response(
+            f"v1/{contributor_id}/patch/{title_id.lower()}", request_headers
         )
+        if rendered_feed:
+            return rendered_feed
+
         try:
-            return {
-                "statusCode": 200,
-                "body": result["Item"]["body"],
-                "headers": {"Content-Type": "application/json"},
-            }
+            item, body = read_definition(get_table(), contributor_id, title_id)
         except KeyError:
             return response("Not Found", 404)
 
+        return definition_response(item, body, request_headers)
+
     else:
         return response("Not Found", 404)
 
 
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
+def feed_response(key, request_headers):
+    """Serve a feed document rendered into the feeds bucket by the stream. Returns
+    ``None`` if the document is not available so the request can be answered from
+    the table instead.
+
+    :param str key: Object key, which mirrors the request path
+    :param dict request_headers: Request headers with lowercase names
+    """
+    if not FEEDS_BUCKET or is_feed_miss(key):
+        return None
+
+    try:
+        feed = get_s3_client().get_object(Bucket=FEEDS_BUCKET, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] == "NoSuchKey":
+            add_feed_miss(key)
+        else:
+            logger.exception(f"Unable to read rendered feed: {key}")
+        return None
+
+    return encoded_response(
+        feed["Body"].read(),
+        feed["Metadata"]["content-hash"],
+        feed["Metadata"].get("last-modified"),
+        request_headers,
+    )
+
+
+def is_feed_miss(key):
+    """Whether the feeds bucket did not have a document within the last
+    ``FEED_MISS_TTL`` seconds.
+    """
+    expires = feed_misses.get(key)
+    if expires is None:
+        return False
+    if expires > time.monotonic():
+        return True
+
+    feed_misses.pop(key, None)
+    return False
+
+
+def add_feed_miss(key):
+    feed_misses[key] = time.monotonic() + FEED_MISS_TTL
+    feed_misses.move_to_end(key)
+    while len(feed_misses) > FEED_MISS_CACHE_SIZE:
+        feed_misses.popitem(last=False)
+
+
+def definition_response(item, body, request_headers):
+    """Return the full definition of a title item, or a ``304`` if the client's
+    cached copy is current. Clients that accept gzip get the compressed copy
+    stored by titles without per-version storage, or the assembled definition
+    compressed for the response.
+
+    :param dict item: The title item
+    :param str body: The assembled definition JSON
+    :param dict request_headers: Request headers with lowercase names
+    """
+    return encoded_response(
+        item["body_gzip"].value if "body_gzip" in item else None,
+        item.get("content_hash") or content_hash(body),
+        item["summary"]["lastModified"],
+        request_headers,
+        body=body,
+    )
+
+
+def encoded_response(body_gzip, etag, last_modified, request_headers, body=None):
+    """Return a JSON document, gzip compressed for clients that accept it, or a
+    ``304`` if the client's cached copy is current.
+
+    The compressed bytes are returned as-is to clients that accept gzip and are
+    decompressed for all others. A document without compressed bytes is
+    compressed only when the response is. Each representation has its own
+    entity tag.
+
+    :param body_gzip: The compressed document, or ``None`` to compress ``body``
+    :type body_gzip: bytes or None
+    :param str body: The document, if it has already been read
+    """
+    use_gzip = accepts_gzip(request_headers)
+
+    validators = cache_validators(
+        f'"{etag}-gzip"' if use_gzip else f'"{etag}"', last_modified
+    )
+    validators["Vary"] = "Accept-Encoding"
+    if is_not_modified(request_headers, validators):
+        return {"statusCode": 304, "headers": validators}
+
+    if use_gzip:
+        with phase("Serialize"):
+            if body_gzip is None:
+                body_gzip = gzip.compress(body.encode())
+            encoded_body = base64.b64encode(body_gzip).decode()
+        return {
+            "isBase64Encoded": True,
+            "statusCode": 200,
+            "body": encoded_body,
+            "headers": {
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                **validators,
+            },
+        }
+
+    if body is None:
+        with phase("Serialize"):
+            body = gzip.decompress(body_gzip).decode()
+    return json_response(body, 200, validators)
+
+
+def summaries_response(items, request_headers):
+    """Return the summaries of title items as a JSON list, or a ``304`` if the
+    client's cached copy is current.
+
+    The entity tag is derived from the stored content hash of every title so the
+    summaries only need to be serialized when something has changed.
+
+    :param items: Title items with ``title_id``, ``summary`` and ``content_hash``
+    :type items: iterable
+    """
+    summaries, feed_hash, last_modified = collect_summaries(items)
+
+    validators = cache_validators(f'"{feed_hash}"', last_modified)
+    if is_not_modified(request_headers, validators):
+        return {"statusCode": 304, "headers": validators}
+
+    return response(summaries, 200, validators)
+
+
+def cache_validators(etag, last_modified):
+    """Return the ``ETag`` and ``Last-Modified`` response headers.
+
+    :param str etag: Quoted entity tag
+    :param last_modified: A definition ``lastModified`` timestamp
+    :type last_modified: str or None
+
+    :rtype: dict
+    """
+    validators = {"ETag": etag}
+
+    try:
+        validators["Last-Modified"] = format_datetime(
+            datetime.strptime(last_modified, "%Y-%m-%dT%H:%M:%SZ").replace(
+                tzinfo=timezone.utc
+            ),
+            usegmt=True,
+        )
+    except (TypeError, ValueError):
+        logger.warning(f"Unable to parse lastModified value: {last_modified}")
+
+    return validators
+
+
+def is_not_modified(request_headers, validators):
+    """Evaluate ``If-None-Match`` and ``If-Modified-Since`` against the response
+    validators. ``If-Modified-Since`` is ignored when ``If-None-Match`` is present.
+
+    :param dict request_headers: Request headers with lowercase names
+    :param dict validators: Response headers from ``cache_validators()``
+
+    :rtype: bool
+    """
+    if "if-none-match" in request_headers:
+        etags = [i.strip() for i in request_headers["if-none-match"].split(",")]
+        return "*" in etags or validators["ETag"] in [
+            i[2:] if i.startswith("W/") else i for i in etags
+        ]
+
+    if "if-modified-since" in request_headers and "Last-Modified" in validators:
+        try:
+            return parsedate_to_datetime(
+                validators["Last-Modified"]
+            ) <= parsedate_to_datetime(request_headers["if-modified-since"])
+        except (TypeError, ValueError):
+            return False
+
+    return False
+
+
+def batch_read_titles(contributor_id, title_ids):
+    """Read the summaries of the requested titles using ``BatchGetItem``.
+
+    Duplicate and empty IDs are dropped. Items are returned in the order the
+    titles were requested; titles that do not exist are omitted.
+
+    Reads of base table items are charged for the whole item, whatever the
+    projection. Title items with per-version storage hold no patches, so a
+    title costs about as much as a query of its projected summary. Titles that
+    still store their full definition in the title item cost more until they
+    are migrated.
+
+    :param str contributor_id: The contributor that owns the titles
+    :param list title_ids: Title IDs as passed in the request path
+
+    :rtype: list
+    """
+    ordered_ids = list(dict.fromkeys(i.lower() for i in title_ids if i))
+    items = dict()
+
+    keys = [title_key(contributor_id, i) for i in ordered_ids]
+    for item in batch_get_items(
+        keys, ProjectionExpression="title_id, summary, content_hash"
+    ):
+        items[item["title_id"]] = item
 
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
-    }
+    return [items[i] for i in ordered_ids if i in items]
@@ -0,0 +1,157 @@
+import base64
+import binascii
+import functools
+import logging
+import os
+import time
+
+from api_helpers import response
+from boto3.dynamodb.conditions import Key
+from dynamodb_helpers import get_table
+from metrics_helpers import instrumented
+from search_helpers import (
+    GENERATION_KEY,
+    MATCH_PREFIX,
+    SEARCH_PARTITION_PREFIX,
+    matches,
+    query_terms,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+DEFAULT_PAGE_LIMIT = 25
+MAX_PAGE_LIMIT = 100
+
+# The index is read at most this many times for one page of results
+MAX_INDEX_QUERIES = 5
+
+# Results are cached until the search generation changes. A container reads the
+# generation at most every SEARCH_GENERATION_TTL seconds, which bounds how long
+# it can return results from before an index update.
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1024))
+SEARCH_GENERATION_TTL = int(os.getenv("SEARCH_GENERATION_TTL", 5))
+
+_generation = {"expires": 0, "value": None}
+
+
+@instrumented
+def lambda_handler(event, context):
+    """Search the titles of all contributors by name, publisher, application
+    name and bundle ID.
+
+    Query string parameters:
+
+    * ``q`` - the words to search for; every word must start a word of a title
+    * ``limit`` - the maximum number of titles in the page (optional, default 25)
+    * ``cursor`` - the ``next_cursor`` returned with the previous page (optional)
+
+    Titles are ranked by how they match the longest word of the query: whole
+    words before prefixes, and matches on the name before the application name,
+    bundle ID and publisher.
+    """
+    qs_params = event.get("queryStringParameters") or {}
+
+    try:
+        partition_term, words = query_terms(qs_params.get("q") or "")
+        limit = parse_limit(qs_params.get("limit"))
+        cursor = qs_params.get("cursor") or None
+        titles, next_cursor = cached_search(
+            current_generation(), partition_term, tuple(words), limit, cursor
+        )
+    except ValueError as error:
+        return response(f"Bad Request: {str(error)}", 400)
+
+    result = {"titles": titles}
+    if next_cursor:
+        result["next_cursor"] = next_cursor
+    return response(result, 200)
+
+
+def parse_limit(value):
+    if not value:
+        return DEFAULT_PAGE_LIMIT
+
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ValueError("'limit' must be an integer")
+
+    if not 1 <= limit <= MAX_PAGE_LIMIT:
+        raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_LIMIT}")
+    return limit
+
+
+def current_generation():
+    """Return the search generation, reading it from the table if the value read
+    last is older than ``SEARCH_GENERATION_TTL`` seconds.
+    """
+    if time.monotonic() >= _generation["expires"]:
+        item = get_table().get_item(Key=GENERATION_KEY).get("Item", {})
+        _generation["value"] = int(item.get("generation", 0))
+        _generation["expires"] = time.monotonic() + SEARCH_GENERATION_TTL
+
+    return _generation["value"]
+
+
+@functools.lru_cache(maxsize=SEARCH_CACHE_SIZE)
+def cached_search(generation, partition_term, words, limit, cursor):
+    """Return a page of search results and the cursor for the next page. Pages
+    are cached by the search generation they were read at.
+
+    The index partition of ``partition_term`` holds every title with a word
+    starting with the term, ordered by rank. It is read in order until ``limit``
+    titles matching all of the ``words`` are found, the partition ends, or it
+    has been read ``MAX_INDEX_QUERIES`` times. Each query reads at most
+    ``limit`` entries, so the time taken does not depend on the number of
+    titles in the index.
+
+    :rtype: tuple
+    """
+    partition = f"{SEARCH_PARTITION_PREFIX}{partition_term}"
+    kwargs = {
+        "KeyConditionExpression": Key("contributor_id").eq(partition),
+        "ProjectionExpression": "#type, title, tokens, score",
+        "ExpressionAttributeNames": {"#type": "type"},
+        "Limit": limit,
+    }
+    if cursor:
+        kwargs["ExclusiveStartKey"] = decode_cursor(cursor, partition)
+
+    titles = list()
+    for _ in range(MAX_INDEX_QUERIES):
+        result = get_table().query(**kwargs)
+
+        for index, item in enumerate(result["Items"]):
+            if not matches(item, words):
+                continue
+
+            titles.append({**item["title"], "score": int(item["score"])})
+            if len(titles) == limit:
+                if index == len(result["Items"]) - 1 and not result.get(
+                    "LastEvaluatedKey"
+                ):
+                    return titles, None
+                return titles, encode_cursor(item["type"])
+
+        if not result.get("LastEvaluatedKey"):
+            return titles, None
+        kwargs["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+    return titles, encode_cursor(kwargs["ExclusiveStartKey"]["type"])
+
+
+def encode_cursor(index_type):
+    return base64.urlsafe_b64encode(index_type.encode()).decode()
+
+
+def decode_cursor(cursor, partition):
+    try:
+        index_type = base64.urlsafe_b64decode(cursor.encode()).decode()
+    except (binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+    if not index_type.startswith(MATCH_PREFIX):
+        raise ValueError("Invalid cursor")
+
+    return {"contributor_id": partition, "type": index_type}
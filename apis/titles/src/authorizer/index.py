@@ -1,19 +1,31 @@
+from collections import OrderedDict
 import logging
 import os
+import time
 
-import boto3
+from dynamodb_helpers import REVOCATION_PARTITION, get_table, query_prefix, token_key
 import jwt
+from metrics_helpers import instrumented, phase, set_property
+import security_helpers
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 DOMAIN_NAME = os.getenv("DOMAIN_NAME")
 
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+# A revoked token may be accepted for up to TOKEN_CACHE_TTL seconds by a warm
+# container, plus the API Gateway authorizer result TTL (see template.yaml).
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+TOKEN_CACHE_TTL = int(os.getenv("TOKEN_CACHE_TTL", 60))
 
+# Tokens signed with the service's key are verified without a table read. Their
+# revocations are read from the revocation partition at most every
+# REVOCATION_REFRESH seconds, which bounds how long a revoked token can still be
+# accepted in the same way.
+REVOCATION_REFRESH = int(os.getenv("REVOCATION_REFRESH", 60))
 
+
+@instrumented
 def lambda_handler(event, context):
     """Details on errors must never be provided back to the authenticating client.
 
@@ -24,26 +36,133 @@ def lambda_handler(event, context):
 
     try:
         unverified_claims = jwt.decode(token, verify=False)
-        token_entry = token_lookup(unverified_claims["sub"], unverified_claims["jti"])
-        jwt.decode(
-            token,
-            token_entry["token_secret"],
-            issuer=f"https://contributors.{DOMAIN_NAME}",
-            audience=f"https://api.{DOMAIN_NAME}",
-            algorithms=["HS256"],
-        )
+        set_property("contributor_id", unverified_claims["sub"])
+
+        if jwt.get_unverified_header(token)["alg"] == "RS256":
+            claims = verify_signed_token(token)
+        else:
+            claims = verify_secret_token(token, unverified_claims)
     except:
         logger.exception("Token verification failed")
         raise Exception("Unauthorized")
 
-    return generate_policy(token, "Allow", event["methodArn"], unverified_claims)
+    return generate_policy(token, "Allow", event["methodArn"], claims)
 
 
-def token_lookup(contributor_id, token_id):
-    response = communitypatchtable.get_item(
-        Key={"contributor_id": contributor_id, "type": f"TOKEN#{token_id}"}
+def verify_signed_token(token):
+    """Verify a token signed with the service's key, and check that it has not
+    been revoked.
+    """
+    claims = security_helpers.validate_token(
+        token,
+        issuer=f"https://contributors.{DOMAIN_NAME}",
+        audience=f"https://api.{DOMAIN_NAME}",
     )
-    return response["Item"]
+    if claims["jti"] in revocations.token_ids():
+        raise Exception(f"Token has been revoked: {claims['jti']}")
+    return claims
+
+
+def verify_secret_token(token, unverified_claims):
+    """Verify a token signed with its own secret, which is read from its token
+    entry.
+    """
+    with phase("AuthorizerLookup"):
+        token_entry = token_lookup(unverified_claims["sub"], unverified_claims["jti"])
+
+    return jwt.decode(
+        token,
+        token_entry["token_secret"],
+        issuer=f"https://contributors.{DOMAIN_NAME}",
+        audience=f"https://api.{DOMAIN_NAME}",
+        algorithms=["HS256"],
+    )
+
+
+class TokenCache:
+    """A bounded LRU cache of token table entries. Entries expire ``ttl`` seconds
+    after they were read from the table, which bounds how long a revoked token
+    can still be accepted by a warm container.
+    """
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+    def get(self, key):
+        try:
+            expires, value = self._entries[key]
+        except KeyError:
+            return None
+
+        if expires <= time.monotonic():
+            del self._entries[key]
+            return None
+
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL)
+
+
+def token_lookup(contributor_id, token_id):
+    """Return the table entry for a token, from the cache if it was read within
+    the cache TTL. Missing tokens are never cached.
+    """
+    cache_key = (contributor_id, token_id)
+
+    token_entry = token_cache.get(cache_key)
+    if token_entry is None:
+        response = get_table().get_item(Key=token_key(contributor_id, token_id))
+        token_entry = response["Item"]
+        token_cache.put(cache_key, token_entry)
+
+    return token_entry
+
+
+class RevocationSet:
+    """The IDs of revoked tokens, read from the revocation partition when they
+    are older than ``refresh`` seconds. Revocation entries expire with their
+    token, so the set only holds tokens that would otherwise still be accepted.
+
+    A failed read is raised instead of returning stale IDs, so tokens are never
+    accepted unchecked.
+    """
+
+    def __init__(self, refresh):
+        self.refresh = refresh
+        self._expires = 0
+        self._token_ids = frozenset()
+
+    def token_ids(self):
+        if time.monotonic() >= self._expires:
+            with phase("AuthorizerLookup"):
+                self._token_ids = frozenset(read_revocations())
+            self._expires = time.monotonic() + self.refresh
+        return self._token_ids
+
+
+revocations = RevocationSet(REVOCATION_REFRESH)
+
+
+def read_revocations():
+    """Yield the IDs of revoked tokens from the revocation partition."""
+    for item in query_prefix(
+        REVOCATION_PARTITION,
+        "REVOKED#",
+        ProjectionExpression="#type",
+        ExpressionAttributeNames={"#type": "type"},
+    ):
+        yield item["type"].partition("#")[2]
 
 
 def generate_policy(principal_id, effect=None, resource=None, context=None):
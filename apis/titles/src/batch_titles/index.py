@@ -0,0 +1,461 @@
+import json
+import logging
+import os
+import random
+import time
+
+from api_helpers import event_body, response
+from botocore.exceptions import ClientError
+from definition_helpers import (
+    RANK_START,
+    build_title_item,
+    build_version_items,
+    has_duplicate_versions,
+    initial_ranks,
+    next_rank,
+)
+from dynamodb_helpers import (
+    archive_prefix,
+    batch_get_items,
+    get_table,
+    put_new_items,
+    query_prefix,
+    title_key,
+    version_key,
+)
+from metrics_helpers import instrumented, phase, set_property
+from overflow_helpers import discard_overflow, overflow_item
+from validation_helpers import get_validator, validation_errors
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+COMMUNITY_PATCH_TABLE = os.getenv("COMMUNITY_PATCH_TABLE")
+
+MAX_OPERATIONS = 100
+
+# TransactWriteItems accepts at most 100 operations per request
+TRANSACT_WRITE_LIMIT = 100
+WRITE_MAX_ATTEMPTS = 5
+
+
+@instrumented
+def lambda_handler(event, context):
+    """Apply a list of title operations for the authenticated contributor.
+
+    Each operation is one of:
+
+    * ``{"action": "create", "definition": {...}}``
+    * ``{"action": "update", "definition": {...}}`` - replaces the definition
+    * ``{"action": "delete", "title_id": "..."}``
+
+    Operations are validated and applied independently; the response contains
+    a result with a status code for every operation, in request order.
+    """
+    # Not consistent with Cognito auth
+    authenticated_claims = event["requestContext"]["authorizer"]
+    contributor_id = authenticated_claims["sub"]
+    set_property("contributor_id", contributor_id)
+
+    try:
+        with phase("Parse"):
+            request_body = json.loads(event_body(event))
+    except (TypeError, ValueError):
+        logger.exception("Bad Request: No JSON content found")
+        return response("Bad Request: No JSON content found", 400)
+
+    operations = (
+        request_body.get("operations") if isinstance(request_body, dict) else None
+    )
+    if not operations or not isinstance(operations, list):
+        return response("Bad Request: 'operations' must be a non-empty list", 400)
+
+    if len(operations) > MAX_OPERATIONS:
+        return response(
+            f"Bad Request: A request may contain at most {MAX_OPERATIONS} operations",
+            400,
+        )
+
+    results = [None] * len(operations)
+    valid_operations = validate_operations(operations, results)
+
+    existing_titles = read_title_items(
+        contributor_id, [i["title_id"] for i in valid_operations]
+    )
+    writes = list()
+    for operation in valid_operations:
+        title_item = existing_titles.get(operation["title_id"])
+        if operation["action"] == "create" and title_item:
+            set_result(
+                results,
+                operation,
+                409,
+                f"Conflict: You have already created a title with the ID "
+                f"'{operation['title_id']}'",
+            )
+        elif operation["action"] != "create" and not title_item:
+            set_result(results, operation, 404, "Not Found")
+        else:
+            operation["existing"] = title_item
+            writes.append(operation)
+
+    write_titles(contributor_id, writes, results)
+
+    counts = dict()
+    for result in results:
+        counts[result["status"]] = counts.get(result["status"], 0) + 1
+    logger.info(f"Applied {len(operations)} title operations: {counts}")
+
+    return response({"results": results}, 200)
+
+
+def validate_operations(operations, results):
+    """Validate every operation, setting a ``400`` result on those that are
+    invalid.
+
+    :returns: The valid operations with their ``index``, ``action`` and
+        ``title_id``
+    :rtype: list
+    """
+    valid_operations = list()
+    title_ids = set()
+
+    for index, operation in enumerate(operations):
+        parsed = {"index": index, "action": None}
+        if not isinstance(operation, dict):
+            set_result(results, parsed, 400, "Bad Request: Unknown operation")
+            continue
+
+        action = parsed["action"] = operation.get("action")
+
+        if action in ("create", "update"):
+            definition = operation.get("definition")
+            with phase("Validation"):
+                errors = validation_errors(get_validator("full_definition"), definition)
+            if errors:
+                set_result(
+                    results,
+                    parsed,
+                    400,
+                    "Validation Error",
+                    errors=errors,
+                    title_id=(
+                        definition.get("id") if isinstance(definition, dict) else None
+                    ),
+                )
+                continue
+
+            parsed["title_id"] = definition["id"].lower()
+            parsed["definition"] = definition
+
+            if has_duplicate_versions(definition):
+                set_result(
+                    results,
+                    parsed,
+                    400,
+                    "Bad Request: The definition contains duplicate versions",
+                )
+                continue
+
+        elif action == "delete" and isinstance(operation.get("title_id"), str):
+            parsed["title_id"] = operation["title_id"].lower()
+
+        else:
+            set_result(results, parsed, 400, "Bad Request: Unknown operation")
+            continue
+
+        if parsed["title_id"] in title_ids:
+            set_result(
+                results,
+                parsed,
+                400,
+                "Bad Request: The request contains another operation for this title",
+            )
+            continue
+
+        title_ids.add(parsed["title_id"])
+        valid_operations.append(parsed)
+
+    return valid_operations
+
+
+def read_title_items(contributor_id, title_ids):
+    """Read the existing title items of a list of titles.
+
+    :returns: Title items by lowercase title ID
+    :rtype: dict
+    """
+    items = batch_get_items(
+        [title_key(contributor_id, i) for i in title_ids],
+        ProjectionExpression="#type, versions, revision, retention, archived_count",
+        ExpressionAttributeNames={"#type": "type"},
+        ConsistentRead=True,
+    )
+    return {i["type"][6:]: i for i in items}
+
+
+def write_titles(contributor_id, operations, results):
+    """Write the operations that passed validation.
+
+    The version items of new and replaced definitions are written first, each
+    on the condition that no item has its key, so the versions of another
+    request are never overwritten. A replaced definition's versions are ranked
+    above its existing ones, and a new definition's above any left over from a
+    deleted title; an operation with a rank taken in the meantime fails with a
+    conflict. The title items are then written with conditional
+    ``TransactWriteItems`` requests, so a title only becomes visible, or changes,
+    once all of its versions are in the table. Finally the version items that
+    are no longer referenced by a title item, and those this request wrote for
+    operations that failed, are deleted with the archived versions of deleted
+    titles. Replaced titles keep their retention policy and archived versions.
+
+    Large values are stored in the definitions bucket. The objects of items
+    that were not written are deleted; those of deleted version items expire
+    once the deletes are read from the table stream.
+    """
+    for operation in operations:
+        if operation["action"] == "delete":
+            continue
+
+        definition = operation["definition"]
+        existing = operation["existing"]
+
+        if existing:
+            start = max(
+                [int(r.partition(".")[0]) + 1 for r in existing_ranks(existing)],
+                default=RANK_START,
+            )
+        else:
+            start, exists = next_rank(
+                get_table(), contributor_id, operation["title_id"]
+            )
+            if exists:
+                set_condition_failed_result(results, operation)
+                continue
+
+        ranks = initial_ranks(len(definition["patches"]), start)
+        title_item = build_title_item(
+            contributor_id,
+            definition,
+            ranks,
+            revision=int(existing.get("revision", 0)) + 1 if existing else 1,
+        )
+        for name in ("retention", "archived_count"):
+            if existing and name in existing:
+                title_item[name] = existing[name]
+
+        operation["title_item"] = overflow_item(title_item)
+        operation["version_items"] = [
+            overflow_item(i)
+            for i in build_version_items(contributor_id, definition, ranks)
+        ]
+
+    written, taken = put_new_items(
+        [
+            item
+            for operation in operations
+            if results[operation["index"]] is None
+            for item in operation.get("version_items", [])
+        ]
+    )
+    written_types = {i["type"] for i in written}
+    taken_types = {i["type"] for i in taken}
+    for operation in operations:
+        version_types = {i["type"] for i in operation.get("version_items", [])}
+        operation["written_types"] = version_types & written_types
+        if version_types & taken_types:
+            set_result(
+                results,
+                operation,
+                409,
+                "Conflict: The title is being updated by another request",
+            )
+
+    pending = [i for i in operations if results[i["index"]] is None]
+    for start in range(0, len(pending), TRANSACT_WRITE_LIMIT):
+        transact_title_items(
+            contributor_id, pending[start : start + TRANSACT_WRITE_LIMIT], results
+        )
+
+    discard_overflow(
+        taken
+        + [
+            operation["title_item"]
+            for operation in operations
+            if "title_item" in operation
+            and results[operation["index"]]["status"] >= 300
+        ]
+    )
+
+    with get_table().batch_writer() as batch:
+        for operation in operations:
+            if results[operation["index"]]["status"] < 300:
+                unreferenced = [
+                    version_key(contributor_id, operation["title_id"], rank)
+                    for rank in existing_ranks(operation["existing"])
+                ]
+            else:
+                unreferenced = [
+                    {"contributor_id": contributor_id, "type": i}
+                    for i in operation["written_types"]
+                ]
+
+            for key in unreferenced:
+                batch.delete_item(Key=key)
+
+            if (
+                operation["action"] == "delete"
+                and results[operation["index"]]["status"] < 300
+                and operation["existing"].get("archived_count")
+            ):
+                for item in query_prefix(
+                    contributor_id,
+                    archive_prefix(operation["title_id"]),
+                    ProjectionExpression="contributor_id, #type",
+                    ExpressionAttributeNames={"#type": "type"},
+                ):
+                    batch.delete_item(Key=item)
+
+
+def transact_title_items(contributor_id, operations, results):
+    """Write the title items of up to ``TRANSACT_WRITE_LIMIT`` operations in one
+    transaction.
+
+    Operations whose condition fails get an error result and are removed from
+    the transaction; the remaining operations are retried.
+    """
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        if not operations:
+            return
+
+        try:
+            get_table().meta.client.transact_write_items(
+                TransactItems=[title_write(contributor_id, i) for i in operations]
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+
+            reasons = error.response.get("CancellationReasons", [])
+            failed = [
+                operation
+                for operation, reason in zip(operations, reasons)
+                if reason.get("Code") == "ConditionalCheckFailed"
+            ]
+            for operation in failed:
+                set_condition_failed_result(results, operation)
+
+            operations = [i for i in operations if i not in failed]
+            logger.warning(
+                f"Title transaction cancelled, retrying {len(operations)} "
+                f"operations (attempt {attempt + 1})"
+            )
+            if not failed:
+                time.sleep(random.uniform(0, 0.05 * 2 ** attempt))
+            continue
+
+        for operation in operations:
+            if operation["action"] == "create":
+                set_result(
+                    results, operation, 201, f"Title '{operation['title_id']}' created"
+                )
+            elif operation["action"] == "update":
+                set_result(
+                    results, operation, 200, f"Title '{operation['title_id']}' updated"
+                )
+            else:
+                set_result(
+                    results, operation, 200, f"Title '{operation['title_id']}' deleted"
+                )
+        return
+
+    for operation in operations:
+        set_result(
+            results,
+            operation,
+            409,
+            "Conflict: The title is being updated by another request",
+        )
+
+
+def title_write(contributor_id, operation):
+    """Return the transaction operation that writes an operation's title item.
+    Creates require that the title does not exist; updates and deletes require
+    that it has not changed since it was read.
+    """
+    if operation["action"] == "create":
+        return {
+            "Put": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Item": operation["title_item"],
+                "ConditionExpression": "attribute_not_exists(#type)",
+                "ExpressionAttributeNames": {"#type": "type"},
+            }
+        }
+
+    revision = operation["existing"].get("revision")
+    if revision:
+        condition = {
+            "ConditionExpression": "revision = :rev",
+            "ExpressionAttributeValues": {":rev": revision},
+        }
+    else:
+        condition = {
+            "ConditionExpression": "attribute_exists(#type) "
+            "and attribute_not_exists(revision)",
+            "ExpressionAttributeNames": {"#type": "type"},
+        }
+
+    if operation["action"] == "update":
+        return {
+            "Put": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Item": operation["title_item"],
+                **condition,
+            }
+        }
+
+    return {
+        "Delete": {
+            "TableName": COMMUNITY_PATCH_TABLE,
+            "Key": title_key(contributor_id, operation["title_id"]),
+            **condition,
+        }
+    }
+
+
+def existing_ranks(title_item):
+    """The ranks of the version items of an existing title item."""
+    if not title_item:
+        return []
+    return list(title_item.get("versions", {}).values())
+
+
+def set_condition_failed_result(results, operation):
+    if operation["action"] == "create":
+        set_result(
+            results,
+            operation,
+            409,
+            f"Conflict: You have already created a title with the ID "
+            f"'{operation['title_id']}'",
+        )
+    else:
+        set_result(
+            results,
+            operation,
+            409,
+            "Conflict: The title was changed by another request",
+        )
+
+
+def set_result(results, operation, status, message, **kwargs):
+    result = {
+        "index": operation["index"],
+        "action": operation["action"],
+        "title_id": operation.get("title_id"),
+        "status": status,
+        "message": message,
+    }
+    result.update(kwargs)
+    results[operation["index"]] = result
@@ -1,91 +1,126 @@
 import json
 import logging
-import os
 
-import boto3
+from api_helpers import event_body, response
 from botocore.exceptions import ClientError
-from jsonschema import validate, ValidationError
+from definition_helpers import (
+    build_title_item,
+    build_version_items,
+    has_duplicate_versions,
+    initial_ranks,
+    next_rank,
+)
+from dynamodb_helpers import get_table, put_new_items
+from metrics_helpers import instrumented, phase, set_property
+from overflow_helpers import discard_overflow, overflow_item
+from validation_helpers import get_validator, validation_errors
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-
-def read_schema(schema):
-    with open(f"schemas/{schema}.json", "r") as f_obj:
-        return json.load(f_obj)
-
-
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
-
-schema_definition = read_schema("full_definition")
+# Creates whose version ranks are taken by another write of the title ID are
+# retried with ranks above that write's
+CREATE_MAX_ATTEMPTS = 5
 
 
+@instrumented
 def lambda_handler(event, context):
     # Not consistent with Cognito auth
     authenticated_claims = event["requestContext"]["authorizer"]
+    set_property("contributor_id", authenticated_claims["sub"])
 
     try:
-        title_body = json.loads(event["body"])
-    except (TypeError, json.JSONDecodeError):
+        with phase("Parse"):
+            title_body = json.loads(event_body(event))
+    except (TypeError, ValueError):
         logger.exception("Bad Request: No JSON content found")
         return response("Bad Request: No JSON content found", 400)
 
-    try:
-        validate(title_body, schema_definition)
-    except ValidationError as error:
-        validation_error = (
-            f"Validation Error {str(error.message)} "
-            f"for item: {'/'.join([str(i) for i in error.path])}"
-        )
-        logger.error(validation_error)
-        return response(validation_error, 400)
+    with phase("Validation"):
+        errors = validation_errors(get_validator("full_definition"), title_body)
+    if errors:
+        logger.error(f"Validation Error: {errors}")
+        return response({"message": "Validation Error", "errors": errors}, 400)
+
+    set_property("title_id", title_body["id"])
+    if has_duplicate_versions(title_body):
+        return response("Bad Request: The definition contains duplicate versions", 400)
 
     try:
-        create_table_entry(authenticated_claims["sub"], title_body)
+        created = create_table_entry(authenticated_claims["sub"], title_body)
     except ClientError as error:
         if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
-            return response(
-                f"Conflict: You have already created a title with the ID '{title_body['id']}'",
-                409,
-            )
+            created = False
         else:
             logger.exception("Unknown ClientError writing new title.")
             return response(f"Internal Server Error", 500)
 
+    if not created:
+        return response(
+            f"Conflict: You have already created a title with the ID '{title_body['id']}'",
+            409,
+        )
+
     return response(f"Title '{title_body['id']}' created", 201)
 
 
 def create_table_entry(contributor_id, title_body):
-    communitypatchtable.put_item(
-        Item={
-            "contributor_id": contributor_id,
-            "type": f"TITLE#{title_body['id'].lower()}",
-            "search_index": "TITLE",
-            "aws_region": os.getenv("AWS_REGION"),
-            "title_id": title_body["id"].lower(),
-            "body": json.dumps(title_body),
-            "summary": {
-                "id": title_body["id"],
-                "name": title_body["name"],
-                "publisher": title_body["publisher"],
-                "currentVersion": title_body["currentVersion"],
-                "lastModified": title_body["lastModified"],
-            },
-        },
-        ConditionExpression="attribute_not_exists(#type)",
-        ExpressionAttributeNames={"#type": "type"},
-    )
-
-
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
-
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
-    }
+    """Write one item per patch version and then the title item.
+
+    The title item is written last, on the condition that the title does not
+    exist, so readers never see a title whose version items are not written
+    yet. The version items are ranked above any version items already in the
+    table and are only put where no item exists, so those of an existing title,
+    of another request creating the same title, or left over from a deleted one
+    are never overwritten. If a rank was taken in the meantime the ranks are
+    chosen again. If the title item cannot be written the version items this
+    request wrote are removed again. Large values are stored in the definitions
+    bucket.
+
+    :returns: ``False`` if the title already exists
+    :rtype: bool
+    """
+    for attempt in range(CREATE_MAX_ATTEMPTS):
+        start, exists = next_rank(get_table(), contributor_id, title_body["id"])
+        if exists:
+            return False
+
+        ranks = initial_ranks(len(title_body["patches"]), start)
+        version_items = [
+            overflow_item(i)
+            for i in build_version_items(contributor_id, title_body, ranks)
+        ]
+        written, taken = put_new_items(version_items)
+        if not taken:
+            break
+
+        discard_overflow(taken)
+        delete_version_items(written)
+        logger.warning(
+            f"Version ranks taken during create: {title_body['id']} "
+            f"(attempt {attempt + 1})"
+        )
+    else:
+        # Another request keeps writing versions of the title ID, which is
+        # reported like the title it creates
+        return False
+
+    title_item = overflow_item(build_title_item(contributor_id, title_body, ranks))
+    try:
+        get_table().put_item(
+            Item=title_item,
+            ConditionExpression="attribute_not_exists(#type)",
+            ExpressionAttributeNames={"#type": "type"},
+        )
+    except ClientError:
+        discard_overflow([title_item])
+        delete_version_items(written)
+        raise
+
+    return True
+
+
+def delete_version_items(version_items):
+    with get_table().batch_writer() as batch:
+        for item in version_items:
+            batch.delete_item(Key={k: item[k] for k in ("contributor_id", "type")})
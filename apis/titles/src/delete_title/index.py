@@ -1,47 +1,110 @@
-import json
 import logging
-import os
 
-import boto3
+from api_helpers import response
+from boto3.dynamodb.conditions import Key
 from botocore.exceptions import ClientError
+from dynamodb_helpers import (
+    archive_prefix,
+    get_table,
+    query_items,
+    query_prefix,
+    title_key,
+)
+from metrics_helpers import instrumented, set_property
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+# Deletes that lose a race with a change to the title are retried
+DELETE_MAX_ATTEMPTS = 5
 
 
+@instrumented
 def lambda_handler(event, context):
     authenticated_claims = event["requestContext"]["authorizer"]
     title_id = event["pathParameters"]["title_id"]
+    set_property("contributor_id", authenticated_claims["sub"])
+    set_property("title_id", title_id)
 
-    try:
-        communitypatchtable.delete_item(
-            Key={
-                "contributor_id": authenticated_claims["sub"],
-                "type": f"TITLE#{title_id.lower()}",
-            },
-            ConditionExpression="attribute_exists(#type)",
-            ExpressionAttributeNames={"#type": "type"},
-        )
-    except ClientError as error:
-        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+    for attempt in range(DELETE_MAX_ATTEMPTS):
+        title_item, keys = title_keys(authenticated_claims["sub"], title_id)
+        if not title_item:
             return response("Not Found", 404)
-        else:
-            raise
+
+        try:
+            delete_title_item(title_item)
+            break
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+
+        logger.warning(
+            f"Title changed during delete: {title_item['type']} (attempt {attempt + 1})"
+        )
+    else:
+        return response("Conflict: The title is being updated by another request", 409)
+
+    with get_table().batch_writer() as batch:
+        for key in keys:
+            batch.delete_item(Key=key)
 
     return response(f"Title '{title_id}' deleted", 200)
 
 
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
+def title_keys(contributor_id, title_id):
+    """Read a title item with the keys of its version and archive items.
 
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
+    The keys are read before the title item is deleted. A title created with
+    the same ID once it is deleted ranks its versions above those read here, so
+    deleting these keys never removes the items of the new title.
+
+    :returns: The title item, ``None`` if it does not exist, and the keys
+    :rtype: tuple
+    """
+    title_type = title_key(contributor_id, title_id)["type"]
+    version_prefix = f"{title_type}#VERSION#"
+    projection = {
+        "ProjectionExpression": "contributor_id, #type, revision",
+        "ExpressionAttributeNames": {"#type": "type"},
+        "ConsistentRead": True,
     }
+
+    title_item = None
+    keys = list()
+    for item in query_items(
+        KeyConditionExpression=Key("contributor_id").eq(contributor_id)
+        & Key("type").between(title_type, f"{version_prefix}~"),
+        **projection,
+    ):
+        if item["type"] == title_type:
+            title_item = item
+        elif item["type"].startswith(version_prefix):
+            keys.append({"contributor_id": contributor_id, "type": item["type"]})
+
+    keys.extend(
+        {"contributor_id": contributor_id, "type": i["type"]}
+        for i in query_prefix(contributor_id, archive_prefix(title_id), **projection)
+    )
+    return title_item, keys
+
+
+def delete_title_item(title_item):
+    """Delete a title item on the condition that it has not changed since it was
+    read, so no version is added after its keys were read.
+    """
+    # Titles created before revisions were introduced have no revision attribute
+    if title_item.get("revision"):
+        condition = {
+            "ConditionExpression": "revision = :rev",
+            "ExpressionAttributeValues": {":rev": title_item["revision"]},
+        }
+    else:
+        condition = {
+            "ConditionExpression": "attribute_exists(#type) "
+            "and attribute_not_exists(revision)",
+            "ExpressionAttributeNames": {"#type": "type"},
+        }
+
+    get_table().delete_item(
+        Key={k: title_item[k] for k in ("contributor_id", "type")}, **condition
+    )
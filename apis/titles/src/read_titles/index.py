@@ -1,57 +1,232 @@
+import base64
+import binascii
+import gzip
 import json
 import logging
-import os
 
-import boto3
+from api_helpers import accepts_gzip, json_response, response
 from boto3.dynamodb.conditions import Key
+from definition_helpers import content_hash, read_definition
+from dynamodb_helpers import SUMMARY_INDEX, archive_prefix, get_table, title_key
+from metrics_helpers import instrumented, phase, set_property
+from overflow_helpers import load_value
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+MAX_PAGE_LIMIT = 1000
 
+# The attributes of the last evaluated key of a page of title summaries, which
+# holds the index key as well as the table key, and of a page of the archive
+SUMMARY_CURSOR_KEYS = frozenset(("contributor_id", "type", "title_id"))
+ARCHIVE_CURSOR_KEYS = frozenset(("contributor_id", "type"))
 
+
+@instrumented
 def lambda_handler(event, context):
     # Not consistent with Cognito auth
     authenticated_claims = event["requestContext"]["authorizer"]
+    set_property("contributor_id", authenticated_claims["sub"])
 
     if event["resource"] == "/v1/titles":
-        result = communitypatchtable.query(
-            IndexName="ContributorSummaries",
-            KeyConditionExpression=Key("contributor_id").eq(
-                authenticated_claims["sub"]
-            ),
-        )
-        return response({"titles": [i["summary"] for i in result["Items"]]}, 200)
+        try:
+            titles, next_cursor = read_summaries_page(
+                authenticated_claims["sub"], event.get("queryStringParameters") or {}
+            )
+        except ValueError as error:
+            return response(f"Bad Request: {str(error)}", 400)
+
+        result = {"titles": titles}
+        if next_cursor:
+            result["next_cursor"] = next_cursor
+        return response(result, 200)
 
     elif event["resource"] == "/v1/titles/{title_id}":
         title_id = event["pathParameters"]["title_id"]
+        set_property("title_id", title_id)
 
-        result = communitypatchtable.get_item(
-            Key={
-                "contributor_id": authenticated_claims["sub"],
-                "type": f"TITLE#{title_id.lower()}",
-            }
-        )
         try:
-            return {
-                "statusCode": 200,
-                "body": result["Item"]["body"],
-                "headers": {"Content-Type": "application/json"},
-            }
+            item, body = read_definition(
+                get_table(), authenticated_claims["sub"], title_id
+            )
         except KeyError:
             return response("Not Found", 404)
 
+        request_headers = {
+            k.lower(): v for k, v in (event.get("headers") or {}).items()
+        }
+        return definition_response(item, body, request_headers)
+
+    elif event["resource"] == "/v1/titles/{title_id}/archive":
+        title_id = event["pathParameters"]["title_id"]
+        set_property("title_id", title_id)
+
+        try:
+            patches, next_cursor = read_archive_page(
+                authenticated_claims["sub"],
+                title_id,
+                event.get("queryStringParameters") or {},
+            )
+        except ValueError as error:
+            return response(f"Bad Request: {str(error)}", 400)
+        except KeyError:
+            return response("Not Found", 404)
+
+        result = {"patches": patches}
+        if next_cursor:
+            result["next_cursor"] = next_cursor
+        return response(result, 200)
+
 
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
+def read_archive_page(contributor_id, title_id, qs_params):
+    """Return one page of a title's archived patches, newest first, and the
+    cursor for the next page. Takes the same 'limit' and 'cursor' parameters as
+    the list of titles.
 
-    return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
+    :raises KeyError: The title does not exist
+
+    :rtype: tuple
+    """
+    kwargs = {
+        "KeyConditionExpression": Key("contributor_id").eq(contributor_id)
+        & Key("type").begins_with(archive_prefix(title_id)),
+        "ScanIndexForward": False,
     }
+    kwargs.update(page_parameters(contributor_id, qs_params, ARCHIVE_CURSOR_KEYS))
+    start_key = kwargs.get("ExclusiveStartKey")
+    if start_key and not start_key.get("type", "").startswith(archive_prefix(title_id)):
+        raise ValueError("Invalid cursor")
+
+    result = get_table().query(**kwargs)
+
+    # A title without archived versions is told apart from a missing title
+    if not result["Items"] and "ExclusiveStartKey" not in kwargs:
+        if "Item" not in get_table().get_item(
+            Key=title_key(contributor_id, title_id),
+            ProjectionExpression="#type",
+            ExpressionAttributeNames={"#type": "type"},
+        ):
+            raise KeyError(title_id)
+
+    return (
+        [json.loads(load_value(i["patch"])) for i in result["Items"]],
+        encode_cursor(result["LastEvaluatedKey"])
+        if result.get("LastEvaluatedKey")
+        else None,
+    )
+
+
+def page_parameters(contributor_id, qs_params, cursor_keys):
+    """Return the query parameters of the 'limit' and 'cursor' query string
+    parameters.
+
+    :param set cursor_keys: The attributes of a start key of the query
+
+    :rtype: dict
+    """
+    kwargs = dict()
+
+    if qs_params.get("limit"):
+        try:
+            kwargs["Limit"] = int(qs_params["limit"])
+        except ValueError:
+            raise ValueError("'limit' must be an integer")
+        if not 1 <= kwargs["Limit"] <= MAX_PAGE_LIMIT:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_LIMIT}")
+
+    if qs_params.get("cursor"):
+        kwargs["ExclusiveStartKey"] = decode_cursor(qs_params["cursor"], cursor_keys)
+        if kwargs["ExclusiveStartKey"].get("contributor_id") != contributor_id:
+            raise ValueError("Invalid cursor")
+
+    return kwargs
+
+
+def read_summaries_page(contributor_id, qs_params):
+    """Return one page of a contributor's title summaries and the cursor for the
+    next page.
+
+    Pages are at most ``limit`` titles (or one 1 MB query page if no limit was
+    passed). The cursor is ``None`` once the last page has been read.
+
+    :param str contributor_id: The contributor that owns the titles
+    :param dict qs_params: Query string parameters with optional 'limit' and
+        'cursor' values
+
+    :rtype: tuple
+    """
+    kwargs = {
+        "IndexName": SUMMARY_INDEX,
+        "KeyConditionExpression": Key("contributor_id").eq(contributor_id),
+        **page_parameters(contributor_id, qs_params, SUMMARY_CURSOR_KEYS),
+    }
+
+    result = get_table().query(**kwargs)
+
+    return (
+        [i["summary"] for i in result["Items"]],
+        encode_cursor(result["LastEvaluatedKey"])
+        if result.get("LastEvaluatedKey")
+        else None,
+    )
+
+
+def encode_cursor(last_evaluated_key):
+    return base64.urlsafe_b64encode(
+        json.dumps(last_evaluated_key, separators=(",", ":")).encode()
+    ).decode()
+
+
+def decode_cursor(cursor, cursor_keys):
+    """Decode a cursor into the start key of a query. Cursors that are not a key
+    with exactly the attributes of the query's keys, all of them strings, are
+    rejected before they reach DynamoDB.
+
+    :raises ValueError: The cursor is not valid
+    """
+    try:
+        start_key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+    if (
+        not isinstance(start_key, dict)
+        or set(start_key) != cursor_keys
+        or not all(isinstance(v, str) for v in start_key.values())
+    ):
+        raise ValueError("Invalid cursor")
+
+    return start_key
+
+
+def definition_response(item, body, request_headers):
+    """Return the full definition of a title item, gzip compressed for clients
+    that accept it. The gzip representation stored at write time by titles
+    without per-version storage is returned as-is; the assembled definition of
+    other titles is compressed for the response.
+
+    The ``ETag`` is the title's content hash, which update requests accept in an
+    ``If-Match`` header.
+    """
+    etag = item.get("content_hash") or content_hash(body)
+
+    if accepts_gzip(request_headers):
+        with phase("Serialize"):
+            if "body_gzip" in item:
+                body_gzip = item["body_gzip"].value
+            else:
+                body_gzip = gzip.compress(body.encode())
+            encoded_body = base64.b64encode(body_gzip).decode()
+        return {
+            "isBase64Encoded": True,
+            "statusCode": 200,
+            "body": encoded_body,
+            "headers": {
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                "ETag": f'"{etag}-gzip"',
+                "Vary": "Accept-Encoding",
+            },
+        }
+
+    return json_response(body, 200, {"ETag": f'"{etag}"', "Vary": "Accept-Encoding"})
@@ -0,0 +1,188 @@
+import base64
+import binascii
+import concurrent.futures
+import functools
+import heapq
+import json
+import logging
+import os
+
+from api_helpers import response
+from boto3.dynamodb.conditions import Key
+from definition_helpers import search_partitions
+from dynamodb_helpers import get_table
+from metrics_helpers import instrumented
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+COMMUNITY_PATCH_TABLE = os.getenv("COMMUNITY_PATCH_TABLE")
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+
+# The table and index keys of a TitleSearch item, which a query resumes from
+INDEX_KEYS = ("contributor_id", "type", "search_index", "title_id")
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=len(search_partitions()))
+
+
+@instrumented
+def lambda_handler(event, context):
+    """Search the titles of all contributors by title ID.
+
+    Query string parameters are optional:
+
+    * ``prefix`` - only return titles whose ID starts with this value
+    * ``limit`` - the maximum number of titles in the page (default 100)
+    * ``cursor`` - the ``next_cursor`` returned with the previous page
+
+    Titles are returned in title ID order with the ID of their contributor.
+    """
+    try:
+        titles, next_cursor = search_titles(event.get("queryStringParameters") or {})
+    except ValueError as error:
+        return response(f"Bad Request: {str(error)}", 400)
+
+    result = {"titles": titles}
+    if next_cursor:
+        result["next_cursor"] = next_cursor
+    return response(result, 200)
+
+
+def search_titles(qs_params):
+    """Return one page of search results and the cursor for the next page.
+
+    Every partition of the ``TitleSearch`` index is queried in parallel for up
+    to ``limit`` titles, and the sorted results are merged. The cursor holds the
+    key to resume each partition from; partitions that have been read to the
+    end are left out of it. The cursor is ``None`` once every partition has
+    been read.
+
+    :param dict qs_params: Query string parameters with optional 'prefix',
+        'limit' and 'cursor' values
+
+    :rtype: tuple
+    """
+    prefix = (qs_params.get("prefix") or "").lower()
+
+    limit = DEFAULT_PAGE_LIMIT
+    if qs_params.get("limit"):
+        try:
+            limit = int(qs_params["limit"])
+        except ValueError:
+            raise ValueError("'limit' must be an integer")
+        if not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise ValueError(f"'limit' must be between 1 and {MAX_PAGE_LIMIT}")
+
+    if qs_params.get("cursor"):
+        start_keys = decode_cursor(qs_params["cursor"])
+    else:
+        start_keys = {i: None for i in search_partitions()}
+
+    partitions = list(start_keys)
+    pages = dict(
+        zip(
+            partitions,
+            get_executor().map(
+                lambda i: query_partition(i, prefix, limit, start_keys[i]),
+                partitions,
+            ),
+        )
+    )
+
+    # A partition with more items than were read limits the merged results to
+    # the titles that sort before its last item
+    bound = min(
+        (
+            items[-1]["title_id"]
+            for items, last_evaluated_key in pages.values()
+            if items and last_evaluated_key
+        ),
+        default=None,
+    )
+
+    titles = list()
+    last_read = dict()
+    for partition, item in heapq.merge(
+        *[[(i, item) for item in pages[i][0]] for i in partitions],
+        key=lambda i: i[1]["title_id"],
+    ):
+        if len(titles) == limit or (bound is not None and item["title_id"] > bound):
+            break
+        titles.append({**item["summary"], "contributor_id": item["contributor_id"]})
+        last_read[partition] = item
+
+    next_start_keys = dict()
+    for partition in partitions:
+        items, last_evaluated_key = pages[partition]
+        if partition in last_read:
+            if last_read[partition] is items[-1] and not last_evaluated_key:
+                continue
+            next_start_keys[partition] = {
+                k: last_read[partition][k] for k in INDEX_KEYS
+            }
+        elif items or last_evaluated_key:
+            next_start_keys[partition] = start_keys[partition]
+
+    return titles, encode_cursor(next_start_keys) if next_start_keys else None
+
+
+def query_partition(partition, prefix, limit, start_key):
+    """Query one partition of the ``TitleSearch`` index.
+
+    :returns: The items read, in title ID order, and the key to continue from
+        if the partition has more items
+    :rtype: tuple
+    """
+    key_condition = Key("search_index").eq(partition)
+    if prefix:
+        key_condition &= Key("title_id").begins_with(prefix)
+
+    kwargs = {
+        "TableName": COMMUNITY_PATCH_TABLE,
+        "IndexName": "TitleSearch",
+        "KeyConditionExpression": key_condition,
+        "Limit": limit,
+    }
+    if start_key:
+        kwargs["ExclusiveStartKey"] = start_key
+
+    # Resources are not thread safe, but their client is
+    result = get_table().meta.client.query(**kwargs)
+    return result["Items"], result.get("LastEvaluatedKey")
+
+
+def encode_cursor(start_keys):
+    return base64.urlsafe_b64encode(
+        json.dumps(start_keys, separators=(",", ":")).encode()
+    ).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        start_keys = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError):
+        raise ValueError("Invalid cursor")
+
+    partitions = search_partitions()
+    if not isinstance(start_keys, dict) or not start_keys:
+        raise ValueError("Invalid cursor")
+
+    for partition, start_key in start_keys.items():
+        if partition not in partitions:
+            raise ValueError("Invalid cursor")
+        if start_key is None:
+            continue
+        if (
+            not isinstance(start_key, dict)
+            or set(start_key) != set(INDEX_KEYS)
+            or not all(isinstance(v, str) for v in start_key.values())
+            or start_key["search_index"] != partition
+        ):
+            raise ValueError("Invalid cursor")
+
+    return start_keys
@@ -2,25 +2,44 @@ from datetime import datetime
 import json
 import logging
 import os
+import random
+import time
 
-import boto3
+from api_helpers import event_body, response
 from botocore.exceptions import ClientError
-from jsonschema import validate, ValidationError
+from definition_helpers import (
+    VersionIndex,
+    chain_hash,
+    content_hash,
+    initial_ranks,
+    is_versioned,
+    ranks_between,
+    read_legacy_body,
+    search_partition,
+    split_definition,
+    version_sort_key,
+)
+from dynamodb_helpers import get_table, retention_key, title_key, version_key
+from metrics_helpers import instrumented, phase, set_property
+from overflow_helpers import (
+    compress_value,
+    discard_overflow,
+    load_value,
+    overflow_value,
+)
+from validation_helpers import get_array_validator, get_validator, validation_errors
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+COMMUNITY_PATCH_TABLE = os.getenv("COMMUNITY_PATCH_TABLE")
 
-def read_schema(schema):
-    with open(f"schemas/{schema}.json", "r") as f_obj:
-        return json.load(f_obj)
-
-
-communitypatchtable = boto3.resource("dynamodb").Table(
-    os.getenv("COMMUNITY_PATCH_TABLE")
-)
+# Writes that lose a race with another request are retried with backoff
+WRITE_MAX_ATTEMPTS = 5
+WRITE_RETRY_BASE_DELAY = 0.05
 
-schema_definition = read_schema("version")
+# A transaction holds at most 100 operations, one of which updates the title
+MAX_VERSIONS_PER_REQUEST = 99
 
 
 class ApiException(Exception):
@@ -39,16 +58,21 @@ class Conflict(ApiException):
     status_code = 409
 
 
+class PreconditionFailed(ApiException):
+    status_code = 412
+
+
+@instrumented
 def lambda_handler(event, context):
     # Not consistent with Cognito auth
     authenticated_claims = event["requestContext"]["authorizer"]
+    contributor_id = authenticated_claims["sub"]
+    title_id = event["pathParameters"]["title_id"]
+    set_property("contributor_id", contributor_id)
+    set_property("title_id", title_id)
 
-    try:
-        current_title_body = read_title(
-            authenticated_claims["sub"], event["pathParameters"]["title_id"]
-        )
-    except KeyError:
-        return response("Not Found", 404)
+    request_headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+    if_match = request_headers.get("if-match")
 
     # ADD VERSION
     if (
@@ -56,29 +80,56 @@ def lambda_handler(event, context):
         and event["httpMethod"] == "POST"
     ):
         try:
-            version_body = json.loads(event["body"])
-        except (TypeError, json.JSONDecodeError):
+            with phase("Parse"):
+                version_body = json.loads(event_body(event))
+        except (TypeError, ValueError):
             logger.exception("Bad Request: No JSON content found")
             return response("Bad Request: No JSON content found", 400)
 
-        try:
-            validate(version_body, schema_definition)
-        except ValidationError as error:
-            validation_error = (
-                f"Validation Error {str(error.message)} "
-                f"for item: {'/'.join([str(i) for i in error.path])}"
-            )
-            logger.error(validation_error)
-            return response(validation_error, 400)
+        # A list of versions, newest first, is added as a block
+        if isinstance(version_body, list):
+            if len(version_body) > MAX_VERSIONS_PER_REQUEST:
+                return response(
+                    "Bad Request: A request may contain at most "
+                    f"{MAX_VERSIONS_PER_REQUEST} versions",
+                    400,
+                )
+            version_bodies = version_body
+            with phase("Validation"):
+                errors = validation_errors(
+                    get_array_validator("version"), version_bodies
+                )
+        else:
+            version_bodies = [version_body]
+            with phase("Validation"):
+                errors = validation_errors(get_validator("version"), version_body)
+
+        if errors:
+            logger.error(f"Validation Error: {errors}")
+            return response({"message": "Validation Error", "errors": errors}, 400)
+
+        new_versions = [i["version"] for i in version_bodies]
+        if len(set(new_versions)) != len(new_versions):
+            return response("Bad Request: The request contains duplicate versions", 400)
 
         try:
-            updated_title_body = add_version(
-                current_title_body, version_body, event["queryStringParameters"]
+            title_item, new_content_hash = update_title(
+                contributor_id,
+                title_id,
+                if_match,
+                lambda item: add_versions(
+                    contributor_id,
+                    item,
+                    version_bodies,
+                    event["queryStringParameters"],
+                ),
             )
-            update_title(authenticated_claims["sub"], updated_title_body)
             return response(
-                f"Version '{version_body['version']}' added to title '{updated_title_body['id']}'",
+                f"{'Versions' if len(new_versions) > 1 else 'Version'} "
+                f"{', '.join(repr(i) for i in new_versions)} "
+                f"added to title '{title_item['summary']['id']}'",
                 201,
+                {"ETag": f'"{new_content_hash}"'},
             )
         except ApiException as error:
             return response(str(error), error.status_code)
@@ -90,148 +141,471 @@ def lambda_handler(event, context):
     ):
         target_version = event["pathParameters"]["version"]
         try:
-            updated_title_body = delete_version(current_title_body, target_version)
-            update_title(authenticated_claims["sub"], updated_title_body)
-            return response(f"Version '{target_version}' deleted from title", 200,)
+            _, new_content_hash = update_title(
+                contributor_id,
+                title_id,
+                if_match,
+                lambda item: delete_version(contributor_id, item, target_version),
+            )
+            return response(
+                f"Version '{target_version}' deleted from title",
+                200,
+                {"ETag": f'"{new_content_hash}"'},
+            )
+        except ApiException as error:
+            return response(str(error), error.status_code)
+
+    # SET RETENTION POLICY
+    elif (
+        event["resource"] == "/v1/titles/{title_id}/retention"
+        and event["httpMethod"] == "PUT"
+    ):
+        try:
+            with phase("Parse"):
+                retention = json.loads(event_body(event))
+        except (TypeError, ValueError):
+            logger.exception("Bad Request: No JSON content found")
+            return response("Bad Request: No JSON content found", 400)
+
+        with phase("Validation"):
+            errors = validation_errors(get_validator("retention"), retention)
+        if errors:
+            logger.error(f"Validation Error: {errors}")
+            return response({"message": "Validation Error", "errors": errors}, 400)
+
+        try:
+            set_retention(contributor_id, title_id, retention)
         except ApiException as error:
             return response(str(error), error.status_code)
 
+        return response(f"Retention policy of title '{title_id}' updated", 200)
+
     else:
         return response("Not Found", 404)
 
 
+def set_retention(contributor_id, title_id, retention):
+    """Set a title's retention policy. Versions beyond the newest
+    ``keep_versions``, or released more than ``keep_days`` ago, are archived once
+    the change is read from the table stream. A limit that is ``null`` is turned
+    off, and one that is left out uses the default.
+
+    The title is listed for the daily retention sweep before its policy is set,
+    so versions age out of titles that are not written again. The sweep removes
+    the entries of titles that no longer exist.
+    """
+    get_table().put_item(Item=retention_key(contributor_id, title_id))
+    try:
+        get_table().update_item(
+            Key=title_key(contributor_id, title_id),
+            UpdateExpression="set retention = :rp",
+            ConditionExpression="attribute_exists(#type)",
+            ExpressionAttributeNames={"#type": "type"},
+            ExpressionAttributeValues={":rp": retention},
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            raise NotFound("Not Found")
+        raise
+
+
+def update_title(contributor_id, title_id, if_match, get_operations):
+    """Apply a change to a title as a transaction that is conditional on the
+    title item's ``revision``.
+
+    If another request changed the title first the title is read again and the
+    change is retried with backoff. Requests with an ``If-Match`` header are not
+    retried: the client asked for the change to apply to the version of the
+    title it has seen.
+
+    :param str if_match: The ``If-Match`` request header, if provided
+    :param get_operations: Returns the transaction operations and the new content
+        hash for a title item
+
+    :returns: The title item the change was applied to and the new content hash
+    :rtype: tuple
+    """
+    for attempt in range(WRITE_MAX_ATTEMPTS):
+        try:
+            title_item = read_title(contributor_id, title_id)
+        except KeyError:
+            raise NotFound("Not Found")
+
+        if not is_versioned(title_item):
+            title_item = migrate_title(contributor_id, title_item)
+
+        if if_match and not etag_matches(if_match, title_item["content_hash"]):
+            raise PreconditionFailed("Precondition Failed: The title has changed")
+
+        operations, new_content_hash = get_operations(title_item)
+        try:
+            write_transaction(*operations)
+            return title_item, new_content_hash
+        except ClientError as error:
+            discard_overflow(transaction_values(operations))
+            if error.response["Error"]["Code"] != "TransactionCanceledException":
+                raise
+
+        if if_match:
+            raise PreconditionFailed("Precondition Failed: The title has changed")
+
+        logger.warning(
+            f"Title changed during update: {title_item['type']} "
+            f"(revision {title_item.get('revision', 0)}, attempt {attempt + 1})"
+        )
+        time.sleep(random.uniform(0, WRITE_RETRY_BASE_DELAY * 2 ** attempt))
+
+    raise Conflict("Conflict: The title is being updated by another request")
+
+
+def etag_matches(if_match, etag):
+    """Whether an ``If-Match`` header matches a title's content hash. The
+    ``-gzip`` entity tags of compressed representations match as well.
+    """
+    for tag in if_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        # If-Match uses the strong comparison, weak entity tags never match
+        if tag.startswith("W/"):
+            continue
+        if tag.strip('"') in (etag, f"{etag}-gzip"):
+            return True
+    return False
+
+
 def read_title(contributor_id, title_id):
-    result = communitypatchtable.get_item(
-        Key={"contributor_id": contributor_id, "type": f"TITLE#{title_id.lower()}"}
+    """Read a title item. For titles with per-version storage this does not
+    include the patches.
+    """
+    result = get_table().get_item(
+        Key=title_key(contributor_id, title_id), ConsistentRead=True
+    )
+    return result["Item"]
+
+
+def migrate_title(contributor_id, title_item):
+    """Convert a title that stores its full definition in one item into a title
+    item and one item per patch version.
+
+    :returns: The updated title item
+    :rtype: dict
+    """
+    body = read_legacy_body(title_item)
+    header, patches = split_definition(json.loads(body))
+    ranks = initial_ranks(len(patches))
+
+    logger.info(f"Migrating title to per-version storage: {title_item['type']}")
+    with get_table().batch_writer() as batch:
+        for patch, rank in zip(patches, ranks):
+            batch.put_item(
+                Item={
+                    **version_key(contributor_id, title_item["title_id"], rank),
+                    "aws_region": os.getenv("AWS_REGION"),
+                    "version": patch["version"],
+                    "patch": overflow_value(
+                        contributor_id,
+                        title_item["title_id"],
+                        compress_value(json.dumps(patch)),
+                    ),
+                }
+            )
+
+    header_value = overflow_value(
+        contributor_id, title_item["title_id"], json.dumps(header)
     )
-    return json.loads(result["Item"]["body"])
+    try:
+        result = get_table().update_item(
+            Key=title_key(contributor_id, title_item["title_id"]),
+            UpdateExpression="set header = :hd, "
+            "versions = :vs, "
+            "search_index = :si, "
+            "content_hash = if_not_exists(content_hash, :ch) "
+            "remove body, body_gzip",
+            ConditionExpression="attribute_not_exists(versions)",
+            ExpressionAttributeValues={
+                ":hd": header_value,
+                ":vs": {p["version"]: r for p, r in zip(patches, ranks)},
+                ":si": search_partition(title_item["title_id"]),
+                ":ch": content_hash(body),
+            },
+            ReturnValues="ALL_NEW",
+        )
+    except ClientError as error:
+        if error.response["Error"]["Code"] == "ConditionalCheckFailedException":
+            # Another request migrated the title first
+            discard_overflow([{"header": header_value}])
+            return read_title(contributor_id, title_item["title_id"])
+        raise
 
+    return result["Attributes"]
 
-def add_version(title_body, version_body, query_string_parameters):
-    if version_body["version"] in [
-        patch_["version"] for patch_ in title_body["patches"]
-    ]:
-        logger.error(f"Conflicting version supplied: '{version_body['version']}'")
-        raise Conflict(f"Conflict: The version '{version_body['version']}' exists")
+
+def add_versions(contributor_id, title_item, version_bodies, query_string_parameters):
+    """Return the transaction that writes new version items and adds them to the
+    title item's ``versions`` map, and the title's new content hash.
+
+    :param list version_bodies: The new versions, newest first. They are placed
+        together at the position given by the query string parameters, or each
+        by version order with ``insert=auto``.
+    """
+    versions = title_item["versions"]
+    new_versions = [i["version"] for i in version_bodies]
+    index = VersionIndex(versions)
+
+    for new_version in new_versions:
+        if new_version in versions:
+            logger.error(f"Conflicting version supplied: '{new_version}'")
+            raise Conflict(f"Conflict: The version '{new_version}' exists")
 
     try:
-        target_index = get_index(query_string_parameters, title_body["patches"])
+        placements = get_placements(query_string_parameters, index, new_versions)
     except ValueError as error:
         raise BadRequest(f"Bad Request: {str(error)}")
 
-    logger.info(f"Updating the definition with new version: {version_body['version']}")
-    title_body["patches"].insert(target_index, version_body)
-
-    # Use the version of the first patch after the insert operation above
-    title_body["currentVersion"] = title_body["patches"][0]["version"]
-    title_body["lastModified"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    new_ranks = dict()
+    for (older, newer), group in placements:
+        new_ranks.update(zip(group, reversed(ranks_between(older, newer, len(group)))))
+    ranks = [new_ranks[i] for i in new_versions]
+    patches = [json.dumps(i) for i in version_bodies]
+
+    current_version = max(
+        list(zip(new_versions, ranks))
+        + ([(index.newest(), versions[index.newest()])] if index else []),
+        key=lambda i: i[1],
+    )[0]
+    new_content_hash = chain_hash(
+        title_item["content_hash"],
+        "add",
+        *[i for change in zip(new_versions, ranks, patches) for i in change],
+    )
 
-    return title_body
+    logger.info(f"Updating the definition with new versions: {new_versions}")
+    operations = [
+        {
+            "Put": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Item": {
+                    **version_key(contributor_id, title_item["title_id"], rank),
+                    "aws_region": os.getenv("AWS_REGION"),
+                    "version": new_version,
+                    "patch": overflow_value(
+                        contributor_id, title_item["title_id"], compress_value(patch)
+                    ),
+                },
+                "ConditionExpression": "attribute_not_exists(#type)",
+                "ExpressionAttributeNames": {"#type": "type"},
+            }
+        }
+        for new_version, rank, patch in zip(new_versions, ranks, patches)
+    ]
+    operations.append(
+        update_title_operation(
+            contributor_id,
+            title_item,
+            current_version,
+            "set "
+            + "".join(f"versions.#v{i} = :r{i}, " for i in range(len(new_versions))),
+            {f"#v{i}": v for i, v in enumerate(new_versions)},
+            {f":r{i}": r for i, r in enumerate(ranks)},
+            new_content_hash,
+        )
+    )
+    return operations, new_content_hash
 
 
-def delete_version(title_body, target_version):
-    index = next(
-        (
-            idx
-            for (idx, d) in enumerate(title_body["patches"])
-            if d["version"] == target_version
-        ),
-        None,
-    )
+def delete_version(contributor_id, title_item, target_version):
+    """Return the transaction that deletes a version item and removes it from the
+    title item's ``versions`` map, and the title's new content hash.
+    """
+    versions = title_item["versions"]
 
-    if index is None:
+    if target_version not in versions:
         raise BadRequest("Not Found")
 
-    if len(title_body["patches"]) < 2:
+    if len(versions) < 2:
         raise BadRequest("A title must contain at least 1 version")
 
+    rank = versions[target_version]
+    current_version = max(
+        [i for i in versions.items() if i[0] != target_version], key=lambda i: i[1]
+    )[0]
+    new_content_hash = chain_hash(
+        title_item["content_hash"], "delete", target_version, rank
+    )
+
     logger.info(f"Removing version from the definition: {target_version}")
-    title_body["patches"].pop(index)
+    operations = [
+        {
+            "Delete": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Key": version_key(contributor_id, title_item["title_id"], rank),
+            }
+        },
+        update_title_operation(
+            contributor_id,
+            title_item,
+            current_version,
+            "remove versions.#version set ",
+            {"#version": target_version},
+            {},
+            new_content_hash,
+        ),
+    ]
+    return operations, new_content_hash
+
+
+def get_placements(qs_params, index, new_versions):
+    """Return where new versions are placed: a list of the ranks on either side
+    of a position and the new versions placed there, newest first.
+
+    With 'insert=auto' each version is placed by version order among the
+    title's versions, so a list of versions can be added in any order. Versions
+    placed at the same position are ordered by version as well. Otherwise all
+    versions are placed together at the position given by 'get_anchors'.
+
+    :param qs_params: Query string parameters
+    :type qs_params: dict or None
+
+    :param VersionIndex index: The versions of the title item
+
+    :rtype: list
+    """
+    if not qs_params or "insert" not in qs_params.keys():
+        return [(get_anchors(qs_params, index), new_versions)]
+
+    if any(i in qs_params.keys() for i in ["insert_after", "insert_before"]):
+        raise ValueError("Conflicting parameters provided")
 
-    # Use the version of the first patch after the delete operation above
-    title_body["currentVersion"] = title_body["patches"][0]["version"]
-    title_body["lastModified"] = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
+    if qs_params["insert"] != "auto":
+        raise ValueError("Unknown insert mode")
 
-    return title_body
+    positions = dict()
+    for new_version in new_versions:
+        positions.setdefault(index.position_by_order(new_version), []).append(
+            new_version
+        )
+
+    return [
+        (index.gap(position), sorted(group, key=version_sort_key, reverse=True))
+        for position, group in positions.items()
+    ]
 
 
-def get_index(qs_params, title_patches):
+def get_anchors(qs_params, index):
     """If 'insert_after' or 'insert_before' were passed as parameters, return
-    the target index for the provided target version.
+    the ranks on either side of the position next to the provided target version.
 
-    If 'params' is 'None' or empty, return 0.
+    If 'params' is 'None' or empty, return the position newer than every version.
 
     :param qs_params: Query string parameters
     :type qs_params: dict or None
 
-    :param list title_patches: The 'patches' array from a definition
+    :param VersionIndex index: The versions of the title item
+
+    :returns: The older and newer rank, either of which may be ``None``
+    :rtype: tuple
     """
-    if not qs_params:
-        return 0
+    if not qs_params or not any(
+        i in qs_params.keys() for i in ["insert_after", "insert_before"]
+    ):
+        return index.gap(0)
 
     if all(i in qs_params.keys() for i in ["insert_after", "insert_before"]):
         raise ValueError("Conflicting parameters provided")
 
-    index = None
-    if any(i in qs_params.keys() for i in ["insert_after", "insert_before"]):
-
-        if qs_params.get("insert_after"):
-            index = (
-                next(
-                    (
-                        idx
-                        for (idx, d) in enumerate(title_patches)
-                        if d["version"] == qs_params.get("insert_after")
-                    ),
-                    None,
-                )
-                + 1
-            )
-
-        elif qs_params.get("insert_before"):
-            index = next(
-                (
-                    idx
-                    for (idx, d) in enumerate(title_patches)
-                    if d["version"] == qs_params.get("insert_before")
-                ),
-                None,
-            )
-
-        else:
-            raise ValueError("Parameter has no value")
+    target_version = qs_params.get("insert_after") or qs_params.get("insert_before")
+    if not target_version:
+        raise ValueError("Parameter has no value")
 
-    if index is None:
+    if target_version not in index:
         raise ValueError("Provided version not found")
 
-    return index
-
+    position = index.position_of(target_version)
 
-def update_title(contributor_id, title_body):
-    communitypatchtable.update_item(
-        Key={
-            "contributor_id": contributor_id,
-            "type": f"TITLE#{title_body['id'].lower()}",
-        },
-        UpdateExpression="set body = :bd, "
-        "summary.currentVersion = :cv, "
-        "summary.lastModified = :lm",
-        ExpressionAttributeValues={
-            ":bd": json.dumps(title_body),
-            ":cv": title_body["currentVersion"],
-            ":lm": title_body["lastModified"],
-        },
-        ReturnValues="UPDATED_NEW",
-    )
+    if qs_params.get("insert_after"):
+        # Newest first: the version after the target is older than it
+        return index.gap(position + 1)
+    else:
+        return index.gap(position)
+
+
+def update_title_operation(
+    contributor_id,
+    title_item,
+    current_version,
+    versions_expression,
+    attribute_names,
+    attribute_values,
+    new_content_hash,
+):
+    """A transaction ``Update`` for the title item that applies a change to the
+    ``versions`` map, refreshes the current version and modified time, moves the
+    title to its search shard, and increments the ``revision``. The update fails
+    if the title item's revision has changed since it was read.
+
+    :param str versions_expression: The start of the update expression that
+        changes the ``versions`` map, ending in an open ``set`` clause followed
+        by a space
+    """
+    last_modified = datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ")
 
+    header = json.loads(load_value(title_item["header"]))
+    header["currentVersion"] = current_version
+    header["lastModified"] = last_modified
 
-def response(message, status_code):
-    if isinstance(message, str):
-        message = {"message": message}
+    # Titles created before revisions were introduced have no revision attribute
+    revision = title_item.get("revision", 0)
+    if revision:
+        condition_expression = "revision = :rev"
+        attribute_values = {**attribute_values, ":rev": revision}
+    else:
+        condition_expression = "attribute_not_exists(revision)"
 
     return {
-        "isBase64Encoded": False,
-        "statusCode": status_code,
-        "body": json.dumps(message),
-        "headers": {"Content-Type": "application/json"},
+        "Update": {
+            "TableName": COMMUNITY_PATCH_TABLE,
+            "Key": title_key(contributor_id, title_item["title_id"]),
+            "UpdateExpression": f"{versions_expression}"
+            "header = :hd, "
+            "content_hash = :ch, "
+            "search_index = :si, "
+            "revision = :next, "
+            "summary.currentVersion = :cv, "
+            "summary.lastModified = :lm",
+            "ConditionExpression": condition_expression,
+            "ExpressionAttributeNames": attribute_names,
+            "ExpressionAttributeValues": {
+                ":hd": overflow_value(
+                    contributor_id, title_item["title_id"], json.dumps(header)
+                ),
+                ":ch": new_content_hash,
+                ":si": search_partition(title_item["title_id"]),
+                ":next": revision + 1,
+                ":cv": current_version,
+                ":lm": last_modified,
+                **attribute_values,
+            },
+        }
     }
+
+
+def transaction_values(operations):
+    """The items and title headers written by a transaction, for deleting the
+    objects of their large values if the transaction fails.
+
+    :rtype: list
+    """
+    values = list()
+    for operation in operations:
+        if "Put" in operation:
+            values.append(operation["Put"]["Item"])
+        elif "Update" in operation:
+            attribute_values = operation["Update"]["ExpressionAttributeValues"]
+            values.append({"header": attribute_values[":hd"]})
+    return values
+
+
+def write_transaction(*operations):
+    # The resource's client serializes attribute values like the Table methods do
+    get_table().meta.client.transact_write_items(TransactItems=list(operations))
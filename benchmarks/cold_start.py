@@ -0,0 +1,183 @@
+"""Import time of every Lambda handler and layer module, as paid on each cold
+start.
+
+Each handler is imported in a fresh interpreter with ``python -X importtime``
+from inside its function directory, with the Lambda layers on the path, the
+same way the Lambda runtime imports it during the init phase. The init cost is
+the wall time of the import. It is split into the modules that took longest to
+import, including their own imports, and the time spent running the handler's
+module level code such as creating clients.
+
+No AWS stand-in is started, so that its imports are not counted: a handler that
+calls an AWS service while it is being imported fails with a connection error.
+
+    python benchmarks/cold_start.py --repeat 5
+    python benchmarks/cold_start.py apis/titles/src/create_title --top 10
+    python benchmarks/cold_start.py src/layers/security_shared/security_helpers.py
+"""
+import argparse
+import glob
+import importlib.util
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+LAYERS = ("src/layers/api_shared", "src/layers/security_shared")
+
+FUNCTION_GLOBS = ("apis/*/src/*", "resources/*/src/*")
+LAYER_MODULE_GLOB = "src/layers/*/*.py"
+
+# Requests to an AWS endpoint made during an import fail immediately
+UNREACHABLE_ENDPOINT = "http://127.0.0.1:9"
+
+# Written to stderr by the child just before the handler is imported
+IMPORT_MARKER = "cold_start: importing handler"
+
+
+def default_targets():
+    handlers = sorted(
+        i
+        for pattern in FUNCTION_GLOBS
+        for i in glob.glob(os.path.join(ROOT, pattern))
+        if os.path.isfile(os.path.join(i, "index.py"))
+    )
+    return handlers + sorted(glob.glob(os.path.join(ROOT, LAYER_MODULE_GLOB)))
+
+
+def import_target(path):
+    """Import a function's handler, or a layer module, in this interpreter and
+    print the wall time in milliseconds. Runs in the child process.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, "index.py")
+
+    os.chdir(os.path.dirname(path))
+    for layer in LAYERS:
+        sys.path.insert(0, os.path.join(ROOT, layer))
+
+    spec = importlib.util.spec_from_file_location(
+        os.path.splitext(os.path.basename(path))[0], path
+    )
+    module = importlib.util.module_from_spec(spec)
+
+    sys.stderr.write(f"{IMPORT_MARKER}\n")
+    sys.stderr.flush()
+
+    start = time.perf_counter()
+    spec.loader.exec_module(module)
+    print((time.perf_counter() - start) * 1000)
+
+
+def child_env():
+    env = dict(os.environ)
+    env.update(
+        {
+            "AWS_DEFAULT_REGION": "us-east-2",
+            "AWS_REGION": "us-east-2",
+            "AWS_ACCESS_KEY_ID": "testing",
+            "AWS_SECRET_ACCESS_KEY": "testing",
+            "AWS_ENDPOINT_URL": UNREACHABLE_ENDPOINT,
+            "AWS_MAX_ATTEMPTS": "1",
+            "AWS_XRAY_SDK_ENABLED": "false",
+            "COMMUNITY_PATCH_TABLE": "communitypatch-benchmark",
+            "DOMAIN_NAME": "communitypatch.local",
+            "NAMESPACE": "benchmark",
+            "PARAM_STORE_PATH": "/communitypatch/benchmark",
+            "PYTHONDONTWRITEBYTECODE": "",
+        }
+    )
+    return env
+
+
+def parse_importtime(stderr):
+    """Return the cumulative import time in milliseconds of every top level
+    import made by the handler, as listed by ``-X importtime``.
+    """
+    imports = dict()
+    _, _, stderr = stderr.partition(IMPORT_MARKER)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        # Nested imports are indented below the module that imported them
+        if name.startswith(" ") and not name.startswith("  "):
+            imports[name.strip()] = int(cumulative) / 1000
+    return imports
+
+
+def measure(path, repeat):
+    init_ms = list()
+    imports = dict()
+
+    for _ in range(repeat):
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", __file__, "--child", path],
+            env=child_env(),
+            capture_output=True,
+            text=True,
+        )
+        if result.returncode:
+            errors = [
+                i
+                for i in result.stderr.splitlines()
+                if not i.startswith("import time:")
+            ]
+            return {"error": errors[-1] if errors else result.returncode}
+
+        init_ms.append(float(result.stdout.strip().splitlines()[-1]))
+        for name, ms in parse_importtime(result.stderr).items():
+            imports.setdefault(name, list()).append(ms)
+
+    imports = {name: statistics.median(ms) for name, ms in imports.items()}
+    return {
+        "init_ms": round(statistics.median(init_ms), 1),
+        "module_code_ms": round(
+            max(0, statistics.median(init_ms) - sum(imports.values())), 1
+        ),
+        "imports_ms": {name: round(ms, 1) for name, ms in imports.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "targets", nargs="*", help="Function directories or layer modules"
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--top", type=int, default=5)
+    parser.add_argument("--child", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        import_target(args.child)
+        return
+
+    paths = [os.path.join(ROOT, i) for i in args.targets] or default_targets()
+
+    for path in paths:
+        result = measure(path, args.repeat)
+        imports = result.pop("imports_ms", {})
+        print(
+            json.dumps(
+                {
+                    "target": os.path.relpath(path, ROOT),
+                    **result,
+                    "slowest_imports_ms": dict(
+                        sorted(imports.items(), key=lambda i: i[1], reverse=True)[
+                            : args.top
+                        ]
+                    ),
+                }
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""Definition item sizes and read latency with large values stored in S3.
+
+Titles with growing patches are created through the ``create_title`` handler
+with values over the overflow threshold stored in the definitions bucket, and
+again with every value kept in its item. For each size the largest title or
+version item written is reported with the number of objects stored, and the
+full definition is read through the titles ``read_titles`` handler with the
+object cache cleared before every call, and again with the cache warm.
+
+Item sizes are the size of the item's JSON, which is close to the size
+DynamoDB bills for. Writes of items over DynamoDB's 400 KB limit fail, which is
+reported as an error. The script exits with an error if a definition read back
+does not match the definition that was written.
+
+    python benchmarks/definition_overflow.py --criteria 10 100 1000 --repeat 20
+"""
+import argparse
+import json
+import sys
+
+import boto3
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+import overflow_helpers
+
+BUCKET_NAME = "communitypatch-benchmark-definitions"
+CONTRIBUTOR_ID = "benchmark-contributor"
+AUTHORIZER = {"authorizer": {"sub": CONTRIBUTOR_ID}}
+
+
+def item_bytes(item):
+    return len(json.dumps(item, default=str).encode())
+
+
+def create(create_title, definition):
+    result = create_title.lambda_handler(
+        {"requestContext": AUTHORIZER, "body": json.dumps(definition)}, None
+    )
+    if result["statusCode"] != 201:
+        raise RuntimeError(result["body"])
+
+
+def read(read_titles, title_id):
+    result = read_titles.lambda_handler(
+        {
+            "requestContext": AUTHORIZER,
+            "resource": "/v1/titles/{title_id}",
+            "httpMethod": "GET",
+            "pathParameters": {"title_id": title_id},
+            "queryStringParameters": None,
+            "headers": {},
+        },
+        None,
+    )
+    assert result["statusCode"] == 200, result
+    return json.loads(result["body"])
+
+
+def uncached_read(read_titles, title_id):
+    overflow_helpers._load_object.cache_clear()
+    return read(read_titles, title_id)
+
+
+def object_count():
+    result = boto3.client("s3").list_objects_v2(Bucket=BUCKET_NAME)
+    return result["KeyCount"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--criteria", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--patches", type=int, default=10)
+    parser.add_argument("--threshold", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    errors = list()
+
+    with local.aws_stand_in():
+        table = local.create_table()
+        local.create_bucket(BUCKET_NAME)
+        create_title = local.load_handler("apis/titles/src/create_title")
+        read_titles = local.load_handler("apis/titles/src/read_titles")
+
+        for criteria_count in args.criteria:
+            for bucket in (BUCKET_NAME, None):
+                overflow_helpers.DEFINITIONS_BUCKET = bucket
+                overflow_helpers.OVERFLOW_THRESHOLD = args.threshold
+
+                title_id = f"Title{criteria_count}{'Overflow' if bucket else ''}"
+                definition = local.definition(title_id, args.patches, criteria_count)
+                result = {
+                    "criteria": criteria_count,
+                    "patches": args.patches,
+                    "definition_bytes": len(json.dumps(definition).encode()),
+                    "overflow": bool(bucket),
+                }
+
+                objects = object_count()
+                try:
+                    create_latencies, _ = local.timed(create, create_title, definition)
+                    create(create_title, {**definition, "id": f"{title_id}Read"})
+                except Exception as error:
+                    result["error"] = str(error)
+                    print(json.dumps(result))
+                    continue
+
+                items = table.query(
+                    KeyConditionExpression="contributor_id = :c and "
+                    "begins_with(#type, :t)",
+                    ExpressionAttributeNames={"#type": "type"},
+                    ExpressionAttributeValues={
+                        ":c": CONTRIBUTOR_ID,
+                        ":t": f"TITLE#{title_id.lower()}read",
+                    },
+                )["Items"]
+
+                uncached, body = local.timed(
+                    uncached_read, read_titles, f"{title_id}Read", repeat=args.repeat
+                )
+                cached, _ = local.timed(
+                    read, read_titles, f"{title_id}Read", repeat=args.repeat
+                )
+                if body != {**definition, "id": f"{title_id}Read"}:
+                    errors.append(f"{title_id}: definition does not match")
+
+                result.update(
+                    create_ms=round(create_latencies[0], 3),
+                    max_item_bytes=max(item_bytes(i) for i in items),
+                    total_item_bytes=sum(item_bytes(i) for i in items),
+                    objects=(object_count() - objects) // 2,
+                    uncached_p50_ms=round(local.percentile(uncached, 50), 3),
+                    cached_p50_ms=round(local.percentile(cached, 50), 3),
+                )
+                print(json.dumps(result))
+
+    if errors:
+        sys.exit(f"Incorrect definitions: {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""Throughput of the table stream to EventBridge publisher.
+
+Titles and versions are written through the Titles API handlers and the
+resulting stream records are passed to the event publisher of
+``resources/regional/src/stream_processor`` in batches of each size. With ``--failure-rate`` a share of the entries in
+every ``PutEvents`` response is reported as throttled, to exercise retries and
+partial batch failures.
+
+    python benchmarks/event_publisher.py --titles 50 --patches 10 --batch-sizes 10 100
+"""
+import argparse
+import json
+import os
+import random
+
+import boto3
+
+import local
+
+CONTRIBUTOR_ID = "benchmark-contributor"
+
+
+def inject_failures(events_client, failure_rate):
+    """Wrap ``put_events`` so a share of the entries fail without being sent."""
+    put_events = events_client.put_events
+    calls = {"requests": 0, "entries": 0}
+
+    def wrapped(Entries):
+        calls["requests"] += 1
+        calls["entries"] += len(Entries)
+
+        failing = [random.random() < failure_rate for _ in Entries]
+        sent = [e for e, f in zip(Entries, failing) if not f]
+        sent_results = iter(put_events(Entries=sent)["Entries"] if sent else [])
+
+        entries = [
+            {"ErrorCode": "ThrottlingException", "ErrorMessage": "Rate exceeded"}
+            if f
+            else next(sent_results)
+            for f in failing
+        ]
+        return {
+            "FailedEntryCount": sum(1 for i in entries if i.get("ErrorCode")),
+            "Entries": entries,
+        }
+
+    events_client.put_events = wrapped
+    return calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=50)
+    parser.add_argument("--patches", type=int, default=10)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    with local.aws_stand_in():
+        table = local.create_table()
+        boto3.client("events").create_event_bus(
+            Name=f"{os.environ['NAMESPACE']}-communitypatch"
+        )
+
+        create_title = local.load_handler("apis/titles/src/create_title")
+        update_title_version = local.load_handler(
+            "apis/titles/src/update_title_version"
+        )
+        stream_processor = local.load_handler("resources/regional/src/stream_processor")
+        stream_processor.PUT_EVENTS_RETRY_BASE_DELAY = 0.01
+        calls = inject_failures(
+            stream_processor.get_events_client(), args.failure_rate
+        )
+
+        for i in range(args.titles):
+            request_context = {"authorizer": {"sub": CONTRIBUTOR_ID}}
+            create_title.lambda_handler(
+                {
+                    "requestContext": request_context,
+                    "body": json.dumps(local.definition(f"title{i:04d}", args.patches)),
+                },
+                None,
+            )
+            update_title_version.lambda_handler(
+                {
+                    "requestContext": request_context,
+                    "resource": "/v1/titles/{title_id}/versions",
+                    "httpMethod": "POST",
+                    "pathParameters": {"title_id": f"title{i:04d}"},
+                    "queryStringParameters": None,
+                    "body": json.dumps(local.version(f"{args.patches + 1}.0.0")),
+                },
+                None,
+            )
+
+        records, _ = local.stream_records(table)
+
+        for batch_size in args.batch_sizes:
+            batches = [
+                records[i : i + batch_size] for i in range(0, len(records), batch_size)
+            ]
+            calls.update(requests=0, entries=0)
+            failures = 0
+            latencies = list()
+
+            for batch in batches:
+                batch_latencies, result = local.timed(
+                    stream_processor.publish_events, batch
+                )
+                latencies.extend(batch_latencies)
+                failures += len(set(result))
+
+            print(
+                json.dumps(
+                    {
+                        "batch_size": batch_size,
+                        "records": len(records),
+                        "failure_rate": args.failure_rate,
+                        "put_events_requests": calls["requests"],
+                        "put_events_entries": calls["entries"],
+                        "batch_item_failures": failures,
+                        "records_per_second": round(
+                            len(records) / (sum(latencies) / 1000), 1
+                        ),
+                        **local.summarize(latencies),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
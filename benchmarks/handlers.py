@@ -0,0 +1,456 @@
+"""Latency, response size and DynamoDB consumed capacity of each API handler.
+
+The table is seeded with ``--contributors`` contributors, each owning
+``--titles`` titles of ``--patches`` patches. Every case then calls one
+handler's ``lambda_handler`` ``--repeat`` times with its own events; any
+set up a case needs, such as titles to delete, is written before it is timed.
+
+Every DynamoDB call made by a handler is sent with ``ReturnConsumedCapacity``
+set to ``TOTAL``, and the units reported are summed for each handler call.
+moto reports a fixed number of units per request, so the units DynamoDB would
+charge are only measured against DynamoDB Local (see the README).
+
+Results are printed as one JSON object per case, labelled with the commit they
+were measured at. Pass the output of an earlier run as ``--baseline`` to add
+the relative change of each metric.
+
+    python benchmarks/handlers.py --titles 25 --patches 5 > before.jsonl
+    python benchmarks/handlers.py --titles 25 --patches 5 --baseline before.jsonl
+"""
+import argparse
+import collections
+import json
+import statistics
+import subprocess
+import threading
+import traceback
+
+import boto3
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+import definition_helpers
+
+CONTRIBUTOR_IDS = "benchmark-contributor-{}"
+
+# Compared against the baseline; lower is better for all of them
+METRICS = ("p50_ms", "p99_ms", "response_bytes", "capacity_units", "dynamodb_requests")
+
+
+class CapacityMeter:
+    """Requests consumed capacity on every DynamoDB call and counts the units
+    and requests made. Handlers may call DynamoDB from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.capacity_units = 0.0
+            self.requests = 0
+
+    def request_capacity(self, params, model, **kwargs):
+        if "ReturnConsumedCapacity" in model.input_shape.members:
+            params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+    def count(self, parsed, **kwargs):
+        consumed = parsed.get("ConsumedCapacity") or []
+        if isinstance(consumed, dict):
+            consumed = [consumed]
+
+        with self.lock:
+            self.requests += 1
+            self.capacity_units += sum(i.get("CapacityUnits", 0) for i in consumed)
+
+    def register(self, events):
+        events.register(
+            "provide-client-params.dynamodb",
+            self.request_capacity,
+            unique_id="handlers-request-capacity",
+        )
+        events.register(
+            "after-call.dynamodb", self.count, unique_id="handlers-count-capacity"
+        )
+
+
+def seed(table, contributor_count, title_count, patch_count):
+    """Write the title and version items of every contributor's titles.
+
+    :returns: The title IDs of each contributor
+    :rtype: dict
+    """
+    title_ids = dict()
+    with table.batch_writer() as batch:
+        for c in range(contributor_count):
+            contributor_id = CONTRIBUTOR_IDS.format(c)
+            title_ids[contributor_id] = [f"Title{i:04d}" for i in range(title_count)]
+
+            for title_id in title_ids[contributor_id]:
+                write_title(batch, contributor_id, title_id, patch_count)
+
+    return title_ids
+
+
+def write_title(batch, contributor_id, title_id, patch_count):
+    definition = local.definition(title_id, patch_count)
+    ranks = definition_helpers.initial_ranks(patch_count)
+
+    batch.put_item(
+        Item=definition_helpers.build_title_item(contributor_id, definition, ranks)
+    )
+    for item in definition_helpers.build_version_items(
+        contributor_id, definition, ranks
+    ):
+        batch.put_item(Item=item)
+
+
+def build_directory(table):
+    """Render the contributor directory from the table stream. Title changes
+    update the contributor entries, whose own changes render the directory.
+    """
+    stream_processor = local.load_handler("resources/regional/src/stream_processor")
+
+    records, iterators = local.stream_records(table)
+    while records:
+        for start in range(0, len(records), 100):
+            stream_processor.contributor_directory.process_records(
+                records[start : start + 100]
+            )
+        records, iterators = local.stream_records(table, iterators)
+
+
+def authorizer_context(contributor_id):
+    return {"requestContext": {"authorizer": {"sub": contributor_id}}}
+
+
+def jamf_event(contributor_id, route, **path_parameters):
+    path = f"/v1/{contributor_id}/{route}"
+    return {
+        "resource": path,
+        "path": path,
+        "pathParameters": {"contributor_id": contributor_id, **path_parameters},
+    }
+
+
+def cases(table, title_ids, args):
+    """Return the name, function directory and event factory of every case.
+
+    An event factory is called once with the number of calls and returns the
+    event of each call.
+    """
+    contributor_id = CONTRIBUTOR_IDS.format(0)
+    titles = title_ids[contributor_id]
+    batch_ids = ",".join(titles[: min(len(titles), 25)])
+
+    def repeated(event):
+        return lambda count: [event] * count
+
+    def create_title(count):
+        return [
+            {
+                **authorizer_context(contributor_id),
+                "body": json.dumps(local.definition(f"New{i:05d}", args.patches)),
+            }
+            for i in range(count)
+        ]
+
+    def add_version(count):
+        return [
+            {
+                **authorizer_context(contributor_id),
+                "resource": "/v1/titles/{title_id}/versions",
+                "httpMethod": "POST",
+                "pathParameters": {"title_id": titles[0]},
+                "queryStringParameters": None,
+                "body": json.dumps(local.version(f"{1000 + i}.0.0")),
+            }
+            for i in range(count)
+        ]
+
+    def batch_update(count):
+        events = list()
+        for i in range(count):
+            operations = list()
+            for title_id in titles[:10]:
+                definition = local.definition(title_id, args.patches)
+                definition["name"] = f"{title_id} {i}"
+                operations.append({"action": "update", "definition": definition})
+            events.append(
+                {
+                    **authorizer_context(contributor_id),
+                    "body": json.dumps({"operations": operations}),
+                }
+            )
+        return events
+
+    def delete_title(count):
+        with table.batch_writer() as batch:
+            for i in range(count):
+                write_title(batch, contributor_id, f"Delete{i:05d}", args.patches)
+        return [
+            {
+                **authorizer_context(contributor_id),
+                "pathParameters": {"title_id": f"Delete{i:05d}"},
+            }
+            for i in range(count)
+        ]
+
+    def create_api_token(count):
+        return [
+            {
+                "requestContext": {"authorizer": {"claims": {"sub": contributor_id}}},
+                "body": json.dumps({"expires_in_days": 1}),
+            }
+            for _ in range(count)
+        ]
+
+    def invalidate_api_token(count):
+        token_ids = [f"benchmark-token-{i}" for i in range(count)]
+        with table.batch_writer() as batch:
+            for token_id in token_ids:
+                batch.put_item(
+                    Item={
+                        "contributor_id": contributor_id,
+                        "type": f"TOKEN#{token_id}",
+                        "token_id": token_id,
+                        "token_secret": token_id,
+                    }
+                )
+        return [
+            {
+                "requestContext": {"authorizer": {"claims": {"sub": contributor_id}}},
+                "pathParameters": {"token_id": token_id},
+            }
+            for token_id in token_ids
+        ]
+
+    def authorizer(algorithm):
+        def make_events(count):
+            # Tokens are issued the way the contributors API issues them
+            create_api_token = local.load_handler(
+                "apis/contributors/src/create_api_token"
+            )
+            create_api_token.API_TOKEN_ALGORITHM = algorithm
+            token = create_api_token.create_api_token(
+                contributor_id, 3600, "titles-api/full_access"
+            )
+            create_api_token.write_token_to_table(contributor_id, token)
+            return [
+                {
+                    "authorizationToken": token["api_token"],
+                    "methodArn": "arn:aws:execute-api:us-east-2:0:api/v1/GET/titles",
+                }
+            ] * count
+
+        return make_events
+
+    return [
+        (
+            "jamf.read_titles.software",
+            "apis/jamf/src/read_titles",
+            repeated(jamf_event(contributor_id, "software")),
+        ),
+        (
+            "jamf.read_titles.software_batch",
+            "apis/jamf/src/read_titles",
+            repeated(
+                jamf_event(contributor_id, f"software/{batch_ids}", title_ids=batch_ids)
+            ),
+        ),
+        (
+            "jamf.read_titles.patch",
+            "apis/jamf/src/read_titles",
+            repeated(
+                jamf_event(contributor_id, f"patch/{titles[-1]}", title_id=titles[-1])
+            ),
+        ),
+        (
+            "jamf.search_titles",
+            "apis/jamf/src/search_titles",
+            repeated({"queryStringParameters": {"q": "title"}}),
+        ),
+        (
+            "titles.read_titles.list",
+            "apis/titles/src/read_titles",
+            repeated({**authorizer_context(contributor_id), "resource": "/v1/titles"}),
+        ),
+        (
+            "titles.read_titles.get",
+            "apis/titles/src/read_titles",
+            repeated(
+                {
+                    **authorizer_context(contributor_id),
+                    "resource": "/v1/titles/{title_id}",
+                    "pathParameters": {"title_id": titles[-1]},
+                }
+            ),
+        ),
+        (
+            "titles.search_titles",
+            "apis/titles/src/search_titles",
+            repeated({"queryStringParameters": {"prefix": "title00"}}),
+        ),
+        ("titles.create_title", "apis/titles/src/create_title", create_title),
+        (
+            "titles.update_title_version.add_version",
+            "apis/titles/src/update_title_version",
+            add_version,
+        ),
+        ("titles.batch_titles.update", "apis/titles/src/batch_titles", batch_update),
+        ("titles.delete_title", "apis/titles/src/delete_title", delete_title),
+        (
+            "titles.authorizer.signed",
+            "apis/titles/src/authorizer",
+            authorizer("RS256"),
+        ),
+        (
+            "titles.authorizer.secret",
+            "apis/titles/src/authorizer",
+            authorizer("HS256"),
+        ),
+        (
+            "contributors.get_contributors",
+            "apis/contributors/src/get_contributors",
+            repeated({"queryStringParameters": None}),
+        ),
+        (
+            "contributors.create_api_token",
+            "apis/contributors/src/create_api_token",
+            create_api_token,
+        ),
+        (
+            "contributors.invalidate_api_token",
+            "apis/contributors/src/invalidate_api_token",
+            invalidate_api_token,
+        ),
+    ]
+
+
+def response_bytes(result):
+    """The size of the body a handler returned, or of the whole result for
+    handlers that do not return an HTTP response.
+    """
+    if isinstance(result, dict) and "statusCode" in result:
+        return len(result.get("body") or "")
+    return len(json.dumps(result))
+
+
+def run_case(handler, events, meter):
+    latencies = list()
+    sizes = list()
+    capacity_units = list()
+    requests = list()
+    statuses = collections.Counter()
+
+    for event in events:
+        meter.reset()
+        call_latencies, result = local.timed(handler.lambda_handler, event, None)
+        latencies.extend(call_latencies)
+        sizes.append(response_bytes(result))
+        capacity_units.append(meter.capacity_units)
+        requests.append(meter.requests)
+        if isinstance(result, dict) and "statusCode" in result:
+            statuses[str(result["statusCode"])] += 1
+
+    return {
+        **local.summarize(latencies),
+        "response_bytes": round(statistics.mean(sizes), 1),
+        "capacity_units": round(statistics.mean(capacity_units), 3),
+        "dynamodb_requests": round(statistics.mean(requests), 3),
+        "status_codes": dict(statuses),
+    }
+
+
+def current_commit():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=local.ROOT,
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def read_baseline(path):
+    with open(path) as f:
+        results = [json.loads(i) for i in f if i.strip()]
+    return {i["case"]: i for i in results if "case" in i}
+
+
+def compare(result, baseline):
+    """Return the relative change of each metric from the baseline."""
+    change = dict()
+    for metric in METRICS:
+        before, after = baseline.get(metric), result.get(metric)
+        if before is None or after is None:
+            continue
+        change[metric] = round((after - before) / before, 3) if before else None
+    return change
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contributors", type=int, default=4)
+    parser.add_argument("--titles", type=int, default=25)
+    parser.add_argument("--patches", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--cases", nargs="+", help="Only run cases whose name starts with a value"
+    )
+    parser.add_argument("--baseline", help="Output of an earlier run to compare with")
+    args = parser.parse_args()
+
+    baseline = read_baseline(args.baseline) if args.baseline else dict()
+    commit = current_commit()
+    meter = CapacityMeter()
+
+    with local.aws_stand_in():
+        # Clients copy the session's event handlers when they are created
+        boto3.setup_default_session()
+        meter.register(boto3.DEFAULT_SESSION.events)
+
+        table = local.create_table()
+        title_ids = seed(table, args.contributors, args.titles, args.patches)
+        build_directory(table)
+        local.create_token_keys()
+
+        stream_processor = local.load_handler("resources/regional/src/stream_processor")
+        records, _ = local.stream_records(table)
+        for start in range(0, len(records), 100):
+            stream_processor.search_indexer.process_records(
+                records[start : start + 100]
+            )
+
+        for name, function_dir, make_events in cases(table, title_ids, args):
+            if args.cases and not any(name.startswith(i) for i in args.cases):
+                continue
+
+            result = {
+                "case": name,
+                "commit": commit,
+                "contributors": args.contributors,
+                "titles": args.titles,
+                "patches": args.patches,
+            }
+            try:
+                handler = local.load_handler(function_dir)
+                result.update(run_case(handler, make_events(args.repeat), meter))
+            except Exception as error:
+                result["error"] = "".join(
+                    traceback.format_exception_only(type(error), error)
+                ).strip()
+
+            if name in baseline and "error" not in result:
+                result["change"] = compare(result, baseline[name])
+
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,376 @@
+"""Synthetic Jamf Pro polling traffic against the Jamf ``read_titles`` handler.
+
+Each simulated Jamf Pro server uses the titles of one contributor and polls
+``/v1/{contributor_id}/software/{title_ids}`` for the titles it subscribes to,
+then ``/v1/{contributor_id}/patch/{title_id}`` for each of them, every
+``--interval`` simulated seconds from a random offset. Contributors, and the
+titles of a contributor that servers subscribe to, are drawn from a Zipf
+distribution with exponent ``--zipf``, so a few of them get most of the traffic.
+
+The polls of ``--duration`` simulated seconds are replayed by ``--workers``
+threads, as fast as they can or at ``--time-scale`` simulated seconds per second.
+Requests call the handler in-process, or with ``--http`` go through a local HTTP
+server that turns them into HTTP API events. With ``--conditional`` servers send
+the ``ETag`` of their last response in ``If-None-Match``.
+
+Latency percentiles are reported by route with the throughput of the replay.
+Every key read from the table is counted, and the share of reads of the hottest
+keys and partitions is reported with their read rate at the simulated schedule.
+moto applies one request at a time; run against DynamoDB Local for concurrent
+reads.
+
+    python benchmarks/jamf_polling_load.py --servers 2000 --interval 300 --workers 16
+"""
+import argparse
+import base64
+import collections
+import http.client
+import http.server
+import itertools
+import json
+import random
+import sys
+import threading
+import time
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+import dynamodb_helpers
+
+
+def zipf_weights(count, exponent):
+    """Cumulative weights of ranks ``1`` to ``count`` under a Zipf distribution."""
+    return list(
+        itertools.accumulate(1 / (rank ** exponent) for rank in range(1, count + 1))
+    )
+
+
+def seed(create_title, contributors, titles, patches):
+    for contributor_id in contributors:
+        for title_id in titles:
+            result = create_title.lambda_handler(
+                {
+                    "requestContext": {"authorizer": {"sub": contributor_id}},
+                    "body": json.dumps(local.definition(title_id, patches)),
+                },
+                None,
+            )
+            if result["statusCode"] != 201:
+                raise RuntimeError(result["body"])
+
+
+def schedule(args, contributors, titles, rng):
+    """Return the requests of every poll in the simulated period, in time order.
+
+    :returns: Tuples of the simulated time, server, route and request path
+    :rtype: list
+    """
+    contributor_weights = zipf_weights(len(contributors), args.zipf)
+    title_weights = zipf_weights(len(titles), args.zipf)
+    subscriptions = min(args.subscriptions, len(titles))
+
+    requests = list()
+    for server in range(args.servers):
+        contributor_id = rng.choices(contributors, cum_weights=contributor_weights)[0]
+        subscribed = set()
+        while len(subscribed) < subscriptions:
+            subscribed.add(rng.choices(titles, cum_weights=title_weights)[0])
+        subscribed = sorted(subscribed)
+
+        start = rng.uniform(0, args.interval)
+        for poll in range(int((args.duration - start) // args.interval) + 1):
+            at = start + poll * args.interval
+            if at >= args.duration:
+                break
+            requests.append(
+                (
+                    at,
+                    server,
+                    "software",
+                    f"/v1/{contributor_id}/software/{','.join(subscribed)}",
+                )
+            )
+            requests.extend(
+                (at, server, "patch", f"/v1/{contributor_id}/patch/{title_id}")
+                for title_id in subscribed
+            )
+
+    requests.sort(key=lambda i: i[0])
+    return requests
+
+
+def event(path, headers):
+    """An HTTP API event for a Jamf route. The ``resource`` of these events is
+    the request path.
+    """
+    _, _, contributor_id, route, *rest = path.split("/", 4)
+    path_parameters = {"contributor_id": contributor_id}
+    if rest and route == "software":
+        path_parameters["title_ids"] = rest[0]
+    elif rest:
+        path_parameters["title_id"] = rest[0]
+
+    return {
+        "resource": path,
+        "path": path,
+        "httpMethod": "GET",
+        "pathParameters": path_parameters,
+        "headers": headers,
+    }
+
+
+class KeyReads:
+    """Counts the table keys read by DynamoDB calls. Queries are counted by
+    their key condition values.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.keys = collections.Counter()
+        self.partitions = collections.Counter()
+
+    def register(self, client):
+        client.meta.events.register("before-call.dynamodb", self.before_call)
+
+    def before_call(self, params, model, **kwargs):
+        body = json.loads(params.get("body") or b"{}")
+        if model.name == "GetItem":
+            keys = [self.key(body["Key"])]
+        elif model.name == "BatchGetItem":
+            keys = [
+                self.key(i)
+                for table in body["RequestItems"].values()
+                for i in table["Keys"]
+            ]
+        elif model.name == "Query":
+            values = [
+                list(i.values())[0]
+                for i in body.get("ExpressionAttributeValues", {}).values()
+            ]
+            index_name = body.get("IndexName")
+            keys = [((index_name + ":" if index_name else "") + values[0], values)]
+        else:
+            return
+
+        with self.lock:
+            for partition, key in keys:
+                self.partitions[partition] += 1
+                self.keys["#".join(key)] += 1
+
+    @staticmethod
+    def key(key):
+        return key["contributor_id"]["S"], [
+            key["contributor_id"]["S"],
+            key["type"]["S"],
+        ]
+
+    def report(self, counter, duration):
+        total = sum(counter.values())
+        ranked = counter.most_common()
+        top = ranked[: max(1, len(ranked) // 100)]
+        return {
+            "distinct": len(ranked),
+            "reads": total,
+            "hottest": ranked[0][0] if ranked else None,
+            "hottest_share": round(ranked[0][1] / total, 4) if ranked else 0,
+            "top_1pct_share": round(sum(i[1] for i in top) / total, 4) if total else 0,
+            "hottest_reads_per_s": round(ranked[0][1] / duration, 3) if ranked else 0,
+        }
+
+
+def serve(handler):
+    """Start an HTTP server on a free local port that passes requests to the
+    handler, with one thread per connection.
+
+    :returns: The server
+    """
+
+    class RequestHandler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            result = handler.lambda_handler(
+                event(self.path, dict(self.headers.items())), None
+            )
+            body = (result.get("body") or "").encode()
+            if result.get("isBase64Encoded"):
+                body = base64.b64decode(body)
+
+            self.send_response(result["statusCode"])
+            for name, value in (result.get("headers") or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), RequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class Replay:
+    """Replays scheduled requests from several worker threads."""
+
+    def __init__(self, args, requests, handler, server=None):
+        self.args = args
+        self.requests = iter(requests)
+        self.handler = handler
+        self.server = server
+        self.lock = threading.Lock()
+        self.etags = dict()
+        self.latencies = collections.defaultdict(list)
+        self.statuses = collections.Counter()
+        self.lateness = list()
+        self.start = None
+
+    def next_request(self):
+        with self.lock:
+            return next(self.requests, None)
+
+    def worker(self):
+        connection = None
+        if self.server:
+            connection = http.client.HTTPConnection(*self.server.server_address)
+
+        while True:
+            request = self.next_request()
+            if not request:
+                break
+            at, server, route, path = request
+
+            if self.args.time_scale:
+                delay = self.start + at / self.args.time_scale - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.lateness.append(max(0.0, -delay) * 1000)
+
+            headers = {}
+            if self.args.conditional and (server, path) in self.etags:
+                headers["If-None-Match"] = self.etags[(server, path)]
+
+            start = time.perf_counter()
+            if connection:
+                connection.request("GET", path, headers=headers)
+                http_response = connection.getresponse()
+                http_response.read()
+                status = http_response.status
+                etag = http_response.getheader("ETag")
+            else:
+                result = self.handler.lambda_handler(event(path, headers), None)
+                status = result["statusCode"]
+                etag = (result.get("headers") or {}).get("ETag")
+            elapsed = (time.perf_counter() - start) * 1000
+
+            self.latencies[route].append(elapsed)
+            self.statuses[status] += 1
+            if etag:
+                self.etags[(server, path)] = etag
+
+        if connection:
+            connection.close()
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.worker) for _ in range(self.args.workers)
+        ]
+        self.start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - self.start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contributors", type=int, default=20)
+    parser.add_argument("--titles", type=int, default=25)
+    parser.add_argument("--patches", type=int, default=5)
+    parser.add_argument("--servers", type=int, default=500)
+    parser.add_argument("--subscriptions", type=int, default=5)
+    parser.add_argument("--zipf", type=float, default=1.1)
+    parser.add_argument("--interval", type=float, default=300)
+    parser.add_argument("--duration", type=float, default=900)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--time-scale", type=float, default=0)
+    parser.add_argument("--conditional", action="store_true")
+    parser.add_argument("--http", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    contributors = [f"contributor{i:03d}" for i in range(args.contributors)]
+    titles = [f"title{i:03d}" for i in range(args.titles)]
+
+    with local.aws_stand_in():
+        local.create_table()
+        seed(
+            local.load_handler("apis/titles/src/create_title"),
+            contributors,
+            titles,
+            args.patches,
+        )
+        handler = local.load_handler("apis/jamf/src/read_titles")
+
+        key_reads = KeyReads()
+        key_reads.register(dynamodb_helpers.get_dynamodb().meta.client)
+
+        requests = schedule(args, contributors, titles, rng)
+        server = serve(handler) if args.http else None
+        replay = Replay(args, requests, handler, server)
+        try:
+            elapsed = replay.run()
+        finally:
+            if server:
+                server.shutdown()
+
+    latencies = [i for route in replay.latencies.values() for i in route]
+    for route, route_latencies in sorted(replay.latencies.items()):
+        print(
+            json.dumps(
+                {
+                    "measure": "latency",
+                    "route": route,
+                    **local.summarize(route_latencies),
+                }
+            )
+        )
+
+    print(
+        json.dumps(
+            {
+                "measure": "throughput",
+                "requests": len(latencies),
+                "elapsed_s": round(elapsed, 3),
+                "requests_per_s": round(len(latencies) / elapsed, 1),
+                "offered_per_s": round(len(requests) / args.duration, 1),
+                "statuses": {str(k): v for k, v in sorted(replay.statuses.items())},
+                **local.summarize(latencies),
+                **(
+                    {"late_p99_ms": round(local.percentile(replay.lateness, 99), 3)}
+                    if replay.lateness
+                    else {}
+                ),
+            }
+        )
+    )
+
+    for measure, counter in (
+        ("key_reads", key_reads.keys),
+        ("partition_reads", key_reads.partitions),
+    ):
+        print(
+            json.dumps({"measure": measure, **key_reads.report(counter, args.duration)})
+        )
+
+    errors = sum(v for k, v in replay.statuses.items() if k >= 400)
+    if errors:
+        sys.exit(f"{errors} requests failed")
+
+
+if __name__ == "__main__":
+    main()
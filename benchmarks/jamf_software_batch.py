@@ -0,0 +1,94 @@
+"""Latency of the Jamf ``/software/{title_ids}`` route against the number of
+requested titles.
+
+Compares the previous one-query-per-title lookup with the ``BatchGetItem`` read
+path in ``apis/jamf/src/read_titles``.
+
+    python benchmarks/jamf_software_batch.py --counts 1 10 30 60 100 --repeat 20
+"""
+import argparse
+import json
+
+from boto3.dynamodb.conditions import Key
+
+import local
+
+CONTRIBUTOR_ID = "benchmark-contributor"
+
+
+def seed(table, count):
+    with table.batch_writer() as batch:
+        for i in range(count):
+            title_id = f"title{i:04d}"
+            batch.put_item(
+                Item={
+                    "contributor_id": CONTRIBUTOR_ID,
+                    "type": f"TITLE#{title_id}",
+                    "search_index": "TITLE",
+                    "title_id": title_id,
+                    "body": json.dumps(local.definition(title_id)),
+                    "summary": {
+                        "id": title_id,
+                        "name": title_id,
+                        "publisher": "CommunityPatch",
+                        "currentVersion": "1.0.0",
+                        "lastModified": "2020-01-01T00:00:00Z",
+                    },
+                }
+            )
+
+
+def query_per_title(table, title_ids):
+    results = list()
+    for i in title_ids:
+        query_result = table.query(
+            IndexName="ContributorSummaries",
+            KeyConditionExpression=Key("contributor_id").eq(CONTRIBUTOR_ID)
+            & Key("title_id").eq(i),
+        )
+        if query_result.get("Items"):
+            results.append(query_result["Items"][0]["summary"])
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1, 10, 30, 60, 100])
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with local.aws_stand_in():
+        table = local.create_table()
+        seed(table, max(args.counts))
+        handler = local.load_handler("apis/jamf/src/read_titles")
+
+        for count in args.counts:
+            title_ids = [f"title{i:04d}" for i in range(count)]
+            path = f"/v1/{CONTRIBUTOR_ID}/software/{','.join(title_ids)}"
+            event = {
+                "resource": path,
+                "path": path,
+                "pathParameters": {
+                    "contributor_id": CONTRIBUTOR_ID,
+                    "title_ids": ",".join(title_ids),
+                },
+            }
+
+            baseline, _ = local.timed(
+                query_per_title, table, title_ids, repeat=args.repeat
+            )
+            batched, result = local.timed(
+                handler.lambda_handler, event, None, repeat=args.repeat
+            )
+            assert [i["id"] for i in json.loads(result["body"])] == title_ids
+
+            for name, latencies in (("query", baseline), ("batch_get", batched)):
+                print(
+                    json.dumps(
+                        {"titles": count, "method": name, **local.summarize(latencies)}
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+"""Render Jamf feeds from the table stream into S3 and compare serving them from
+the bucket with reading them from the table.
+
+Titles are created through the ``create_title`` handler, the resulting stream
+records are passed to the stream processor's ``feed_renderer`` and the Jamf
+``read_titles`` handler is timed with and without ``FEEDS_BUCKET`` set.
+
+    python benchmarks/jamf_static_feeds.py --titles 50 --patches 20 --repeat 20
+"""
+import argparse
+import json
+import os
+
+import local
+
+CONTRIBUTOR_ID = "benchmark-contributor"
+FEEDS_BUCKET = "communitypatch-benchmark-jamf-feeds"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, default=50)
+    parser.add_argument("--patches", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with local.aws_stand_in():
+        table = local.create_table()
+        local.create_bucket(FEEDS_BUCKET)
+        os.environ["FEEDS_BUCKET"] = FEEDS_BUCKET
+
+        create_title = local.load_handler("apis/titles/src/create_title")
+        stream_processor = local.load_handler("resources/regional/src/stream_processor")
+        from_bucket = local.load_handler("apis/jamf/src/read_titles", "jamf_s3")
+        os.environ["FEEDS_BUCKET"] = ""
+        from_table = local.load_handler("apis/jamf/src/read_titles", "jamf_table")
+
+        for i in range(args.titles):
+            result = create_title.lambda_handler(
+                {
+                    "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+                    "body": json.dumps(
+                        local.definition(f"title{i:04d}", args.patches)
+                    ),
+                },
+                None,
+            )
+            assert result["statusCode"] == 201, result
+
+        records, _ = local.stream_records(table)
+        latencies, _ = local.timed(
+            stream_processor.feed_renderer.process_records, records
+        )
+        print(
+            json.dumps(
+                {"operation": "render", "records": len(records), **local.summarize(latencies)}
+            )
+        )
+
+        routes = {
+            "software": (f"/v1/{CONTRIBUTOR_ID}/software", {}),
+            "patch": (
+                f"/v1/{CONTRIBUTOR_ID}/patch/title0000",
+                {"title_id": "title0000"},
+            ),
+        }
+        for route, (path, parameters) in routes.items():
+            event = {
+                "resource": path,
+                "path": path,
+                "pathParameters": {"contributor_id": CONTRIBUTOR_ID, **parameters},
+                "headers": {"accept-encoding": "gzip"},
+            }
+            responses = dict()
+            for source, handler in (("table", from_table), ("bucket", from_bucket)):
+                latencies, responses[source] = local.timed(
+                    handler.lambda_handler, event, None, repeat=args.repeat
+                )
+                print(
+                    json.dumps(
+                        {
+                            "operation": route,
+                            "source": source,
+                            "bytes": len(responses[source]["body"]),
+                            **local.summarize(latencies),
+                        }
+                    )
+                )
+
+            # The table path does not compress the /software document
+            assert responses["table"]["headers"]["ETag"].replace(
+                "-gzip", ""
+            ) == responses["bucket"]["headers"]["ETag"].replace("-gzip", ""), route
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,348 @@
+"""Helpers for running CommunityPatch handlers in-process against local stand-ins
+for AWS services.
+
+By default the stand-ins are provided by ``moto``. Set ``AWS_ENDPOINT_URL`` (or a
+service specific variable such as ``AWS_ENDPOINT_URL_DYNAMODB``) to run against
+DynamoDB Local or another emulator instead.
+"""
+import contextlib
+import importlib.util
+import os
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TABLE_NAME = "communitypatch-benchmark"
+
+# Lambda layers are importable from every function
+LAYERS = ("src/layers/api_shared", "src/layers/security_shared")
+
+for layer in LAYERS:
+    sys.path.insert(0, os.path.join(ROOT, layer))
+
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-2")
+os.environ.setdefault("AWS_REGION", os.environ["AWS_DEFAULT_REGION"])
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("COMMUNITY_PATCH_TABLE", TABLE_NAME)
+os.environ.setdefault("DOMAIN_NAME", "communitypatch.local")
+os.environ.setdefault("NAMESPACE", "benchmark")
+os.environ.setdefault("PARAM_STORE_PATH", "/communitypatch/benchmark/")
+os.environ.setdefault("AWS_XRAY_SDK_ENABLED", "false")
+# Benchmarks print their own results; handler metrics are not written unless asked
+os.environ.setdefault("METRICS_SAMPLE_RATE", "0")
+
+
+@contextlib.contextmanager
+def aws_stand_in():
+    """Start the ``moto`` mock unless an emulator endpoint has been configured."""
+    if any(k.startswith("AWS_ENDPOINT_URL") for k in os.environ):
+        yield
+        return
+
+    from unittest import mock
+
+    from moto import mock_aws
+    from moto.core.botocore_stubber import BotocoreStubber
+
+    # AWS applies each request atomically. moto does not when handlers are called
+    # from several threads, so requests are passed to it one at a time.
+    lock = threading.Lock()
+    handle_request = BotocoreStubber.__call__
+
+    def atomic_request(self, *args, **kwargs):
+        with lock:
+            return handle_request(self, *args, **kwargs)
+
+    with mock_aws(), mock.patch.object(BotocoreStubber, "__call__", atomic_request):
+        yield
+
+
+def load_handler(function_dir, module_name=None):
+    """Import the ``index.py`` of a function directory as a new module.
+
+    Handlers read files relative to the Lambda task root, so the import runs from
+    inside the function directory, with the directory on the path for the
+    modules the handler imports from it. The validators for the function's schemas,
+    which handlers build on first use, are built during the import for the same
+    reason.
+
+    :param str function_dir: Path to the function relative to the repository root
+    :param str module_name: Name to register the module under
+
+    :returns: The imported handler module
+    """
+    path = os.path.join(ROOT, function_dir)
+    module_name = module_name or function_dir.replace("/", ".")
+
+    spec = importlib.util.spec_from_file_location(
+        module_name, os.path.join(path, "index.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+
+    cwd = os.getcwd()
+    os.chdir(path)
+    sys.path.insert(0, path)
+    try:
+        spec.loader.exec_module(module)
+
+        if os.path.isdir("schemas"):
+            from validation_helpers import get_validator
+
+            for schema in os.listdir("schemas"):
+                get_validator(os.path.splitext(schema)[0])
+    finally:
+        sys.path.remove(path)
+        os.chdir(cwd)
+
+    sys.modules[module_name] = module
+    return module
+
+
+def create_table(table_name=TABLE_NAME):
+    """Create the CommunityPatch table as defined in ``resources/global/tables.yaml``.
+
+    :returns: The boto3 ``Table`` resource
+    """
+    import boto3
+
+    def gsi(name, hash_key, range_key, non_key_attributes):
+        return {
+            "IndexName": name,
+            "KeySchema": [
+                {"AttributeName": hash_key, "KeyType": "HASH"},
+                {"AttributeName": range_key, "KeyType": "RANGE"},
+            ],
+            "Projection": {
+                "ProjectionType": "INCLUDE",
+                "NonKeyAttributes": non_key_attributes,
+            },
+        }
+
+    table = boto3.resource("dynamodb").create_table(
+        TableName=table_name,
+        BillingMode="PAY_PER_REQUEST",
+        AttributeDefinitions=[
+            {"AttributeName": i, "AttributeType": "S"}
+            for i in ("contributor_id", "type", "search_index", "title_id", "alias")
+        ],
+        KeySchema=[
+            {"AttributeName": "contributor_id", "KeyType": "HASH"},
+            {"AttributeName": "type", "KeyType": "RANGE"},
+        ],
+        GlobalSecondaryIndexes=[
+            gsi("ContributorSummaries", "contributor_id", "title_id", ["summary"]),
+            gsi(
+                "ContributorTitleSummaries",
+                "contributor_id",
+                "title_id",
+                ["summary", "content_hash"],
+            ),
+            gsi(
+                "TitleSearch",
+                "search_index",
+                "title_id",
+                ["contributor_id", "summary"],
+            ),
+            gsi("ContributorAliasLookup", "type", "alias", ["contributor_id"]),
+        ],
+        StreamSpecification={
+            "StreamEnabled": True,
+            "StreamViewType": "NEW_AND_OLD_IMAGES",
+        },
+    )
+    table.wait_until_exists()
+    return table
+
+
+def stream_records(table, shard_iterators=None):
+    """Return new records from the table's stream in the format of a Lambda event
+    source mapping, along with the iterators to pass on the next call.
+
+    :param table: boto3 ``Table`` resource with a stream enabled
+    :param dict shard_iterators: Iterators returned from a previous call
+
+    :rtype: tuple
+    """
+    import boto3
+
+    streams_client = boto3.client("dynamodbstreams")
+    stream_arn = table.latest_stream_arn
+
+    if shard_iterators is None:
+        shard_iterators = {
+            shard["ShardId"]: streams_client.get_shard_iterator(
+                StreamArn=stream_arn,
+                ShardId=shard["ShardId"],
+                ShardIteratorType="TRIM_HORIZON",
+            )["ShardIterator"]
+            for shard in streams_client.describe_stream(StreamArn=stream_arn)[
+                "StreamDescription"
+            ]["Shards"]
+        }
+
+    records = list()
+    next_iterators = dict()
+    for shard_id, iterator in shard_iterators.items():
+        result = streams_client.get_records(ShardIterator=iterator)
+        for record in result["Records"]:
+            record["eventSourceARN"] = stream_arn
+            # Lambda passes the creation time as seconds since the epoch
+            created = record["dynamodb"].get("ApproximateCreationDateTime")
+            if created is not None and hasattr(created, "timestamp"):
+                record["dynamodb"]["ApproximateCreationDateTime"] = int(
+                    created.timestamp()
+                )
+            records.append(record)
+        next_iterators[shard_id] = result.get("NextShardIterator", iterator)
+
+    return records, next_iterators
+
+
+def create_bucket(bucket_name):
+    import boto3
+
+    boto3.client("s3").create_bucket(
+        Bucket=bucket_name,
+        CreateBucketConfiguration={
+            "LocationConstraint": os.environ["AWS_DEFAULT_REGION"]
+        },
+    )
+    return bucket_name
+
+
+def create_token_keys():
+    """Store a new RSA key pair for signing API tokens in parameter store, as
+    ``security_helpers`` reads it.
+    """
+    import base64
+
+    import boto3
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    private_key = rsa.generate_private_key(
+        public_exponent=65537, key_size=2048, backend=default_backend()
+    )
+    keys = {
+        "token_private_key": private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption(),
+        ),
+        "token_public_key": private_key.public_key().public_bytes(
+            serialization.Encoding.PEM,
+            serialization.PublicFormat.SubjectPublicKeyInfo,
+        ),
+    }
+
+    ssm_client = boto3.client("ssm")
+    for name, pem in keys.items():
+        ssm_client.put_parameter(
+            Name=os.path.join(os.environ["PARAM_STORE_PATH"], name),
+            Value=base64.b64encode(pem).decode(),
+            Type="SecureString",
+        )
+
+
+def definition(title_id, patch_count=1, criteria_count=1):
+    """Return a synthetic patch definition that passes the ``full_definition``
+    schema.
+
+    :param str title_id: The definition ``id``
+    :param int patch_count: Number of patches, newest first
+    :param int criteria_count: Number of criteria on each patch component
+    """
+    patches = [
+        version(f"{patch_count - i}.0.0", criteria_count) for i in range(patch_count)
+    ]
+    return {
+        "id": title_id,
+        "name": title_id,
+        "publisher": "CommunityPatch",
+        "appName": f"{title_id}.app",
+        "bundleId": f"dev.communitypatch.{title_id}",
+        "lastModified": "2020-01-01T00:00:00Z",
+        "currentVersion": patches[0]["version"] if patches else "0.0.0",
+        "requirements": [
+            {
+                "name": "Application Bundle ID",
+                "operator": "is",
+                "value": f"dev.communitypatch.{title_id}",
+                "type": "recon",
+                "and": True,
+            }
+        ],
+        "patches": patches,
+        "extensionAttributes": [],
+    }
+
+
+def version(version_string, criteria_count=1):
+    """Return a synthetic patch that passes the ``version`` schema."""
+    return {
+        "version": version_string,
+        "releaseDate": "2020-01-01T00:00:00Z",
+        "standalone": True,
+        "minimumOperatingSystem": "10.13",
+        "reboot": False,
+        "killApps": [],
+        "components": [
+            {
+                "name": "Component",
+                "version": version_string,
+                "criteria": [
+                    {
+                        "name": "Application Version",
+                        "operator": "is",
+                        "value": version_string,
+                        "type": "recon",
+                        "and": True,
+                    }
+                ]
+                * criteria_count,
+            }
+        ],
+        "capabilities": [
+            {
+                "name": "Operating System Version",
+                "operator": "greater than or equal",
+                "value": "10.13",
+                "type": "recon",
+            }
+        ],
+    }
+
+
+def timed(func, *args, repeat=1, **kwargs):
+    """Call ``func`` ``repeat`` times and return the per-call latencies in
+    milliseconds along with the last result.
+    """
+    latencies = list()
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return latencies, result
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of values."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies):
+    """Return a dictionary of latency statistics in milliseconds."""
+    return {
+        "count": len(latencies),
+        "mean_ms": round(statistics.mean(latencies), 3),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+    }
@@ -0,0 +1,56 @@
+"""Schema validation time for definitions of increasing size.
+
+Compares calling ``jsonschema.validate()`` on every request, which checks the
+schema and builds a new validator each time, with the validators shared by the
+``api_shared`` layer.
+
+    python benchmarks/schema_validation.py --patches 1 10 100 500 --criteria 5
+"""
+import argparse
+import json
+
+import jsonschema
+
+import local
+from validation_helpers import get_validator, schema_path, validation_errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--patches", type=int, nargs="+", default=[1, 10, 100, 500])
+    parser.add_argument("--criteria", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    with open(schema_path("full_definition")) as f_obj:
+        schema = json.load(f_obj)
+
+    validator = get_validator("full_definition")
+
+    for patch_count in args.patches:
+        instance = local.definition("benchmark", patch_count, args.criteria)
+        size = len(json.dumps(instance))
+
+        per_request, _ = local.timed(
+            jsonschema.validate, instance, schema, repeat=args.repeat
+        )
+        shared, errors = local.timed(
+            validation_errors, validator, instance, repeat=args.repeat
+        )
+        assert not errors, errors
+
+        for name, latencies in (("validate", per_request), ("shared", shared)):
+            print(
+                json.dumps(
+                    {
+                        "patches": patch_count,
+                        "bytes": size,
+                        "method": name,
+                        **local.summarize(latencies),
+                    }
+                )
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Title search cost against the number of indexed titles.
+
+Title items are written directly to the table, and the table stream is passed
+to ``search_indexer`` to build the search index. A fixed set of queries is then
+run through the Jamf ``search_titles`` handler with its result cache cleared
+before every call, and again with the cache warm. For comparison the same
+queries are answered by scanning the table for titles whose name contains the
+query, which is what a search without an index has to do.
+
+The cost of a search in DynamoDB follows the number of items it reads, which
+is reported for each query. The local stand-in sorts the whole table for every
+query, so its latencies grow with the table either way. The script exits with
+an error if a search does not return the expected titles.
+
+    python benchmarks/search_index.py --titles 50 200 500 --repeat 5
+"""
+import argparse
+import json
+import random
+import sys
+
+import boto3
+from boto3.dynamodb.conditions import Attr
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+import definition_helpers
+
+CONTRIBUTOR_IDS = [f"benchmark-contributor-{i}" for i in range(4)]
+
+WORDS = [
+    "acrobat",
+    "atlas",
+    "beacon",
+    "cascade",
+    "compass",
+    "delta",
+    "ember",
+    "falcon",
+    "harbor",
+    "horizon",
+    "lumen",
+    "meridian",
+    "nimbus",
+    "orbit",
+    "pioneer",
+    "quartz",
+    "summit",
+    "tundra",
+    "vertex",
+    "zenith",
+]
+PUBLISHERS = ["Acme Software", "Globex", "Initech", "Umbrella Labs", "Vandelay"]
+
+
+class ItemsRead:
+    """Counts the items read by ``Query`` and ``Scan`` calls."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, parsed, **kwargs):
+        self.count += parsed.get("ScannedCount", 0)
+
+
+def title_definition(index, rng):
+    name = " ".join(rng.sample(WORDS, 2)).title()
+    definition = local.definition(f"Title{index:05d}")
+    definition.update(
+        name=f"{name} {index}",
+        publisher=rng.choice(PUBLISHERS),
+        appName=f"{name.replace(' ', '')}.app",
+        bundleId=f"com.benchmark.title{index:05d}",
+    )
+    return definition
+
+
+def build_index(table, search_indexer, definitions):
+    with table.batch_writer() as batch:
+        for index, definition in enumerate(definitions):
+            batch.put_item(
+                Item=definition_helpers.build_title_item(
+                    CONTRIBUTOR_IDS[index % len(CONTRIBUTOR_IDS)], definition, [1]
+                )
+            )
+
+    records, iterators = local.stream_records(table)
+    while records:
+        # The stream event source mapping delivers batches of up to 100 records
+        for start in range(0, len(records), 100):
+            search_indexer.process_records(records[start : start + 100])
+        records, iterators = local.stream_records(table, iterators)
+
+
+def search(search_titles, query, limit):
+    result = search_titles.lambda_handler(
+        {"queryStringParameters": {"q": query, "limit": str(limit)}}, None
+    )
+    assert result["statusCode"] == 200, result
+    return json.loads(result["body"])["titles"]
+
+
+def uncached_search(search_titles, query, limit):
+    search_titles.cached_search.cache_clear()
+    return search(search_titles, query, limit)
+
+
+def items_read(items_read_counter, func, *args):
+    """Return the number of items read by one call of ``func``."""
+    items_read_counter.count = 0
+    func(*args)
+    return items_read_counter.count
+
+
+def scan_search(table, query, limit):
+    """Return up to ``limit`` titles whose name contains the query."""
+    titles = list()
+    kwargs = {
+        "FilterExpression": Attr("type").begins_with("TITLE#")
+        & Attr("summary.name").contains(query)
+    }
+    while len(titles) < limit:
+        result = table.scan(**kwargs)
+        titles.extend(i["summary"] for i in result["Items"])
+        if "LastEvaluatedKey" not in result:
+            break
+        kwargs["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+    return titles[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--titles", type=int, nargs="+", default=[50, 200, 500])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--limit", type=int, default=25)
+    args = parser.parse_args()
+
+    errors = list()
+    items_read_counter = ItemsRead()
+
+    with local.aws_stand_in():
+        # Clients copy the session's event handlers when they are created
+        boto3.setup_default_session()
+        for operation in ("Query", "Scan"):
+            boto3.DEFAULT_SESSION.events.register(
+                f"after-call.dynamodb.{operation}", items_read_counter
+            )
+
+        for title_count in args.titles:
+            rng = random.Random(title_count)
+            definitions = [title_definition(i, rng) for i in range(title_count)]
+
+            table = local.create_table()
+            search_indexer = local.load_handler(
+                "resources/regional/src/stream_processor"
+            ).search_indexer
+            search_titles = local.load_handler("apis/jamf/src/search_titles")
+            build_index(table, search_indexer, definitions)
+
+            # One title by its bundle ID, and a common word with a second word
+            target = definitions[title_count // 2]
+            queries = {
+                "bundle_id": (target["bundleId"], [target["id"]]),
+                "words": (
+                    target["name"].split()[0] + " " + target["name"].split()[1][:3],
+                    None,
+                ),
+            }
+
+            result = {"titles": title_count}
+            for label, (query, expected) in queries.items():
+                uncached, found = local.timed(
+                    uncached_search,
+                    search_titles,
+                    query,
+                    args.limit,
+                    repeat=args.repeat,
+                )
+                cached, _ = local.timed(
+                    search, search_titles, query, args.limit, repeat=args.repeat
+                )
+                scanned, _ = local.timed(
+                    scan_search, table, query, args.limit, repeat=args.repeat
+                )
+
+                found_ids = [i["id"] for i in found]
+                if expected is not None and found_ids != expected:
+                    errors.append(f"{title_count} titles: {query!r} found {found_ids}")
+                if target["id"] not in found_ids and len(found) < args.limit:
+                    errors.append(
+                        f"{title_count} titles: {query!r} missed {target['id']}"
+                    )
+                if [i["score"] for i in found] != sorted(
+                    (i["score"] for i in found), reverse=True
+                ):
+                    errors.append(f"{title_count} titles: {query!r} out of rank order")
+
+                result[f"{label}_results"] = len(found)
+                result[f"{label}_items_read"] = items_read(
+                    items_read_counter,
+                    uncached_search,
+                    search_titles,
+                    query,
+                    args.limit,
+                )
+                result[f"{label}_scan_items_read"] = items_read(
+                    items_read_counter, scan_search, table, query, args.limit
+                )
+                result[f"{label}_uncached_p50_ms"] = round(
+                    local.percentile(uncached, 50), 3
+                )
+                result[f"{label}_cached_p50_ms"] = round(
+                    local.percentile(cached, 50), 3
+                )
+                result[f"{label}_scan_p50_ms"] = round(local.percentile(scanned, 50), 3)
+
+            print(json.dumps(result))
+
+            table.delete()
+            table.wait_until_not_exists()
+
+    if errors:
+        sys.exit(f"Incorrect search results: {errors}")
+
+
+if __name__ == "__main__":
+    main()
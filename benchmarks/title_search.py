@@ -0,0 +1,186 @@
+"""Title write throughput and search latency against the number of TitleSearch
+shards.
+
+DynamoDB limits the write throughput of every partition key of an index (1,000
+writes of up to 1 KB per second). The benchmark models the limit by delaying
+writes of title items so that no ``search_index`` value receives more than
+``--key-writes-per-second``; the default is scaled down so that the local
+stand-in is not the bottleneck. Titles are created through ``create_title`` by
+parallel writers, then paged through and searched by prefix with
+``search_titles``. The script exits with an error if a search does not return
+exactly the expected titles in order.
+
+    python benchmarks/title_search.py --shards 1 2 4 8 16 --titles 300 --writers 16
+"""
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+
+import boto3
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+import definition_helpers
+
+CONTRIBUTOR_IDS = [f"benchmark-contributor-{i}" for i in range(4)]
+
+
+class KeyWriteLimit:
+    """Delays writes so each ``search_index`` value is written at most
+    ``writes_per_second`` times a second.
+    """
+
+    def __init__(self, writes_per_second):
+        self.interval = 1 / writes_per_second
+        self.next_write = collections.defaultdict(float)
+        self.lock = threading.Lock()
+
+    def __call__(self, params, **kwargs):
+        # The request has been serialized when the before-call event is emitted
+        item = json.loads(params["body"]).get("Item", {})
+        search_index = item.get("search_index", {}).get("S")
+        if not search_index:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_write[search_index])
+            self.next_write[search_index] = start + self.interval
+
+        time.sleep(start - now)
+
+
+def create_titles(create_title, title_ids, writers):
+    pending = list(title_ids)
+    lock = threading.Lock()
+
+    def writer():
+        while True:
+            with lock:
+                if not pending:
+                    return
+                title_id = pending.pop()
+            result = create_title.lambda_handler(
+                {
+                    "requestContext": {
+                        "authorizer": {
+                            "sub": CONTRIBUTOR_IDS[
+                                int(title_id[5:]) % len(CONTRIBUTOR_IDS)
+                            ]
+                        }
+                    },
+                    "body": json.dumps(local.definition(title_id)),
+                },
+                None,
+            )
+            assert result["statusCode"] == 201, result
+
+    threads = [threading.Thread(target=writer) for _ in range(writers)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+
+def search(search_titles, **params):
+    result = search_titles.lambda_handler(
+        {"queryStringParameters": {k: str(v) for k, v in params.items()}}, None
+    )
+    assert result["statusCode"] == 200, result
+    return json.loads(result["body"])
+
+
+def page_through(search_titles, limit, prefix=None):
+    """Read every page of a search and return the title IDs and page latencies."""
+    title_ids = list()
+    latencies = list()
+    params = {"limit": limit}
+    if prefix:
+        params["prefix"] = prefix
+
+    while True:
+        page_latencies, page = local.timed(search, search_titles, **params)
+        latencies.extend(page_latencies)
+        title_ids.extend(i["id"] for i in page["titles"])
+
+        if "next_cursor" not in page:
+            return title_ids, latencies
+        params["cursor"] = page["next_cursor"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--titles", type=int, default=300)
+    parser.add_argument("--writers", type=int, default=16)
+    parser.add_argument("--key-writes-per-second", type=float, default=20)
+    parser.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    title_ids = [f"title{i:05d}" for i in range(args.titles)]
+    prefix = title_ids[-1][:-2]
+    errors = list()
+
+    with local.aws_stand_in():
+        for shard_count in args.shards:
+            table = local.create_table()
+            boto3.DEFAULT_SESSION.events.register(
+                "before-call.dynamodb.PutItem",
+                KeyWriteLimit(args.key_writes_per_second),
+                unique_id="title-search-key-write-limit",
+            )
+            definition_helpers.SEARCH_SHARD_COUNT = shard_count
+
+            # Handlers create their clients on first use, after the limit has
+            # been registered
+            create_title = local.load_handler("apis/titles/src/create_title")
+            search_titles = local.load_handler("apis/titles/src/search_titles")
+
+            elapsed = create_titles(create_title, title_ids, args.writers)
+
+            found, page_latencies = page_through(search_titles, args.limit)
+            if found != title_ids:
+                errors.append(f"{shard_count} shards: listed {len(found)} titles")
+
+            prefix_found, prefix_latencies = page_through(
+                search_titles, args.limit, prefix
+            )
+            if prefix_found != [i for i in title_ids if i.startswith(prefix)]:
+                errors.append(f"{shard_count} shards: prefix search mismatch")
+
+            print(
+                json.dumps(
+                    {
+                        "shards": shard_count,
+                        "titles": args.titles,
+                        "writers": args.writers,
+                        "key_writes_per_second": args.key_writes_per_second,
+                        "titles_per_second": round(args.titles / elapsed, 1),
+                        "list_pages": len(page_latencies),
+                        "list_p50_ms": round(local.percentile(page_latencies, 50), 3),
+                        "prefix_p50_ms": round(
+                            local.percentile(prefix_latencies, 50), 3
+                        ),
+                    }
+                )
+            )
+
+            boto3.DEFAULT_SESSION.events.unregister(
+                "before-call.dynamodb.PutItem",
+                unique_id="title-search-key-write-limit",
+            )
+            table.delete()
+            table.wait_until_not_exists()
+
+    if errors:
+        sys.exit(f"Incorrect search results: {errors}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Concurrent version writes to one title through ``update_title_version``.
+
+Parallel writers each add their own versions to the same title. Every version
+acknowledged with a ``201`` must be in the definition afterwards and the title's
+revision must count every write; the script exits with an error if any update
+was lost.
+
+With ``--if-match`` the writers do their own compare-and-swap: they read the
+title, send its ``ETag`` in ``If-Match`` and read again after a ``412``.
+
+    python benchmarks/version_concurrency.py --writers 8 --versions 10
+"""
+import argparse
+import collections
+import json
+import sys
+import threading
+import time
+
+import local
+
+CONTRIBUTOR_ID = "benchmark-contributor"
+TITLE_ID = "ConcurrentTitle"
+
+
+def event(resource, method, body=None, headers=None):
+    return {
+        "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+        "resource": resource,
+        "httpMethod": method,
+        "pathParameters": {"title_id": TITLE_ID},
+        "queryStringParameters": None,
+        "headers": headers or {},
+        "body": body,
+    }
+
+
+def read_title(read_titles):
+    result = read_titles.lambda_handler(event("/v1/titles/{title_id}", "GET"), None)
+    return json.loads(result["body"]), result["headers"]["ETag"]
+
+
+def add_version(update_title_version, read_titles, version_string, if_match):
+    body = json.dumps(local.version(version_string))
+
+    while True:
+        headers = {}
+        if if_match:
+            headers["If-Match"] = read_title(read_titles)[1]
+
+        result = update_title_version.lambda_handler(
+            event("/v1/titles/{title_id}/versions", "POST", body, headers), None
+        )
+        if not (if_match and result["statusCode"] == 412):
+            return result["statusCode"]
+
+
+def writer(modules, writer_id, args, barrier, statuses, latencies):
+    barrier.wait()
+    for i in range(args.versions):
+        start = time.perf_counter()
+        status = add_version(*modules, f"2.{writer_id}.{i}", args.if_match)
+        latencies.append((time.perf_counter() - start) * 1000)
+        statuses[status].append(f"2.{writer_id}.{i}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--writers", type=int, default=8)
+    parser.add_argument("--versions", type=int, default=10)
+    parser.add_argument("--if-match", action="store_true")
+    args = parser.parse_args()
+
+    with local.aws_stand_in():
+        table = local.create_table()
+        create_title = local.load_handler("apis/titles/src/create_title")
+        read_titles = local.load_handler("apis/titles/src/read_titles")
+        update_title_version = local.load_handler(
+            "apis/titles/src/update_title_version"
+        )
+
+        create_title.lambda_handler(
+            {
+                "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+                "body": json.dumps(local.definition(TITLE_ID)),
+            },
+            None,
+        )
+
+        barrier = threading.Barrier(args.writers)
+        statuses = collections.defaultdict(list)
+        latencies = list()
+        threads = [
+            threading.Thread(
+                target=writer,
+                args=(
+                    (update_title_version, read_titles),
+                    i,
+                    args,
+                    barrier,
+                    statuses,
+                    latencies,
+                ),
+            )
+            for i in range(args.writers)
+        ]
+
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        definition, _ = read_title(read_titles)
+        title_item = table.get_item(
+            Key={"contributor_id": CONTRIBUTOR_ID, "type": f"TITLE#{TITLE_ID.lower()}"}
+        )["Item"]
+
+    stored = {i["version"] for i in definition["patches"]}
+    lost = [i for i in statuses[201] if i not in stored]
+
+    print(
+        json.dumps(
+            {
+                "writers": args.writers,
+                "versions": args.writers * args.versions,
+                "if_match": args.if_match,
+                "statuses": {k: len(v) for k, v in sorted(statuses.items())},
+                "stored": len(stored) - 1,
+                "revision": int(title_item["revision"]),
+                "lost": len(lost),
+                "writes_per_second": round(len(statuses[201]) / elapsed, 1),
+                **local.summarize(latencies),
+            }
+        )
+    )
+
+    if (
+        lost
+        or len(stored) - 1 != len(statuses[201])
+        or int(title_item["revision"]) != 1 + len(statuses[201])
+    ):
+        sys.exit(f"Lost updates: {lost}")
+
+
+if __name__ == "__main__":
+    main()
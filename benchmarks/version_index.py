@@ -0,0 +1,253 @@
+"""Version placement cost against the number of versions of a title.
+
+Titles with long version histories are indexed in memory. The time to find the
+position next to an existing version (``insert_after``) and to place a new
+version by version order (``insert=auto``) is compared with sorting the ranks
+and scanning them. A request builds the ``VersionIndex`` of its title's
+``versions`` map, so the time of a request is the build plus one lookup; the
+lookup alone is the cost of each further version in a request that adds several.
+The versions are then added through the ``update_title_version`` handler for
+each insertion mode against titles of a smaller size.
+
+The script exits with an error if a version placed by version order is not
+between the versions that sort on either side of it.
+
+    python benchmarks/version_index.py --versions 1000 10000 100000 --repeat 200
+"""
+
+import argparse
+import json
+import random
+import sys
+
+import local
+
+# The layers are on the path once ``local`` has been imported
+from definition_helpers import (
+    VersionIndex,
+    initial_ranks,
+    sorted_ranks,
+    version_sort_key,
+)
+
+CONTRIBUTOR_ID = "benchmark-contributor"
+MODES = {
+    "newest": lambda existing: None,
+    "insert_after": lambda existing: {"insert_after": random.choice(existing)},
+    "auto": lambda existing: {"insert": "auto"},
+}
+
+
+def version_string(number):
+    return f"{number // 100}.{number % 100}.0"
+
+
+def versions_map(count):
+    """A ``versions`` map of ``count`` versions ranked in version order."""
+    ranks = initial_ranks(count)
+    return {version_string(count - 1 - i): rank for i, rank in enumerate(ranks)}
+
+
+def scan_anchors(versions, target):
+    ranks = sorted_ranks(versions)
+    index = ranks.index(versions[target])
+    return ranks[index + 1] if index + 1 < len(ranks) else None, ranks[index]
+
+
+def scan_position(versions, version):
+    key = version_sort_key(version)
+    order = sorted(versions, key=versions.get, reverse=True)
+    return next(
+        (i for i, v in enumerate(order) if version_sort_key(v) < key), len(order)
+    )
+
+
+def placement(update_title_version, index, version):
+    return update_title_version.get_placements({"insert": "auto"}, index, [version])
+
+
+def request_anchors(update_title_version, versions, target):
+    """Index a ``versions`` map and find the position next to a version, as a
+    request does.
+    """
+    return update_title_version.get_anchors(
+        {"insert_after": target}, VersionIndex(versions)
+    )
+
+
+def request_placement(update_title_version, versions, version):
+    """Index a ``versions`` map and place a version by version order, as a
+    request does.
+    """
+    return placement(update_title_version, VersionIndex(versions), version)
+
+
+def in_memory(update_title_version, count, repeat, errors):
+    versions = versions_map(count)
+    numbers = [random.randrange(count) for _ in range(repeat)]
+
+    build, index = local.timed(VersionIndex, versions, repeat=min(repeat, 20))
+    anchors = list()
+    requested_anchors = list()
+    scanned_anchors = list()
+    auto = list()
+    requested_auto = list()
+    scanned_auto = list()
+
+    for number in numbers:
+        target = version_string(number)
+        latencies, _ = local.timed(
+            update_title_version.get_anchors, {"insert_after": target}, index
+        )
+        anchors.extend(latencies)
+        latencies, _ = local.timed(scan_anchors, versions, target)
+        scanned_anchors.extend(latencies)
+
+        # Sorts after the target and before the next version
+        new_version = f"{target[:-2]}.5"
+        latencies, result = local.timed(
+            placement, update_title_version, index, new_version
+        )
+        auto.extend(latencies)
+        older = versions[target]
+        newer = versions.get(version_string(number + 1))
+        if result != [((older, newer), [new_version])]:
+            errors.append(f"{new_version} placed at {result[0][0]}")
+
+        # Requests and scans sort every version, so fewer of them are timed
+        if len(scanned_auto) < 20:
+            latencies, _ = local.timed(
+                request_anchors, update_title_version, versions, target
+            )
+            requested_anchors.extend(latencies)
+            latencies, _ = local.timed(
+                request_placement, update_title_version, versions, new_version
+            )
+            requested_auto.extend(latencies)
+            latencies, _ = local.timed(scan_position, versions, new_version)
+            scanned_auto.extend(latencies)
+
+    return {
+        "versions": count,
+        "build_p50_ms": round(local.percentile(build, 50), 3),
+        "insert_after_lookup_p50_ms": round(local.percentile(anchors, 50), 4),
+        "insert_after_p50_ms": round(local.percentile(requested_anchors, 50), 4),
+        "insert_after_scan_p50_ms": round(local.percentile(scanned_anchors, 50), 4),
+        "auto_lookup_p50_ms": round(local.percentile(auto, 50), 4),
+        "auto_p50_ms": round(local.percentile(requested_auto, 50), 4),
+        "auto_scan_p50_ms": round(local.percentile(scanned_auto, 50), 4),
+    }
+
+
+def add_version(update_title_version, title_id, version, query_string_parameters):
+    result = update_title_version.lambda_handler(
+        {
+            "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+            "resource": "/v1/titles/{title_id}/versions",
+            "httpMethod": "POST",
+            "pathParameters": {"title_id": title_id},
+            "queryStringParameters": query_string_parameters,
+            "headers": {},
+            "body": json.dumps(local.version(version)),
+        },
+        None,
+    )
+    if result["statusCode"] != 201:
+        raise RuntimeError(result["body"])
+
+
+def read_versions(read_titles, title_id):
+    result = read_titles.lambda_handler(
+        {
+            "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+            "resource": "/v1/titles/{title_id}",
+            "httpMethod": "GET",
+            "pathParameters": {"title_id": title_id},
+            "queryStringParameters": None,
+            "headers": {},
+        },
+        None,
+    )
+    return [i["version"] for i in json.loads(result["body"])["patches"]]
+
+
+def through_handler(modules, count, repeat, errors):
+    create_title, read_titles, update_title_version = modules
+    result = {"versions": count}
+
+    for mode, parameters in MODES.items():
+        title_id = f"Title{count}{mode.title().replace('_', '')}"
+        definition = local.definition(title_id, count)
+        response = create_title.lambda_handler(
+            {
+                "requestContext": {"authorizer": {"sub": CONTRIBUTOR_ID}},
+                "body": json.dumps(definition),
+            },
+            None,
+        )
+        if response["statusCode"] != 201:
+            raise RuntimeError(response["body"])
+
+        existing = [i["version"] for i in definition["patches"]]
+        latencies = list()
+        for i in range(repeat):
+            if mode == "newest":
+                version = f"{count + 1 + i}.0.0"
+            else:
+                version = f"{random.randrange(1, count + 1)}.0.{i + 1}"
+            elapsed, _ = local.timed(
+                add_version,
+                update_title_version,
+                title_id,
+                version,
+                parameters(existing),
+            )
+            latencies.extend(elapsed)
+
+        result[f"{mode}_p50_ms"] = round(local.percentile(latencies, 50), 3)
+        result[f"{mode}_p99_ms"] = round(local.percentile(latencies, 99), 3)
+
+        if mode == "auto":
+            versions = read_versions(read_titles, title_id)
+            keys = [version_sort_key(i) for i in versions]
+            if keys != sorted(keys, reverse=True):
+                errors.append(f"{title_id}: versions are not in version order")
+
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--versions", type=int, nargs="+", default=[1000, 10000, 100000]
+    )
+    parser.add_argument("--handler-versions", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--handler-repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    random.seed(0)
+    errors = list()
+
+    with local.aws_stand_in():
+        local.create_table()
+        modules = (
+            local.load_handler("apis/titles/src/create_title"),
+            local.load_handler("apis/titles/src/read_titles"),
+            local.load_handler("apis/titles/src/update_title_version"),
+        )
+
+        for count in args.versions:
+            result = in_memory(modules[2], count, args.repeat, errors)
+            print(json.dumps({"measure": "in_memory", **result}))
+
+        for count in args.handler_versions:
+            result = through_handler(modules, count, args.handler_repeat, errors)
+            print(json.dumps({"measure": "handler", **result}))
+
+    if errors:
+        sys.exit(f"Incorrect placements: {errors[:10]}")
+
+
+if __name__ == "__main__":
+    main()
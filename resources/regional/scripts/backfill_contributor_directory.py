@@ -0,0 +1,43 @@
+"""Recompute every entry of the contributor directory from the titles in the table.
+
+The stream processor sets a contributor's title count from their titles each
+time one changes, so contributors whose titles have not changed since it was
+deployed keep the count of the earlier entries. This recomputes all of them and
+writes the directory. Entries replicate with the rest of the table, so it only
+needs to run against one region.
+
+    python resources/regional/scripts/backfill_contributor_directory.py --table communitypatch-table --region us-east-2
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.dirname(
+    os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+)
+
+# The stream processor and its layer, as they are laid out in the function
+PATHS = ("src/layers/api_shared", "resources/regional/src/stream_processor")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--table", required=True)
+    parser.add_argument("--region")
+    args = parser.parse_args()
+
+    # The table name is read by the helpers when they are imported
+    os.environ["COMMUNITY_PATCH_TABLE"] = args.table
+    if args.region:
+        os.environ["AWS_DEFAULT_REGION"] = args.region
+
+    for path in PATHS:
+        sys.path.insert(0, os.path.join(ROOT, path))
+
+    from processors import contributor_directory
+
+    print(f"Updated {contributor_directory.backfill()} directory entries")
+
+
+if __name__ == "__main__":
+    main()
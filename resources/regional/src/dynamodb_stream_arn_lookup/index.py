@@ -1,9 +1,13 @@
+import functools
 import json
 
 import boto3
 import requests
 
-client = boto3.client("dynamodb")
+
+@functools.lru_cache(maxsize=None)
+def get_dynamodb_client():
+    return boto3.client("dynamodb")
 
 
 def lambda_handler(event, context):
@@ -12,7 +16,7 @@ def lambda_handler(event, context):
     if event["RequestType"] != "Delete":
         try:
             table_name = event["ResourceProperties"]["TableName"]
-            response = client.describe_table(TableName=table_name)
+            response = get_dynamodb_client().describe_table(TableName=table_name)
             stream_arn = response["Table"]["LatestStreamArn"]
         except Exception as error:
             cfnresponse(
@@ -1,33 +1,353 @@
 from datetime import datetime
+import functools
 import json
+import logging
 import os
+import random
+import time
 
 import boto3
+from botocore.exceptions import ClientError
+from definition_helpers import is_versioned, read_legacy_body
+from dynamodb_helpers import deserialize
+from processors import (
+    contributor_directory,
+    feed_renderer,
+    overflow_cleanup,
+    search_indexer,
+    version_archiver,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
 
 EVENT_BUS = f"{os.getenv('NAMESPACE')}-communitypatch"
 
-events_client = boto3.client("events")
+# PutEvents accepts at most 10 entries and 256 KB per request
+PUT_EVENTS_MAX_ENTRIES = 10
+PUT_EVENTS_MAX_BYTES = 256 * 1024
+
+PUT_EVENTS_MAX_ATTEMPTS = 5
+PUT_EVENTS_RETRY_BASE_DELAY = 0.1
+
+# A table stream supports about two concurrent readers per shard, so everything
+# that consumes the stream runs in this function with the event publisher rather
+# than from an event source mapping of its own
+PROCESSORS = (
+    feed_renderer,
+    contributor_directory,
+    search_indexer,
+    version_archiver,
+    overflow_cleanup,
+)
+
+
+@functools.lru_cache(maxsize=None)
+def get_events_client():
+    return boto3.client("events")
 
 
 def lambda_handler(event, context):
-    events_to_put = []
-
-    for record in event["Records"]:
-        print(f"Event: {record['eventName']}/{record['eventID']}")
-        table_arn, _ = record["eventSourceARN"].split("/stream")
-        events_to_put.append(
-            {
-                "Time": datetime.utcnow(),
-                "Source": "communitypatch.table",
-                "Resources": [table_arn],
-                "DetailType": "Table Change",
-                "Detail": json.dumps(record),
-                "EventBusName": EVENT_BUS,
-            }
+    """Process a batch of table stream records: pass them to each of the
+    ``PROCESSORS``, then publish their domain events.
+
+    Every processor returns the sequence numbers of the records it could not
+    process, and a processor that raises fails the whole batch. They are
+    reported as batch item failures, so the event source mapping retries the
+    batch from the first failed record; every processor handles records it has
+    seen before the same way.
+
+    Only the events of records before the first failed record are published, so
+    the events of a record are published once, when it has been processed. The
+    events of a publish that partly fails can be published again when the batch
+    is retried; their ``idempotency_key`` is the same, and consumers drop
+    duplicates by it.
+    """
+    records = event["Records"]
+    failed = list()
+
+    for processor in PROCESSORS:
+        try:
+            failed.extend(processor.process_records(records))
+        except Exception:
+            logger.exception(f"Unable to process records: {processor.__name__}")
+            failed.append(records[0]["dynamodb"]["SequenceNumber"])
+
+    if failed:
+        first_failed = min(int(i) for i in failed)
+        records = [
+            i for i in records if int(i["dynamodb"]["SequenceNumber"]) < first_failed
+        ]
+    failed.extend(publish_events(records))
+
+    return {
+        "batchItemFailures": [
+            {"itemIdentifier": i} for i in sorted(set(failed), key=int)
+        ]
+    }
+
+
+def sweep_handler(event, context):
+    """Run the retention sweep of the version archiver on a schedule."""
+    return {"archived": version_archiver.sweep()}
+
+
+def publish_events(records):
+    """Publish domain events for the changes in a batch of table stream records.
+
+    Each record is decoded once and classified by its ``type`` key. Events carry
+    only what changed, not the item images:
+
+    * ``TitleCreated``, ``TitleUpdated``, ``TitleDeleted``
+    * ``VersionAdded``, ``VersionRemoved`` (one per version)
+    * ``TokenCreated``, ``TokenRevoked``
+
+    Other records produce no events. Every event has the ``event_id`` of its
+    record and an ``idempotency_key`` that is the same each time the record is
+    published.
+
+    Entries that cannot be published after retrying are reported as batch item
+    failures so the event source mapping retries the batch from the first failed
+    record instead of the whole batch.
+
+    :returns: The sequence numbers of the records whose events were not published
+    :rtype: list
+    """
+    entries = list()
+
+    for record in records:
+        for entry in build_entries(record):
+            entries.append((record["dynamodb"]["SequenceNumber"], entry))
+
+    failed = publish(entries)
+
+    if failed:
+        logger.error(f"Unable to publish {len(failed)} of {len(entries)} events")
+
+    return failed
+
+
+def build_entries(record):
+    table_arn, _ = record["eventSourceARN"].split("/stream")
+    created = record["dynamodb"].get("ApproximateCreationDateTime")
+
+    entries = list()
+    for index, (detail_type, detail) in enumerate(domain_events(record)):
+        logger.info(f"Event: {detail_type} ({record['eventID']})")
+        entry = {
+            "Time": (
+                datetime.utcfromtimestamp(created) if created else datetime.utcnow()
+            ),
+            "Source": "communitypatch.table",
+            "Resources": [table_arn],
+            "DetailType": detail_type,
+            "Detail": json.dumps(
+                {
+                    **detail,
+                    "event_id": record["eventID"],
+                    "idempotency_key": f"{record['eventID']}:{index}",
+                }
+            ),
+            "EventBusName": EVENT_BUS,
+        }
+
+        if entry_size(entry) > PUT_EVENTS_MAX_BYTES:
+            logger.error(f"Event exceeds the size limit and was dropped: {entry}")
+            continue
+
+        entries.append(entry)
+
+    return entries
+
+
+def domain_events(record):
+    """Classify a stream record as domain events.
+
+    :returns: ``(detail_type, detail)`` pairs
+    :rtype: list
+    """
+    keys = deserialize(record["dynamodb"]["Keys"])
+    new_image = deserialize(record["dynamodb"].get("NewImage", {}))
+    old_image = deserialize(record["dynamodb"].get("OldImage", {}))
+    item_type, _, item_id = keys["type"].partition("#")
+
+    # Version items are reported through the change to their title item
+    if "#" in item_id:
+        return []
+
+    if item_type == "TITLE":
+        return title_events(record["eventName"], keys, new_image, old_image)
+    elif item_type == "TOKEN":
+        return token_events(record, keys, new_image, old_image)
+    return []
+
+
+def title_events(event_name, keys, new_image, old_image):
+    image = new_image or old_image
+    title = {
+        "contributor_id": keys["contributor_id"],
+        "title_id": image.get("summary", {}).get("id", keys["type"][6:]),
+    }
+    if image.get("aws_region"):
+        title["aws_region"] = image["aws_region"]
+
+    if event_name == "INSERT":
+        return [
+            (
+                "TitleCreated",
+                {
+                    **title,
+                    "summary": new_image["summary"],
+                    "versions": title_versions(new_image),
+                },
+            )
+        ]
+    elif event_name == "REMOVE":
+        return [("TitleDeleted", title)]
+
+    new_versions = title_versions(new_image)
+    old_versions = title_versions(old_image)
+    added = [i for i in new_versions if i not in set(old_versions)]
+    removed = [i for i in old_versions if i not in set(new_versions)]
+
+    # Archived versions are no longer served but have not been removed. The
+    # archiver only removes versions from the map with the update that counts
+    # them as archived.
+    archived = list()
+    if new_image.get("archived_count", 0) > old_image.get("archived_count", 0):
+        archived, removed = removed, []
+    current = {
+        "currentVersion": new_image["summary"]["currentVersion"],
+        "lastModified": new_image["summary"]["lastModified"],
+    }
+
+    events = (
+        [("VersionAdded", {**title, "version": i, **current}) for i in added]
+        + [("VersionRemoved", {**title, "version": i, **current}) for i in removed]
+        + [("VersionArchived", {**title, "version": i, **current}) for i in archived]
+    )
+
+    # Titles migrated to per-version storage get a content hash without changing
+    if not events and (
+        old_image.get("content_hash") not in (None, new_image.get("content_hash"))
+        or new_image["summary"] != old_image["summary"]
+    ):
+        events.append(("TitleUpdated", {**title, "summary": new_image["summary"]}))
+
+    return events
+
+
+def title_versions(title_item):
+    """The versions of a title item, newest first."""
+    if is_versioned(title_item):
+        return [
+            version
+            for version, _ in sorted(
+                title_item["versions"].items(), key=lambda i: i[1], reverse=True
+            )
+        ]
+    elif "body" in title_item or "body_gzip" in title_item:
+        title_body = json.loads(read_legacy_body(title_item))
+        return [i["version"] for i in title_body["patches"]]
+    return []
+
+
+def token_events(record, keys, new_image, old_image):
+    token = {"contributor_id": keys["contributor_id"], "token_id": keys["type"][6:]}
+
+    if record["eventName"] == "INSERT":
+        return [("TokenCreated", {**token, "expires": int(new_image["ttl"])})]
+    elif record["eventName"] == "REMOVE":
+        # Items removed by TTL are deleted by the DynamoDB service principal
+        principal = record.get("userIdentity", {}).get("principalId")
+        expired = principal == "dynamodb.amazonaws.com"
+        return [("TokenRevoked", {**token, "expired": expired})]
+    return []
+
+
+def entry_size(entry):
+    """The size of an entry as counted against the ``PutEvents`` request limit.
+
+    See https://docs.aws.amazon.com/eventbridge/latest/userguide/eb-putevent-size.html
+    """
+    size = 14  # Time
+    for key in ("Source", "DetailType", "Detail"):
+        size += len(entry[key].encode())
+    for resource in entry.get("Resources", []):
+        size += len(resource.encode())
+    return size
+
+
+def chunk_entries(entries):
+    """Split ``(identifier, entry)`` pairs into ``PutEvents`` requests that are
+    within the entry count and size limits, preserving their order.
+    """
+    chunk = list()
+    chunk_size = 0
+
+    for item in entries:
+        size = entry_size(item[1])
+        if chunk and (
+            len(chunk) == PUT_EVENTS_MAX_ENTRIES
+            or chunk_size + size > PUT_EVENTS_MAX_BYTES
+        ):
+            yield chunk
+            chunk = list()
+            chunk_size = 0
+
+        chunk.append(item)
+        chunk_size += size
+
+    if chunk:
+        yield chunk
+
+
+def publish(entries):
+    """Publish ``(identifier, entry)`` pairs, retrying failed entries with
+    backoff.
+
+    :returns: The identifiers of the entries that could not be published
+    :rtype: list
+    """
+    pending = entries
+
+    for attempt in range(PUT_EVENTS_MAX_ATTEMPTS):
+        if attempt:
+            time.sleep(random.uniform(0, PUT_EVENTS_RETRY_BASE_DELAY * 2 ** attempt))
+
+        failed = list()
+        for chunk in chunk_entries(pending):
+            failed.extend(put_events(chunk))
+
+        if not failed:
+            return []
+
+        logger.warning(
+            f"{len(failed)} events failed (attempt {attempt + 1}): "
+            f"{sorted({i[2] for i in failed})}"
         )
+        pending = [i[:2] for i in failed]
+
+    return [i[0] for i in pending]
+
+
+def put_events(chunk):
+    """Send one ``PutEvents`` request.
+
+    :returns: The ``(identifier, entry, error_code)`` of every failed entry
+    :rtype: list
+    """
+    try:
+        result = get_events_client().put_events(Entries=[i[1] for i in chunk])
+    except ClientError as error:
+        logger.exception("Unable to put events")
+        return [(i[0], i[1], error.response["Error"]["Code"]) for i in chunk]
 
-    if events_to_put:
-        print(f"Publishing {len(events_to_put)} events to {EVENT_BUS}")
-        events_client.put_events(Entries=events_to_put)
+    if not result.get("FailedEntryCount"):
+        return []
 
-    return "ok"
+    return [
+        (identifier, entry, result_entry["ErrorCode"])
+        for (identifier, entry), result_entry in zip(chunk, result["Entries"])
+        if result_entry.get("ErrorCode")
+    ]
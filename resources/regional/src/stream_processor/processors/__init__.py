@@ -0,0 +1 @@
+"""Consumers of the table stream that run in the stream processor."""
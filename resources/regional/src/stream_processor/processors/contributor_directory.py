@@ -0,0 +1,188 @@
+import gzip
+import json
+import logging
+import os
+
+from boto3.dynamodb.conditions import Key
+from dynamodb_helpers import (
+    DIRECTORY_SUMMARY_KEY,
+    SUMMARY_INDEX,
+    count_items,
+    deserialize,
+    get_table,
+    query_prefix,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AWS_REGION = os.getenv("AWS_REGION")
+
+# Directory entries live in their own partition of the table
+DIRECTORY_PARTITION = "DIRECTORY"
+
+
+def process_records(records):
+    """Maintain the contributor directory from table stream records.
+
+    Title changes written in this region update the contributor's entry
+    (``DIRECTORY``/``CONTRIBUTOR#{contributor_id}``). Changes to entries, including
+    those replicated from other regions, re-render the sorted directory document
+    (``DIRECTORY``/``SUMMARY``) that ``get_contributors`` reads.
+
+    :returns: The sequence numbers of the records to retry from
+    :rtype: list
+    """
+    rebuild = None
+    contributors = dict()
+
+    for record in records:
+        keys = deserialize(record["dynamodb"]["Keys"])
+
+        if keys["contributor_id"] == DIRECTORY_PARTITION:
+            if keys["type"].startswith("CONTRIBUTOR#"):
+                rebuild = rebuild or record["dynamodb"]["SequenceNumber"]
+
+        elif keys["type"].startswith("TITLE#") and "#VERSION#" not in keys["type"]:
+            image = deserialize(
+                record["dynamodb"].get("NewImage") or record["dynamodb"]["OldImage"]
+            )
+            # Writes replicated from other regions are counted where they were made
+            if image.get("aws_region") != AWS_REGION:
+                continue
+
+            # Each contributor's entry is updated once, from the last title
+            # published in the batch
+            first_record, last_published = contributors.get(
+                keys["contributor_id"], (record["dynamodb"]["SequenceNumber"], None)
+            )
+            if record["eventName"] != "REMOVE":
+                last_published = image["summary"]["lastModified"]
+            contributors[keys["contributor_id"]] = (first_record, last_published)
+
+    failed = list()
+    for contributor_id, (first_record, last_published) in contributors.items():
+        try:
+            update_entry(contributor_id, last_published)
+        except Exception:
+            logger.exception(f"Unable to update directory entry: {contributor_id}")
+            failed.append(first_record)
+
+    if rebuild:
+        try:
+            write_directory()
+        except Exception:
+            logger.exception("Unable to write contributor directory")
+            failed.append(rebuild)
+
+    return failed
+
+
+def update_entry(contributor_id, last_published=None):
+    """Set a contributor's title count to the number of their titles, and their
+    last published time if a title was published.
+
+    The titles are counted rather than the count adjusted by each change, so a
+    record that is processed again leaves the same count. The count is read
+    from ``ContributorTitleSummaries``, which can lag behind the table: a title
+    the index does not have yet is counted by the next change to the
+    contributor's titles.
+
+    :param str contributor_id: The contributor whose entry to update
+    :param str last_published: The ``lastModified`` of the last title published
+    """
+    update_expression = "set contributor = :cid, title_count = :tc"
+    expression_values = {":cid": contributor_id, ":tc": count_titles(contributor_id)}
+
+    if last_published:
+        update_expression += ", last_published = :lp"
+        expression_values[":lp"] = last_published
+
+    logger.info(
+        f"Updating directory entry: {contributor_id} "
+        f"({expression_values[':tc']} titles)"
+    )
+    get_table().update_item(
+        Key={
+            "contributor_id": DIRECTORY_PARTITION,
+            "type": f"CONTRIBUTOR#{contributor_id}",
+        },
+        UpdateExpression=update_expression,
+        ExpressionAttributeValues=expression_values,
+    )
+
+
+def count_titles(contributor_id):
+    """Count a contributor's titles without reading their summaries.
+
+    :rtype: int
+    """
+    return count_items(
+        IndexName=SUMMARY_INDEX,
+        KeyConditionExpression=Key("contributor_id").eq(contributor_id),
+    )
+
+
+def write_directory():
+    """Write every contributor with at least one title, sorted by title count, as
+    a single gzip compressed document.
+    """
+    contributors = list()
+
+    for entry in query_prefix(DIRECTORY_PARTITION, "CONTRIBUTOR#"):
+        if entry.get("title_count", 0) > 0:
+            contributors.append(
+                {
+                    "id": entry["contributor"],
+                    "title_count": int(entry["title_count"]),
+                    "last_published": entry.get("last_published"),
+                }
+            )
+
+    contributors.sort(key=lambda i: (-i["title_count"], i["id"]))
+
+    logger.info(f"Writing contributor directory: {len(contributors)} contributors")
+    get_table().put_item(
+        Item={
+            **DIRECTORY_SUMMARY_KEY,
+            "contributor_count": len(contributors),
+            "body_gzip": gzip.compress(json.dumps(contributors).encode()),
+        }
+    )
+
+
+def backfill():
+    """Recompute the entry of every contributor with titles, and the title count
+    of entries whose contributor no longer has any, then write the directory.
+    Title items are read from ``ContributorTitleSummaries``; their published
+    times are taken from the summaries.
+
+    :returns: The number of entries updated
+    :rtype: int
+    """
+    last_published = dict()
+    kwargs = {
+        "IndexName": SUMMARY_INDEX,
+        "ProjectionExpression": "contributor_id, summary",
+    }
+
+    while True:
+        result = get_table().scan(**kwargs)
+        for item in result["Items"]:
+            last_published[item["contributor_id"]] = max(
+                last_published.get(item["contributor_id"]) or "",
+                item["summary"]["lastModified"],
+            )
+
+        if not result.get("LastEvaluatedKey"):
+            break
+        kwargs["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+    for entry in query_prefix(DIRECTORY_PARTITION, "CONTRIBUTOR#"):
+        last_published.setdefault(entry["contributor"], None)
+
+    for contributor_id, published in last_published.items():
+        update_entry(contributor_id, published)
+
+    write_directory()
+    return len(last_published)
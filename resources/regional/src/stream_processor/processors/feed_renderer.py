@@ -0,0 +1,172 @@
+import functools
+import gzip
+import json
+import logging
+import os
+
+import boto3
+from definition_helpers import (
+    collect_summaries,
+    content_hash,
+    is_versioned,
+    read_definition,
+)
+from dynamodb_helpers import deserialize, get_table, query_summaries
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+FEEDS_BUCKET = os.getenv("FEEDS_BUCKET")
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client("s3")
+
+
+def process_records(records):
+    """Render the Jamf feed documents of every title changed in a batch of table
+    stream records into the feeds bucket.
+
+    Object keys mirror the Jamf API routes (``v1/{contributor_id}/software`` and
+    ``v1/{contributor_id}/patch/{title_id}``) so the bucket can be used directly
+    as an origin. Objects are stored gzip compressed.
+
+    A document that cannot be rendered does not stop the others. It is rendered
+    again when the batch is retried from the first record of its title or
+    contributor.
+
+    :returns: The sequence numbers of the records to retry from
+    :rtype: list
+    """
+    changed_titles = dict()
+    title_images = dict()
+    first_records = dict()
+
+    for record in records:
+        keys = deserialize(record["dynamodb"]["Keys"])
+        if not keys["type"].startswith("TITLE#"):
+            continue
+
+        # Only the last change to a title in the batch needs to be rendered. Version
+        # items (``TITLE#{title_id}#VERSION#{rank}``) re-render their title.
+        title_id = keys["type"][6:].partition("#")[0]
+        changed_titles[(keys["contributor_id"], title_id)] = record
+        if keys["type"] == f"TITLE#{title_id}":
+            title_images.setdefault(keys["contributor_id"], dict())[title_id] = (
+                deserialize(record["dynamodb"].get("NewImage", {}))
+            )
+
+        sequence_number = record["dynamodb"]["SequenceNumber"]
+        first_records.setdefault((keys["contributor_id"], title_id), sequence_number)
+        first_records.setdefault(keys["contributor_id"], sequence_number)
+
+    failed = list()
+    for (contributor_id, title_id), record in changed_titles.items():
+        try:
+            render_title(contributor_id, title_id, record)
+        except Exception:
+            logger.exception(
+                f"Unable to render patch feed: {contributor_id}/{title_id}"
+            )
+            failed.append(first_records[(contributor_id, title_id)])
+
+    for contributor_id in {i for i, _ in changed_titles}:
+        logger.info(f"Rendering software feed: {contributor_id}")
+        try:
+            render_software(contributor_id, title_images.get(contributor_id))
+        except Exception:
+            logger.exception(f"Unable to render software feed: {contributor_id}")
+            failed.append(first_records[contributor_id])
+
+    return failed
+
+
+def render_title(contributor_id, title_id, record):
+    """Write or remove the ``/patch`` document of a title from the last record
+    of the title in a batch.
+    """
+    image = deserialize(record["dynamodb"].get("NewImage", {}))
+    if image.get("type") == f"TITLE#{title_id}" and not is_versioned(image):
+        logger.info(f"Rendering patch feed: {contributor_id}/{title_id}")
+        render_patch(contributor_id, title_id, image)
+        return
+
+    try:
+        item, body = read_definition(get_table(), contributor_id, title_id)
+    except KeyError:
+        logger.info(f"Removing patch feed: {contributor_id}/{title_id}")
+        get_s3_client().delete_object(
+            Bucket=FEEDS_BUCKET, Key=f"v1/{contributor_id}/patch/{title_id}"
+        )
+    else:
+        logger.info(f"Rendering patch feed: {contributor_id}/{title_id}")
+        render_patch(contributor_id, title_id, item, body)
+
+
+def render_patch(contributor_id, title_id, item, body=None):
+    """Write the ``/patch`` document of a title. ``body`` is the assembled
+    definition of a title with per-version storage; other title items hold the
+    full definition themselves.
+    """
+    if body is not None:
+        body_gzip = gzip.compress(body.encode())
+    elif "body_gzip" in item:
+        body_gzip = item["body_gzip"].value
+        body = gzip.decompress(body_gzip).decode()
+    else:
+        body = item["body"]
+        body_gzip = gzip.compress(body.encode())
+
+    put_feed(
+        f"v1/{contributor_id}/patch/{title_id}",
+        body_gzip,
+        item.get("content_hash") or content_hash(body),
+        item["summary"]["lastModified"],
+    )
+
+
+def render_software(contributor_id, title_images=None):
+    """Write the full ``/software`` document for a contributor. The content hash
+    is derived the same way as in the Jamf API so entity tags match whichever
+    path serves the feed.
+
+    The summaries index is updated after the table, so it may not have the
+    changes being processed yet. The title items of the batch replace those read
+    from the index, and titles removed in the batch are left out.
+
+    :param dict title_images: The last image of each title item changed in the
+        batch by title ID, empty for a removed title
+    """
+    items = {i["title_id"]: i for i in query_summaries(contributor_id)}
+    for title_id, image in (title_images or {}).items():
+        if "title_id" in image:
+            items[title_id] = image
+        else:
+            items.pop(title_id, None)
+
+    summaries, feed_hash, last_modified = collect_summaries(
+        items[i] for i in sorted(items)
+    )
+
+    put_feed(
+        f"v1/{contributor_id}/software",
+        gzip.compress(json.dumps(summaries).encode()),
+        feed_hash,
+        last_modified,
+    )
+
+
+def put_feed(key, body_gzip, feed_hash, last_modified):
+    metadata = {"content-hash": feed_hash}
+    if last_modified:
+        metadata["last-modified"] = last_modified
+
+    get_s3_client().put_object(
+        Bucket=FEEDS_BUCKET,
+        Key=key,
+        Body=body_gzip,
+        ContentType="application/json",
+        ContentEncoding="gzip",
+        Metadata=metadata,
+    )
@@ -0,0 +1,57 @@
+import logging
+import os
+
+from dynamodb_helpers import deserialize
+from overflow_helpers import overflow_objects, release_objects
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AWS_REGION = os.getenv("AWS_REGION")
+
+
+def process_records(records):
+    """Release the definition objects that title, version and archive items no
+    longer point to, from table stream records.
+
+    An object is released when the item that points to it is changed or
+    deleted, including changes that were replaced again later in the batch.
+    Released objects expire after the bucket's grace period. Writes replicated
+    from other regions are released where they were made, as the bucket is
+    shared by all regions.
+
+    :returns: The sequence numbers of the records to retry from
+    :rtype: list
+    """
+    referenced = dict()
+    unreferenced = set()
+    first_record = None
+
+    for record in records:
+        keys = deserialize(record["dynamodb"]["Keys"])
+        if not keys["type"].startswith(("TITLE#", "ARCHIVE#")):
+            continue
+
+        new_image = deserialize(record["dynamodb"].get("NewImage", {}))
+        old_image = deserialize(record["dynamodb"].get("OldImage", {}))
+
+        if (new_image or old_image).get("aws_region") != AWS_REGION:
+            continue
+
+        first_record = first_record or record["dynamodb"]["SequenceNumber"]
+        key = (keys["contributor_id"], keys["type"])
+        unreferenced.update(overflow_objects(old_image))
+        unreferenced.update(referenced.get(key, set()))
+        referenced[key] = overflow_objects(new_image)
+
+    unreferenced.difference_update(*referenced.values())
+    if not unreferenced:
+        return []
+
+    logger.info(f"Releasing {len(unreferenced)} definition objects")
+    try:
+        release_objects(unreferenced)
+    except Exception:
+        logger.exception("Unable to release definition objects")
+        return [first_record]
+    return []
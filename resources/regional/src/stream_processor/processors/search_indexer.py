@@ -0,0 +1,95 @@
+import logging
+import os
+
+from dynamodb_helpers import deserialize, get_table
+from search_helpers import GENERATION_KEY, index_items, search_fields
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AWS_REGION = os.getenv("AWS_REGION")
+
+
+def process_records(records):
+    """Maintain the title search index from table stream records.
+
+    Every change to a title item written in this region is compared with the
+    title before the change. Index entries of terms the title no longer has are
+    deleted, and new or changed entries are written; changes that do not touch a
+    searchable field, such as new versions, do not write to the index. Index
+    entries replicate to the other regions with the rest of the table.
+
+    If the index changed, the search generation is incremented so that search
+    results cached by ``search_titles`` are discarded. Index entries are written
+    for the whole batch at once, so a batch that cannot be written is retried
+    from the first change to a title.
+
+    :returns: The sequence numbers of the records to retry from
+    :rtype: list
+    """
+    changed_titles = dict()
+    first_record = None
+
+    for record in records:
+        keys = deserialize(record["dynamodb"]["Keys"])
+        if not keys["type"].startswith("TITLE#") or "#" in keys["type"][6:]:
+            continue
+
+        new_image = deserialize(record["dynamodb"].get("NewImage", {}))
+        old_image = deserialize(record["dynamodb"].get("OldImage", {}))
+
+        # Writes replicated from other regions are indexed where they were made
+        if (new_image or old_image).get("aws_region") != AWS_REGION:
+            continue
+
+        # Only the title before the first and after the last change in the batch
+        # need to be compared
+        first_record = first_record or record["dynamodb"]["SequenceNumber"]
+        key = (keys["contributor_id"], keys["type"])
+        if key in changed_titles:
+            changed_titles[key][1] = new_image
+        else:
+            changed_titles[key] = [old_image, new_image]
+
+    puts = dict()
+    deletes = set()
+    for (contributor_id, _), (old_image, new_image) in changed_titles.items():
+        old_items = (
+            index_items(contributor_id, search_fields(old_image)) if old_image else {}
+        )
+        new_items = (
+            index_items(contributor_id, search_fields(new_image)) if new_image else {}
+        )
+
+        deletes.update(i for i in old_items if i not in new_items)
+        puts.update({k: v for k, v in new_items.items() if old_items.get(k) != v})
+
+    if not puts and not deletes:
+        return []
+
+    logger.info(
+        f"Updating search index for {len(changed_titles)} titles: "
+        f"{len(puts)} entries written, {len(deletes)} deleted"
+    )
+    try:
+        write_index(puts.values(), deletes)
+    except Exception:
+        logger.exception("Unable to update search index")
+        return [first_record]
+
+    return []
+
+
+def write_index(puts, deletes):
+    """Write and delete index entries, then increment the search generation."""
+    with get_table().batch_writer() as batch:
+        for contributor_id, item_type in deletes:
+            batch.delete_item(Key={"contributor_id": contributor_id, "type": item_type})
+        for item in puts:
+            batch.put_item(Item=item)
+
+    get_table().update_item(
+        Key=GENERATION_KEY,
+        UpdateExpression="add generation :one",
+        ExpressionAttributeValues={":one": 1},
+    )
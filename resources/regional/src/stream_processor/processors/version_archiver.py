@@ -0,0 +1,317 @@
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+
+from botocore.exceptions import ClientError
+from definition_helpers import chain_hash, is_versioned, query_title, sorted_ranks
+from dynamodb_helpers import (
+    COMMUNITY_PATCH_TABLE,
+    RETENTION_PARTITION,
+    archive_key,
+    deserialize,
+    get_table,
+    query_prefix,
+    title_key,
+    version_key,
+)
+from overflow_helpers import (
+    compress_value,
+    discard_overflow,
+    load_value,
+    overflow_value,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+AWS_REGION = os.getenv("AWS_REGION")
+
+# Titles with a retention policy keep this many versions, and versions released
+# within this many days, unless their policy sets other limits. 0 turns a limit
+# off. Titles without a policy are not archived.
+ARCHIVE_KEEP_VERSIONS = int(os.getenv("ARCHIVE_KEEP_VERSIONS", 0))
+ARCHIVE_KEEP_DAYS = int(os.getenv("ARCHIVE_KEEP_DAYS", 0))
+
+# A transaction holds at most 100 operations: two for each archived version and
+# one that updates the title
+MAX_ARCHIVED_PER_TRANSACTION = 49
+
+
+def process_records(records):
+    """Archive the versions of changed titles that fall outside their retention
+    policy, from table stream records.
+
+    Only titles with a retention policy are archived. Archived versions are
+    moved from their version item to an archive item and removed from the title
+    item's ``versions`` map, which counts them in ``archived_count``, so the
+    definition served to Jamf Pro only holds the versions that are kept. The
+    newest version is never archived. Titles are archived in the region they
+    were created in.
+
+    A title with more versions to archive than fit in one transaction is
+    archived in steps: the change to the title item starts the next step.
+    Versions that age out of titles that are not written again are archived by
+    the daily ``sweep``.
+
+    :returns: The sequence numbers of the records to retry from
+    :rtype: list
+    """
+    titles = dict()
+    first_records = dict()
+
+    for record in records:
+        keys = deserialize(record["dynamodb"]["Keys"])
+        if not keys["type"].startswith("TITLE#") or "#" in keys["type"][6:]:
+            continue
+
+        new_image = deserialize(record["dynamodb"].get("NewImage", {}))
+        if (
+            new_image.get("aws_region") != AWS_REGION
+            or not is_versioned(new_image)
+            or not new_image.get("retention")
+        ):
+            continue
+
+        key = (keys["contributor_id"], keys["type"][6:])
+        titles[key] = new_image
+        first_records.setdefault(key, record["dynamodb"]["SequenceNumber"])
+
+    failed = list()
+    for (contributor_id, title_id), title_item in titles.items():
+        keep_versions, keep_days = retention_policy(title_item)
+
+        # Versions can only be archived by age once their patches are read
+        if not keep_days and len(title_item["versions"]) <= (
+            keep_versions or len(title_item["versions"])
+        ):
+            continue
+
+        try:
+            archive_title(contributor_id, title_id)
+        except Exception:
+            logger.exception(f"Unable to archive versions: {contributor_id}/{title_id}")
+            failed.append(first_records[(contributor_id, title_id)])
+
+    return failed
+
+
+def sweep():
+    """Archive the versions of every title listed in the retention partition
+    that fall outside its retention policy. A title is only read from the stream
+    when it changes, so without the sweep versions would never age out of titles
+    that are not written again.
+
+    Entries of titles that no longer exist or have no policy are removed. A
+    title that cannot be archived does not stop the others.
+
+    :returns: The number of versions archived
+    :rtype: int
+    """
+    archived = 0
+
+    for entry in query_prefix(RETENTION_PARTITION, "RETAINED#"):
+        contributor_id, _, title_id = entry["type"][9:].partition("#")
+
+        result = get_table().get_item(
+            Key=title_key(contributor_id, title_id),
+            ProjectionExpression="aws_region, retention",
+        )
+        title_item = result.get("Item")
+        if not title_item or not title_item.get("retention"):
+            logger.info(f"Removing retention entry: {contributor_id}/{title_id}")
+            get_table().delete_item(
+                Key={k: entry[k] for k in ("contributor_id", "type")}
+            )
+            continue
+
+        if title_item.get("aws_region") != AWS_REGION:
+            continue
+
+        try:
+            archived += archive_title(contributor_id, title_id)
+        except Exception:
+            logger.exception(f"Unable to archive versions: {contributor_id}/{title_id}")
+
+    logger.info(f"Retention sweep archived {archived} versions")
+    return archived
+
+
+def retention_policy(title_item):
+    """The number of versions and the age in days a title keeps. A limit set to
+    ``null`` in the title's policy is turned off; one that is not set falls back
+    to the default.
+
+    :rtype: tuple
+    """
+    policy = title_item.get("retention") or {}
+    keep_versions = policy.get("keep_versions", ARCHIVE_KEEP_VERSIONS)
+    keep_days = policy.get("keep_days", ARCHIVE_KEEP_DAYS)
+    return int(keep_versions or 0), int(keep_days or 0)
+
+
+def archive_ranks(title_item, version_items, now):
+    """Return the ranks of the versions to archive, oldest first.
+
+    :param list version_items: The title's version items
+    :param datetime now: The time release dates are compared with
+
+    :rtype: list
+    """
+    keep_versions, keep_days = retention_policy(title_item)
+    ranks = sorted_ranks(title_item["versions"])
+    archived = set()
+
+    if keep_versions:
+        archived.update(ranks[keep_versions:])
+
+    if keep_days:
+        cutoff = now - timedelta(days=keep_days)
+        release_dates = {
+            i["type"].rpartition("#")[2]: release_date(i) for i in version_items
+        }
+        archived.update(
+            rank
+            for rank in ranks[1:]
+            if release_dates.get(rank) and release_dates[rank] < cutoff
+        )
+
+    return [i for i in reversed(ranks) if i in archived]
+
+
+def release_date(version_item):
+    """The release date of a version item's patch, or ``None`` if it cannot be
+    read.
+    """
+    try:
+        value = json.loads(load_value(version_item["patch"]))["releaseDate"]
+        return datetime.strptime(value[:19], "%Y-%m-%dT%H:%M:%S")
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def archive_title(contributor_id, title_id):
+    """Archive the versions of a title that fall outside its retention policy in
+    one transaction that is conditional on the title item's ``revision``. A
+    title changed by another request is archived when that change is read from
+    the stream. The definition's ``lastModified`` is set to the time of the
+    archival, as the served definition changes.
+
+    :returns: The number of versions archived
+    :rtype: int
+    """
+    try:
+        title_item, version_items = query_title(get_table(), contributor_id, title_id)
+    except KeyError:
+        return 0
+
+    now = datetime.utcnow()
+    ranks = archive_ranks(title_item, version_items, now)[:MAX_ARCHIVED_PER_TRANSACTION]
+    if not ranks:
+        return 0
+
+    version_items = {i["type"].rpartition("#")[2]: i for i in version_items}
+    versions = {r: v for v, r in title_item["versions"].items()}
+
+    # Titles created before revisions were introduced have no revision attribute
+    revision = title_item.get("revision", 0)
+    attribute_values = {":rev": revision} if revision else {}
+
+    archive_items = [
+        {
+            **archive_key(contributor_id, title_id, rank, revision + 1),
+            "aws_region": AWS_REGION,
+            "version": versions[rank],
+            "rank": rank,
+            # Archive items get their own copy of a value stored in the
+            # definitions bucket, as the version item's copy is released
+            "patch": overflow_value(
+                contributor_id,
+                title_id,
+                compress_value(load_value(version_items[rank]["patch"])),
+            ),
+            "archived": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+        }
+        for rank in ranks
+        if rank in version_items
+    ]
+    if not archive_items:
+        return 0
+
+    new_content_hash = chain_hash(
+        title_item["content_hash"],
+        "archive",
+        *[i for item in archive_items for i in (item["version"], item["type"])],
+    )
+
+    last_modified = now.strftime("%Y-%m-%dT%H:%M:%SZ")
+    header = json.loads(load_value(title_item["header"]))
+    header["lastModified"] = last_modified
+    header_value = overflow_value(contributor_id, title_id, json.dumps(header))
+
+    operations = list()
+    for item in archive_items:
+        operations.append(
+            {
+                "Put": {
+                    "TableName": COMMUNITY_PATCH_TABLE,
+                    "Item": item,
+                    "ConditionExpression": "attribute_not_exists(#type)",
+                    "ExpressionAttributeNames": {"#type": "type"},
+                }
+            }
+        )
+        operations.append(
+            {
+                "Delete": {
+                    "TableName": COMMUNITY_PATCH_TABLE,
+                    "Key": version_key(contributor_id, title_id, item["rank"]),
+                }
+            }
+        )
+
+    operations.append(
+        {
+            "Update": {
+                "TableName": COMMUNITY_PATCH_TABLE,
+                "Key": title_key(contributor_id, title_id),
+                "UpdateExpression": "remove "
+                + ", ".join(f"versions.#v{i}" for i in range(len(archive_items)))
+                + " set archived_count = if_not_exists(archived_count, :zero) + :ac, "
+                "header = :hd, "
+                "content_hash = :ch, "
+                "revision = :next, "
+                "summary.lastModified = :lm",
+                "ConditionExpression": (
+                    "revision = :rev" if revision else "attribute_not_exists(revision)"
+                ),
+                "ExpressionAttributeNames": {
+                    f"#v{i}": item["version"] for i, item in enumerate(archive_items)
+                },
+                "ExpressionAttributeValues": {
+                    ":zero": 0,
+                    ":ac": len(archive_items),
+                    ":hd": header_value,
+                    ":ch": new_content_hash,
+                    ":lm": last_modified,
+                    ":next": revision + 1,
+                    **attribute_values,
+                },
+            }
+        }
+    )
+
+    try:
+        get_table().meta.client.transact_write_items(TransactItems=operations)
+    except ClientError as error:
+        discard_overflow(archive_items + [{"header": header_value}])
+        if error.response["Error"]["Code"] == "TransactionCanceledException":
+            logger.warning(f"Title changed during archival: {title_item['type']}")
+            return 0
+        raise
+
+    logger.info(
+        f"Archived {len(archive_items)} versions of {contributor_id}/{title_id}: "
+        f"{[i['version'] for i in archive_items]}"
+    )
+    return len(archive_items)
@@ -1,7 +1,13 @@
+import base64
+import functools
 import json
 
+from metrics_helpers import phase
 
-def response(message, status_code):
+JSON_HEADERS = {'Content-Type': 'application/json'}
+
+
+def response(message, status_code, headers=None):
     """Returns a dictionary object for an API Gateway Lambda integration
     response.
 
@@ -10,14 +16,74 @@ def response(message, status_code):
 
     :param int status_code: HTTP status code of response
 
+    :param dict headers: Headers to add to the response
+
     :rtype: dict
     """
     if isinstance(message, str):
-        message = {'message': message}
+        body = _message_body(message)
+    else:
+        with phase('Serialize'):
+            body = json.dumps(message)
+
+    return json_response(body, status_code, headers)
+
+
+def json_response(body, status_code, headers=None):
+    """Returns a response for a body that is already serialized, such as a
+    definition assembled from its items or a rendered document, without
+    decoding and encoding it again.
 
+    :param str body: JSON document for the body of the response
+
+    :param int status_code: HTTP status code of response
+
+    :param dict headers: Headers to add to the response
+
+    :rtype: dict
+    """
     return {
         'isBase64Encoded': False,
         'statusCode': status_code,
-        'body': json.dumps(message),
-        'headers': {'Content-Type': 'application/json'}
+        'body': body,
+        'headers': {**JSON_HEADERS, **headers} if headers else dict(JSON_HEADERS)
     }
+
+
+def event_body(event):
+    """The body of an API Gateway request event. APIs with binary media types
+    pass request bodies base64 encoded.
+
+    :param dict event: API Gateway Lambda proxy integration event
+
+    :returns: The body, or ``None`` for a request without one
+    :rtype: str or bytes
+    """
+    body = event.get('body')
+    if body is not None and event.get('isBase64Encoded'):
+        return base64.b64decode(body)
+    return body
+
+
+def accepts_gzip(request_headers):
+    """Whether the ``Accept-Encoding`` request header allows a gzip response.
+
+    :param dict request_headers: Request headers with lowercase names
+
+    :rtype: bool
+    """
+    for coding in request_headers.get('accept-encoding', '').split(','):
+        name, _, params = coding.partition(';')
+        if name.strip().lower() in ('gzip', '*'):
+            try:
+                return float(params.strip().partition('q=')[2] or 1) > 0
+            except ValueError:
+                return False
+    return False
+
+
+@functools.lru_cache(maxsize=128)
+def _message_body(message):
+    # Most messages are one of a few errors, so their bodies are only
+    # serialized once
+    return json.dumps({'message': message})
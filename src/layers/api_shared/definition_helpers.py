@@ -0,0 +1,464 @@
+import bisect
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from boto3.dynamodb.conditions import Key
+from dynamodb_helpers import query_items, title_key, version_key
+from overflow_helpers import compress_value, load_value
+
+# Version items are ordered by a rank: the newest patch has the highest rank.
+# Ranks are a fixed width integer with an optional base 36 fraction so a
+# version can always be placed between two existing ones.
+RANK_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+RANK_START = 1000000
+RANK_WIDTH = 10
+
+# Titles are spread over this many TitleSearch partition keys by a hash of the
+# title ID, so title writes are not all sent to one partition. Titles written
+# before the index was sharded keep the legacy key until they are next updated.
+SEARCH_SHARD_COUNT = 16
+LEGACY_SEARCH_PARTITION = "TITLE"
+
+# Versions are compared by their runs of digits and of letters. Build metadata
+# after a "+" is ignored, as in semantic versioning.
+VERSION_PART_PATTERN = re.compile(r"\d+|[a-z]+")
+
+
+def search_partition(title_id):
+    """Return the ``TitleSearch`` partition key of a title."""
+    digest = hashlib.sha256(title_id.lower().encode()).digest()
+    shard = int.from_bytes(digest[:4], "big") % SEARCH_SHARD_COUNT
+    return f"TITLE#{shard:02d}"
+
+
+def search_partitions():
+    """Return every ``TitleSearch`` partition key that can hold titles."""
+    return [f"TITLE#{i:02d}" for i in range(SEARCH_SHARD_COUNT)] + [
+        LEGACY_SEARCH_PARTITION
+    ]
+
+
+def content_hash(body):
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+def chain_hash(previous_hash, *values):
+    """Derive a new content hash from the previous one and the values of a
+    change, so a title's hash changes with every write without reading the
+    full definition.
+    """
+    return content_hash(":".join([previous_hash or ""] + [str(i) for i in values]))
+
+
+def collect_summaries(items):
+    """Collect the summaries of title items for the Jamf ``/software`` feed.
+
+    The feed's content hash is derived from the stored content hash of every
+    title, so whichever path serves the feed gives it the same entity tag
+    without serializing the summaries. Only the summaries of the items are
+    retained.
+
+    :param items: Title items with ``title_id``, ``summary`` and ``content_hash``
+    :type items: iterable
+
+    :returns: The summaries, the content hash of the feed and the latest
+        ``lastModified`` of the titles
+    :rtype: tuple
+    """
+    digest = hashlib.sha256()
+    summaries = list()
+    last_modified = None
+
+    for item in items:
+        item_hash = item.get("content_hash") or content_hash(
+            json.dumps(item["summary"], sort_keys=True)
+        )
+        digest.update(f"{item['title_id']}:{item_hash}\n".encode())
+
+        summaries.append(item["summary"])
+        last_modified = max(
+            last_modified or item["summary"]["lastModified"],
+            item["summary"]["lastModified"],
+        )
+
+    return summaries, digest.hexdigest(), last_modified
+
+
+def build_title_item(contributor_id, title_body, ranks, revision=1):
+    """Return the title item of a new definition.
+
+    :param dict title_body: The full definition
+    :param list ranks: The ranks of the definition's patches, newest first
+    :param int revision: The revision of the title item
+    """
+    header, patches = split_definition(title_body)
+    return {
+        **title_key(contributor_id, title_body["id"]),
+        "search_index": search_partition(title_body["id"]),
+        "aws_region": os.getenv("AWS_REGION"),
+        "title_id": title_body["id"].lower(),
+        "header": json.dumps(header),
+        "versions": {p["version"]: r for p, r in zip(patches, ranks)},
+        "content_hash": content_hash(json.dumps(title_body)),
+        "revision": revision,
+        "summary": {
+            "id": title_body["id"],
+            "name": title_body["name"],
+            "publisher": title_body["publisher"],
+            "currentVersion": title_body["currentVersion"],
+            "lastModified": title_body["lastModified"],
+        },
+    }
+
+
+def build_version_items(contributor_id, title_body, ranks):
+    """Return the version items of a new definition, newest first. Patches are
+    stored compressed.
+    """
+    return [
+        {
+            **version_key(contributor_id, title_body["id"], rank),
+            "aws_region": os.getenv("AWS_REGION"),
+            "version": patch["version"],
+            "patch": compress_value(json.dumps(patch)),
+        }
+        for patch, rank in zip(title_body["patches"], ranks)
+    ]
+
+
+def has_duplicate_versions(title_body):
+    versions = [i["version"] for i in title_body["patches"]]
+    return len(set(versions)) != len(versions)
+
+
+def is_versioned(title_item):
+    """Whether a title item stores its patches as separate version items. Titles
+    written before per-version storage hold the full definition in ``body`` or
+    ``body_gzip``.
+    """
+    return "versions" in title_item
+
+
+def split_definition(title_body):
+    """Split a definition into its header (everything except the patches) and
+    its patches.
+
+    :param dict title_body: A full definition
+
+    :rtype: tuple
+    """
+    header = {k: v for k, v in title_body.items() if k != "patches"}
+    return header, title_body["patches"]
+
+
+def read_legacy_body(title_item):
+    """Return the definition JSON of a title item that stores its full body."""
+    if "body_gzip" in title_item:
+        return gzip.decompress(title_item["body_gzip"].value).decode()
+    return title_item["body"]
+
+
+def query_title(table, contributor_id, title_id):
+    """Read a title item and all of its version items in one query.
+
+    :returns: The title item and its version items, newest first
+    :rtype: tuple
+
+    :raises KeyError: The title does not exist
+    """
+    title_type = title_key(contributor_id, title_id)["type"]
+    version_prefix = f"{title_type}#VERSION#"
+
+    title_item = None
+    version_items = list()
+
+    for item in query_items(
+        table,
+        KeyConditionExpression=Key("contributor_id").eq(contributor_id)
+        & Key("type").between(title_type, f"{version_prefix}~"),
+        ScanIndexForward=False,
+    ):
+        if item["type"] == title_type:
+            title_item = item
+        elif item["type"].startswith(version_prefix):
+            version_items.append(item)
+
+    if title_item is None:
+        raise KeyError(title_id)
+
+    return title_item, version_items
+
+
+def assemble_definition(title_item, version_items):
+    """Return the full definition JSON for a title item and its version items.
+    Values stored in the definitions bucket are read from it.
+
+    :param dict title_item: The title item
+    :param list version_items: Version items, newest first
+
+    :rtype: str
+    """
+    if not is_versioned(title_item):
+        return read_legacy_body(title_item)
+
+    # Version items that are not in the title's map are left over from a write
+    # that did not complete
+    ranks = set(title_item["versions"].values())
+
+    title_body = json.loads(load_value(title_item["header"]))
+    title_body["patches"] = [
+        json.loads(load_value(i["patch"]))
+        for i in version_items
+        if i["type"].rpartition("#")[2] in ranks
+    ]
+    return json.dumps(title_body)
+
+
+def read_definition(table, contributor_id, title_id):
+    """Read and assemble the full definition of a title.
+
+    :returns: The title item and the definition JSON
+    :rtype: tuple
+
+    :raises KeyError: The title does not exist
+    """
+    title_item, version_items = query_title(table, contributor_id, title_id)
+    return title_item, assemble_definition(title_item, version_items)
+
+
+def next_rank(table, contributor_id, title_id):
+    """The rank above every version item of a title ID in the table, including
+    those left over from a deleted title or from a write that did not complete.
+
+    :returns: The rank, and whether the title item exists
+    :rtype: tuple
+    """
+    title_type = title_key(contributor_id, title_id)["type"]
+    version_prefix = f"{title_type}#VERSION#"
+
+    exists = False
+    ranks = list()
+    for item in query_items(
+        table,
+        KeyConditionExpression=Key("contributor_id").eq(contributor_id)
+        & Key("type").between(title_type, f"{version_prefix}~"),
+        ProjectionExpression="#type",
+        ExpressionAttributeNames={"#type": "type"},
+        ConsistentRead=True,
+    ):
+        if item["type"] == title_type:
+            exists = True
+        elif item["type"].startswith(version_prefix):
+            ranks.append(int(item["type"][len(version_prefix) :].partition(".")[0]))
+
+    return max(ranks) + 1 if ranks else RANK_START, exists
+
+
+def initial_ranks(count, start=RANK_START):
+    """Ranks for the patches of a new definition, newest first.
+
+    :param int count: Number of patches
+    :param int start: The rank of the oldest patch
+    """
+    return [format_rank(start + count - 1 - i) for i in range(count)]
+
+
+def sorted_ranks(versions):
+    """The ranks of a title's ``versions`` map, newest first."""
+    return sorted(versions.values(), reverse=True)
+
+
+def version_sort_key(version):
+    """A key that orders version strings the way semantic and Apple versions are
+    ordered. Numeric parts are compared as numbers, a pre-release such as
+    ``1.0b2`` or ``1.0.0-rc.1`` sorts before its release, and zeros at the end
+    of the release are ignored, so ``1.0`` and ``1.0.0`` are equal.
+
+    :rtype: tuple
+    """
+    parts = [
+        (2, int(i), "") if i.isdigit() else (0, 0, i)
+        for i in VERSION_PART_PATTERN.findall(version.lower().partition("+")[0])
+    ]
+    release = 0
+    while release < len(parts) and parts[release][0] == 2:
+        release += 1
+    # Zeros at the end of the numeric release are dropped
+    end = release
+    while end and parts[end - 1] == (2, 0, ""):
+        end -= 1
+    # The end of a version sorts after a pre-release and before more numbers
+    return tuple(parts[:end] + parts[release:]) + ((1, 0, ""),)
+
+
+class VersionIndex:
+    """The versions of a title item in rank order, newest first.
+
+    The index is built with one sort of the ranks of the ``versions`` map, which
+    costs the same as sorting them to scan. The position of an existing version
+    is then a binary search of the ranks, and the position of a new version by
+    version order is a binary search that only parses the versions it compares
+    with. The versions by rank are only collected for the lookups that need them.
+    """
+
+    def __init__(self, versions):
+        self.ranks = versions
+        # Oldest first; positions count from the newest rank at the end
+        self.sorted_ranks = sorted(versions.values())
+        self._by_rank = None
+
+    def __contains__(self, version):
+        return version in self.ranks
+
+    def __len__(self):
+        return len(self.sorted_ranks)
+
+    @property
+    def by_rank(self):
+        if self._by_rank is None:
+            self._by_rank = {r: v for v, r in self.ranks.items()}
+        return self._by_rank
+
+    def rank_at(self, position):
+        return self.sorted_ranks[len(self.sorted_ranks) - 1 - position]
+
+    def newest(self):
+        return self.by_rank[self.sorted_ranks[-1]] if self.sorted_ranks else None
+
+    def gap(self, position):
+        """The ranks on either side of a position, where position ``0`` is newer
+        than every version and ``len(index)`` is older than every version.
+
+        :returns: The older and newer rank, either of which may be ``None``
+        :rtype: tuple
+        """
+        older = self.rank_at(position) if position < len(self) else None
+        newer = self.rank_at(position - 1) if position > 0 else None
+        return older, newer
+
+    def position_of(self, version):
+        """The position of an existing version.
+
+        :raises KeyError: The version is not in the index
+        """
+        rank = self.ranks[version]
+        return len(self.sorted_ranks) - 1 - bisect.bisect_left(self.sorted_ranks, rank)
+
+    def position_by_order(self, version):
+        """The position of a new version by version order: after every version
+        that sorts after it or equal to it.
+
+        Titles whose versions were placed out of order still get a position,
+        which is next to versions that sort on either side of it.
+        """
+        key = version_sort_key(version)
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if version_sort_key(self.by_rank[self.rank_at(middle)]) < key:
+                high = middle
+            else:
+                low = middle + 1
+        return low
+
+
+def rank_between(older, newer):
+    """Return a rank that sorts between two existing ranks.
+
+    :param older: The rank to sort after, or ``None`` for the oldest position
+    :type older: str or None
+
+    :param newer: The rank to sort before, or ``None`` for the newest position
+    :type newer: str or None
+
+    :rtype: str
+    """
+    if older is None and newer is None:
+        return format_rank(RANK_START)
+
+    if newer is None:
+        return format_rank(_rank_parts(older)[0] + 1)
+
+    newer_int, newer_fraction = _rank_parts(newer)
+
+    if older is None:
+        if newer_fraction:
+            return format_rank(newer_int)
+        if newer_int == 0:
+            raise ValueError("No rank is available before the oldest version")
+        return format_rank(newer_int - 1)
+
+    older_int, older_fraction = _rank_parts(older)
+
+    if newer_int - older_int > 1:
+        return format_rank(older_int + 1)
+    elif newer_int - older_int == 1:
+        return f"{format_rank(older_int)}.{_midpoint(older_fraction, None)}"
+    else:
+        return f"{format_rank(older_int)}.{_midpoint(older_fraction, newer_fraction)}"
+
+
+def ranks_between(older, newer, count):
+    """Return ``count`` ranks that sort between two existing ranks, oldest first.
+
+    Ranks in the newest position are consecutive integers. Between two ranks the
+    range is split in half recursively so the fractions stay short.
+
+    :param older: The rank to sort after, or ``None`` for the oldest position
+    :type older: str or None
+
+    :param newer: The rank to sort before, or ``None`` for the newest position
+    :type newer: str or None
+
+    :param int count: Number of ranks
+
+    :rtype: list
+    """
+    if count == 0:
+        return []
+
+    middle = rank_between(older, newer)
+    if newer is None:
+        return [middle] + ranks_between(middle, None, count - 1)
+
+    lower_count = (count - 1) // 2
+    return (
+        ranks_between(older, middle, lower_count)
+        + [middle]
+        + ranks_between(middle, newer, count - 1 - lower_count)
+    )
+
+
+def format_rank(value):
+    return f"{value:0{RANK_WIDTH}d}"
+
+
+def _rank_parts(rank):
+    integer, _, fraction = rank.partition(".")
+    return int(integer), fraction
+
+
+def _midpoint(lower, upper):
+    """A base 36 string that sorts between ``lower`` and ``upper`` (``None`` is
+    unbounded). Neither bound may end with a zero digit, and neither does the
+    result.
+    """
+    if upper is not None:
+        n = 0
+        while n < len(upper) and (lower[n] if n < len(lower) else "0") == upper[n]:
+            n += 1
+        if n > 0:
+            return upper[:n] + _midpoint(lower[n:], upper[n:])
+
+    lower_digit = RANK_DIGITS.index(lower[0]) if lower else 0
+    upper_digit = RANK_DIGITS.index(upper[0]) if upper is not None else len(RANK_DIGITS)
+
+    if upper_digit - lower_digit > 1:
+        return RANK_DIGITS[(lower_digit + upper_digit) // 2]
+    elif upper is not None and len(upper) > 1:
+        return upper[0]
+    else:
+        return RANK_DIGITS[lower_digit] + _midpoint(lower[1:], None)
@@ -0,0 +1,273 @@
+import concurrent.futures
+import functools
+import logging
+import os
+import time
+
+import boto3
+from boto3.dynamodb.conditions import Key
+from boto3.dynamodb.types import TypeDeserializer
+from botocore.config import Config
+from botocore.exceptions import ClientError
+from metrics_helpers import instrument
+
+logger = logging.getLogger(__name__)
+
+COMMUNITY_PATCH_TABLE = os.getenv("COMMUNITY_PATCH_TABLE")
+
+# Client settings for the table. Requests that take longer than the timeouts are
+# retried instead of holding the API Gateway request open, and the adaptive retry
+# mode slows requests down while DynamoDB is throttling them. The connection pool
+# holds a connection for each thread a handler queries from.
+DYNAMODB_MAX_POOL_CONNECTIONS = int(os.getenv("DYNAMODB_MAX_POOL_CONNECTIONS", 32))
+DYNAMODB_CONNECT_TIMEOUT = float(os.getenv("DYNAMODB_CONNECT_TIMEOUT", 1))
+DYNAMODB_READ_TIMEOUT = float(os.getenv("DYNAMODB_READ_TIMEOUT", 5))
+DYNAMODB_MAX_ATTEMPTS = int(os.getenv("DYNAMODB_MAX_ATTEMPTS", 4))
+
+# BatchGetItem accepts at most 100 keys per request
+BATCH_GET_LIMIT = 100
+BATCH_GET_MAX_ATTEMPTS = 5
+
+# Items that must not replace an existing item are put with one conditional
+# request each, from this many threads
+PUT_NEW_ITEMS_WORKERS = int(os.getenv("PUT_NEW_ITEMS_WORKERS", 16))
+
+# The index of title summaries by contributor, with their content hashes
+SUMMARY_INDEX = "ContributorTitleSummaries"
+
+# Revoked token IDs live in their own partition, which the titles API authorizer
+# reads as a whole
+REVOCATION_PARTITION = "REVOCATIONS"
+
+# Titles with a retention policy are listed in their own partition, which the
+# retention sweep of the stream processor reads as a whole
+RETENTION_PARTITION = "RETENTION"
+
+# The sorted contributor directory that ``get_contributors`` reads
+DIRECTORY_SUMMARY_KEY = {"contributor_id": "DIRECTORY", "type": "SUMMARY"}
+
+deserializer = TypeDeserializer()
+
+
+def client_config():
+    """The botocore configuration of the DynamoDB client.
+
+    :rtype: botocore.config.Config
+    """
+    options = {
+        "max_pool_connections": DYNAMODB_MAX_POOL_CONNECTIONS,
+        "connect_timeout": DYNAMODB_CONNECT_TIMEOUT,
+        "read_timeout": DYNAMODB_READ_TIMEOUT,
+        "retries": {"mode": "adaptive", "max_attempts": DYNAMODB_MAX_ATTEMPTS},
+    }
+    # Keeps pooled connections open between invocations of a warm container.
+    # Older versions of botocore do not have the option.
+    if "tcp_keepalive" in Config.OPTION_DEFAULTS:
+        options["tcp_keepalive"] = True
+    return Config(**options)
+
+
+@functools.lru_cache(maxsize=None)
+def get_dynamodb():
+    dynamodb = boto3.resource("dynamodb", config=client_config())
+    instrument(dynamodb.meta.client)
+    return dynamodb
+
+
+@functools.lru_cache(maxsize=None)
+def get_table(table_name=COMMUNITY_PATCH_TABLE):
+    return get_dynamodb().Table(table_name)
+
+
+@functools.lru_cache(maxsize=None)
+def get_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=PUT_NEW_ITEMS_WORKERS)
+
+
+def title_key(contributor_id, title_id):
+    return {"contributor_id": contributor_id, "type": f"TITLE#{title_id.lower()}"}
+
+
+def version_key(contributor_id, title_id, rank):
+    return {
+        "contributor_id": contributor_id,
+        "type": f"TITLE#{title_id.lower()}#VERSION#{rank}",
+    }
+
+
+def archive_key(contributor_id, title_id, rank, revision):
+    """Archived versions are kept outside the ``TITLE#`` range of their title, so
+    reading a title does not read them. A rank can be given to a new version
+    once its version has been archived, so archive items are also keyed by the
+    title revision that archived them.
+    """
+    return {
+        "contributor_id": contributor_id,
+        "type": f"{archive_prefix(title_id)}{rank}#{revision}",
+    }
+
+
+def archive_prefix(title_id):
+    """The start of the ``type`` of every archive item of a title."""
+    return f"ARCHIVE#{title_id.lower()}#"
+
+
+def token_key(contributor_id, token_id):
+    return {"contributor_id": contributor_id, "type": f"TOKEN#{token_id}"}
+
+
+def revocation_key(token_id):
+    return {"contributor_id": REVOCATION_PARTITION, "type": f"REVOKED#{token_id}"}
+
+
+def retention_key(contributor_id, title_id):
+    return {
+        "contributor_id": RETENTION_PARTITION,
+        "type": f"RETAINED#{contributor_id}#{title_id.lower()}",
+    }
+
+
+def query_items(table=None, **kwargs):
+    """Yield the items of a query, following ``LastEvaluatedKey`` across pages.
+
+    :param table: The boto3 ``Table`` to query, the CommunityPatch table if not set
+    :param kwargs: Arguments for ``Table.query``
+    """
+    table = table or get_table()
+
+    while True:
+        result = table.query(**kwargs)
+        yield from result["Items"]
+
+        if not result.get("LastEvaluatedKey"):
+            return
+        kwargs["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+
+def count_items(table=None, **kwargs):
+    """Count the items of a query without returning them, following
+    ``LastEvaluatedKey`` across pages.
+
+    :param table: The boto3 ``Table`` to query, the CommunityPatch table if not set
+    :param kwargs: Arguments for ``Table.query``
+
+    :rtype: int
+    """
+    table = table or get_table()
+    count = 0
+
+    while True:
+        result = table.query(Select="COUNT", **kwargs)
+        count += result["Count"]
+
+        if not result.get("LastEvaluatedKey"):
+            return count
+        kwargs["ExclusiveStartKey"] = result["LastEvaluatedKey"]
+
+
+def query_prefix(partition, prefix, table=None, **kwargs):
+    """Yield the items of a partition with a sort key that starts with a prefix.
+
+    :param str partition: The ``contributor_id`` of the items
+    :param str prefix: The start of the items' ``type``
+    """
+    yield from query_items(
+        table,
+        KeyConditionExpression=Key("contributor_id").eq(partition)
+        & Key("type").begins_with(prefix),
+        **kwargs,
+    )
+
+
+def query_summaries(contributor_id):
+    """Yield the summary items of all of a contributor's titles, with their
+    ``title_id`` and ``content_hash``.
+
+    :param str contributor_id: The contributor that owns the titles
+    """
+    yield from query_items(
+        IndexName=SUMMARY_INDEX,
+        KeyConditionExpression=Key("contributor_id").eq(contributor_id),
+    )
+
+
+def deserialize(image):
+    """Convert an item image of a table stream record to Python values."""
+    return {k: deserializer.deserialize(v) for k, v in image.items()}
+
+
+def batch_get_items(keys, table_name=COMMUNITY_PATCH_TABLE, **options):
+    """Yield the items for a list of keys, in requests of up to 100 keys. Keys
+    that are not processed are retried with an exponential backoff. Items are
+    not returned in the order of their keys, and keys without an item are
+    skipped.
+
+    :param list keys: Primary keys of the items to read
+    :param options: Request options for the table, such as
+        ``ProjectionExpression`` and ``ConsistentRead``
+
+    :raises RuntimeError: Not all keys were processed after retrying
+    """
+    for start in range(0, len(keys), BATCH_GET_LIMIT):
+        request_items = {
+            table_name: {"Keys": keys[start : start + BATCH_GET_LIMIT], **options}
+        }
+
+        for attempt in range(BATCH_GET_MAX_ATTEMPTS):
+            result = get_dynamodb().batch_get_item(RequestItems=request_items)
+            yield from result["Responses"].get(table_name, [])
+
+            request_items = result.get("UnprocessedKeys")
+            if not request_items:
+                break
+
+            logger.warning(
+                f"Retrying {len(request_items[table_name]['Keys'])} unprocessed keys"
+            )
+            time.sleep(0.05 * 2 ** attempt)
+        else:
+            raise RuntimeError("Unable to read all requested items")
+
+
+def put_new_items(items, table=None):
+    """Put items on the condition that no item with the same key exists, so an
+    item written by another request is never replaced. ``BatchWriteItem`` does
+    not accept conditions, so every item is put with its own request.
+
+    If a put fails with an error other than a failed condition, the items that
+    were written are deleted again and the error is raised.
+
+    :param list items: The items to put
+    :param table: The boto3 ``Table`` to write to, the CommunityPatch table if
+        not set
+
+    :returns: The items that were written and the items whose key exists
+    :rtype: tuple
+    """
+    table = table or get_table()
+
+    def put(item):
+        try:
+            table.put_item(
+                Item=item,
+                ConditionExpression="attribute_not_exists(#type)",
+                ExpressionAttributeNames={"#type": "type"},
+            )
+        except ClientError as error:
+            if error.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+            return False
+        return True
+
+    futures = [get_executor().submit(put, i) for i in items]
+    concurrent.futures.wait(futures)
+
+    written = [i for i, f in zip(items, futures) if not f.exception() and f.result()]
+    errors = [f.exception() for f in futures if f.exception()]
+    if errors:
+        with table.batch_writer() as batch:
+            for item in written:
+                batch.delete_item(Key={k: item[k] for k in ("contributor_id", "type")})
+        raise errors[0]
+
+    return written, [i for i, f in zip(items, futures) if not f.result()]
@@ -0,0 +1,184 @@
+import collections
+import contextlib
+import functools
+import json
+import os
+import random
+import threading
+import time
+
+# A sampled request writes one CloudWatch Embedded Metric Format log line, which
+# CloudWatch turns into metrics without any API calls from the function
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "CommunityPatch")
+METRICS_SAMPLE_RATE = float(os.getenv("METRICS_SAMPLE_RATE", 0.1))
+FUNCTION_NAME = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "local")
+
+# Consumed capacity of these operations is counted as read capacity, and of all
+# others as write capacity
+READ_OPERATIONS = frozenset(
+    ("BatchGetItem", "GetItem", "Query", "Scan", "TransactGetItems")
+)
+
+_request = None
+_call_starts = threading.local()
+
+
+class RequestMetrics:
+    """Metric values and properties of one sampled request. DynamoDB calls may
+    be made from several threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.values = collections.defaultdict(float)
+        self.properties = dict()
+
+    def add(self, name, value):
+        with self.lock:
+            self.values[name] += value
+
+
+def instrumented(handler):
+    """Decorate a Lambda handler to time sampled requests and write their
+    metrics when the handler returns.
+
+    A request is sampled with a probability of ``METRICS_SAMPLE_RATE``. Requests
+    that are not sampled are not timed and do not request consumed capacity.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _request
+        if random.random() >= METRICS_SAMPLE_RATE:
+            return handler(event, context)
+
+        _request = RequestMetrics()
+        start = time.perf_counter()
+        try:
+            result = handler(event, context)
+            if isinstance(result, dict) and "statusCode" in result:
+                _request.properties["status_code"] = result["statusCode"]
+            return result
+        except Exception as error:
+            _request.properties["error"] = type(error).__name__
+            raise
+        finally:
+            _request.add("TotalMs", (time.perf_counter() - start) * 1000)
+            emit(_request)
+            _request = None
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def phase(name):
+    """Time a phase of a sampled request as the ``{name}Ms`` metric. A phase
+    that runs several times in a request is reported as the total time.
+    """
+    if _request is None:
+        yield
+        return
+
+    request = _request
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        request.add(f"{name}Ms", (time.perf_counter() - start) * 1000)
+
+
+def set_property(name, value):
+    """Add a value to the metrics log line of a sampled request. Properties are
+    not metrics, but can be searched with CloudWatch Logs Insights, which keeps
+    contributor and title IDs out of the metric dimensions.
+    """
+    if _request is not None:
+        _request.properties[name] = value
+
+
+def instrument(client):
+    """Register the event handlers that time the DynamoDB calls of a client and
+    count the capacity they consume, and the size of the items they carry.
+    ``DynamoDBMs`` is the total time of all calls, so it can exceed the request
+    time when calls are made in parallel.
+
+    :param client: A boto3 DynamoDB client, such as ``Table.meta.client``
+    """
+    events = client.meta.events
+    events.register("provide-client-params.dynamodb", _request_capacity)
+    events.register("before-call.dynamodb", _before_call)
+    events.register("after-call.dynamodb", _after_call)
+
+
+def _request_capacity(params, model, **kwargs):
+    if _request is not None and "ReturnConsumedCapacity" in model.input_shape.members:
+        params.setdefault("ReturnConsumedCapacity", "TOTAL")
+
+
+def _before_call(params, model, **kwargs):
+    if _request is None:
+        return
+
+    _call_starts.value = time.perf_counter()
+    if model.name not in READ_OPERATIONS:
+        # Item sizes are measured as the size of the requests that carry them
+        _request.add("ItemBytesWritten", len(params.get("body") or b""))
+
+
+def _after_call(http_response, parsed, model, **kwargs):
+    request = _request
+    start = getattr(_call_starts, "value", None)
+    if request is None or start is None:
+        return
+
+    _call_starts.value = None
+    request.add("DynamoDBMs", (time.perf_counter() - start) * 1000)
+    request.add("DynamoDBRequests", 1)
+
+    consumed = parsed.get("ConsumedCapacity") or []
+    if isinstance(consumed, dict):
+        consumed = [consumed]
+    capacity_units = sum(i.get("CapacityUnits", 0) for i in consumed)
+
+    if model.name in READ_OPERATIONS:
+        request.add("ReadCapacityUnits", capacity_units)
+        request.add("ItemBytesRead", len(http_response.content or b""))
+    else:
+        request.add("WriteCapacityUnits", capacity_units)
+
+
+def emit(request):
+    """Write the metrics of a request as an Embedded Metric Format log line."""
+    values = {k: round(v, 3) for k, v in request.values.items()}
+
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": METRICS_NAMESPACE,
+                            "Dimensions": [["FunctionName"]],
+                            "Metrics": [
+                                {"Name": k, "Unit": _unit(k)} for k in sorted(values)
+                            ],
+                        }
+                    ],
+                },
+                "FunctionName": FUNCTION_NAME,
+                **request.properties,
+                **values,
+            },
+            default=str,
+        ),
+        flush=True,
+    )
+
+
+def _unit(name):
+    if name.endswith("Ms"):
+        return "Milliseconds"
+    if "Bytes" in name:
+        return "Bytes"
+    return "Count"
@@ -0,0 +1,180 @@
+import functools
+import gzip
+import hashlib
+import logging
+import os
+import uuid
+
+import boto3
+from boto3.dynamodb.types import Binary
+from botocore.exceptions import ClientError
+
+logger = logging.getLogger(__name__)
+
+# Definition values larger than DEFINITION_OVERFLOW_BYTES are stored as objects in
+# the definitions bucket, and the item holds a pointer to the object instead. The
+# values are compressed unless DEFINITION_OVERFLOW_GZIP is "false".
+DEFINITIONS_BUCKET = os.getenv("DEFINITIONS_BUCKET")
+OVERFLOW_THRESHOLD = int(os.getenv("DEFINITION_OVERFLOW_BYTES", 65536))
+OVERFLOW_GZIP = os.getenv("DEFINITION_OVERFLOW_GZIP", "true").lower() != "false"
+
+# Item attributes that may hold a pointer instead of their value
+OVERFLOW_ATTRIBUTES = ("header", "patch")
+
+# Objects are never changed once written, so their values can be kept
+OVERFLOW_CACHE_SIZE = int(os.getenv("DEFINITION_OVERFLOW_CACHE_SIZE", 64))
+
+# Objects no longer referenced by an item are tagged, and a lifecycle rule on the
+# bucket expires them, so requests that read the item before it changed can
+# still read its values
+UNREFERENCED_TAG = {"Key": "unreferenced", "Value": "true"}
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client():
+    return boto3.client("s3")
+
+
+def compress_value(value):
+    """Compress a definition value when it is written, so the item is stored and
+    read at its compressed size. Compressed values are Binary attributes.
+
+    :param str value: A JSON document
+
+    :rtype: bytes
+    """
+    return gzip.compress(value.encode())
+
+
+def overflow_value(contributor_id, title_id, value):
+    """Store a definition value in the definitions bucket if it is larger than
+    the threshold.
+
+    Every stored value gets a new object, so an object is only ever referenced by
+    the item it was written for.
+
+    :param value: A JSON document, or one compressed with ``compress_value``
+    :type value: str or bytes
+
+    :returns: The value, or a pointer to the object it was stored in
+    :rtype: str, bytes or dict
+    """
+    size = len(value) if isinstance(value, bytes) else len(value.encode())
+    if not DEFINITIONS_BUCKET or size <= OVERFLOW_THRESHOLD:
+        return value
+
+    data = gzip.decompress(value) if isinstance(value, bytes) else value.encode()
+
+    encoding = "gzip" if OVERFLOW_GZIP else "identity"
+    key = f"{contributor_id}/{title_id.lower()}/{uuid.uuid4()}.json"
+    get_s3_client().put_object(
+        Bucket=DEFINITIONS_BUCKET,
+        Key=key,
+        Body=gzip.compress(data) if OVERFLOW_GZIP else data,
+        ContentType="application/json",
+        ContentEncoding=encoding,
+    )
+
+    return {
+        "bucket": DEFINITIONS_BUCKET,
+        "key": key,
+        "hash": hashlib.sha256(data).hexdigest(),
+        "size": len(data),
+        "encoding": encoding,
+    }
+
+
+def overflow_item(item):
+    """Return a copy of a title or version item with its large values stored in
+    the definitions bucket.
+
+    :rtype: dict
+    """
+    title_id = item["type"].split("#")[1]
+    return {
+        k: (
+            overflow_value(item["contributor_id"], title_id, v)
+            if k in OVERFLOW_ATTRIBUTES and isinstance(v, (str, bytes))
+            else v
+        )
+        for k, v in item.items()
+    }
+
+
+def load_value(value):
+    """Return a definition value, decompressing it if it is stored compressed and
+    reading it from the definitions bucket if the item holds a pointer.
+
+    :rtype: str
+    """
+    if isinstance(value, str):
+        return value
+    if isinstance(value, Binary):
+        value = value.value
+    if isinstance(value, bytes):
+        return gzip.decompress(value).decode()
+    return _load_object(value["bucket"], value["key"], value["hash"], value["encoding"])
+
+
+@functools.lru_cache(maxsize=OVERFLOW_CACHE_SIZE)
+def _load_object(bucket, key, digest, encoding):
+    data = get_s3_client().get_object(Bucket=bucket, Key=key)["Body"].read()
+    if encoding == "gzip":
+        data = gzip.decompress(data)
+
+    if hashlib.sha256(data).hexdigest() != digest:
+        raise ValueError(f"Definition object does not match its hash: {key}")
+    return data.decode()
+
+
+def overflow_objects(item):
+    """Return the bucket and key of every object an item points to.
+
+    :rtype: set
+    """
+    return {
+        (v["bucket"], v["key"])
+        for k, v in item.items()
+        if k in OVERFLOW_ATTRIBUTES and isinstance(v, dict)
+    }
+
+
+def release_objects(objects):
+    """Tag objects that are no longer referenced by an item so they expire.
+
+    :param objects: The bucket and key of each object
+    :type objects: iterable
+    """
+    for bucket, key in objects:
+        get_s3_client().put_object_tagging(
+            Bucket=bucket, Key=key, Tagging={"TagSet": [UNREFERENCED_TAG]}
+        )
+
+
+def delete_objects(objects):
+    """Delete objects from the definitions bucket.
+
+    :param objects: The bucket and key of each object
+    :type objects: iterable
+    """
+    by_bucket = dict()
+    for bucket, key in objects:
+        by_bucket.setdefault(bucket, list()).append({"Key": key})
+
+    for bucket, keys in by_bucket.items():
+        # DeleteObjects accepts at most 1,000 keys
+        for start in range(0, len(keys), 1000):
+            get_s3_client().delete_objects(
+                Bucket=bucket, Delete={"Objects": keys[start : start + 1000]}
+            )
+
+
+def discard_overflow(items):
+    """Delete the objects of items that were not written to the table, which
+    no request can have read. Errors are logged; the objects are only left
+    unreferenced.
+    """
+    try:
+        delete_objects(set().union(*[overflow_objects(i) for i in items]))
+    except ClientError:
+        logger.exception("Unable to delete unreferenced definition objects")
@@ -0,0 +1,126 @@
+import json
+import re
+
+from definition_helpers import is_versioned, read_legacy_body
+from overflow_helpers import load_value
+
+# Searchable definition fields and the weight of a match on each
+SEARCH_FIELDS = {"name": 4, "appName": 3, "bundleId": 2, "publisher": 1}
+
+# Every prefix of a token from MIN_TERM_LENGTH to MAX_TERM_LENGTH characters is
+# indexed as a term
+MIN_TERM_LENGTH = 3
+MAX_TERM_LENGTH = 12
+
+# Parts of bundle IDs and application names that would match nearly every title
+STOP_WORDS = frozenset(("app", "com", "net", "org"))
+
+# Index entries live in one partition per term and are ordered by their rank
+SEARCH_PARTITION_PREFIX = "SEARCH#"
+MATCH_PREFIX = "MATCH#"
+MAX_SCORE = 9
+
+# Incremented whenever the index changes, so cached results can be discarded
+GENERATION_KEY = {"contributor_id": "SEARCH", "type": "GENERATION"}
+
+TOKEN_PATTERN = re.compile(r"[^\W_]+")
+
+
+def tokenize(text):
+    """Split text into lowercase words, without stop words.
+
+    :rtype: list
+    """
+    return [i for i in TOKEN_PATTERN.findall(text.lower()) if i not in STOP_WORDS]
+
+
+def search_fields(title_item):
+    """Return the searchable fields of a title item.
+
+    :rtype: dict
+    """
+    if is_versioned(title_item):
+        definition = json.loads(load_value(title_item["header"]))
+    elif "body" in title_item or "body_gzip" in title_item:
+        definition = json.loads(read_legacy_body(title_item))
+    else:
+        definition = title_item.get("summary", {})
+
+    return {k: str(definition.get(k) or "") for k in ("id",) + tuple(SEARCH_FIELDS)}
+
+
+def index_terms(fields):
+    """Return the index terms of a title's searchable fields with their score.
+
+    A whole word scores higher than a prefix of one, and a match on a field with
+    a higher weight scores higher than one on a lower weight field. A term found
+    in several fields keeps its highest score.
+
+    :param dict fields: Fields from ``search_fields()``
+
+    :rtype: dict
+    """
+    terms = dict()
+    for field, weight in SEARCH_FIELDS.items():
+        for token in tokenize(fields[field]):
+            for length in range(MIN_TERM_LENGTH, min(len(token), MAX_TERM_LENGTH) + 1):
+                score = weight * 2 + (1 if length == len(token) else 0)
+                terms[token[:length]] = max(terms.get(token[:length], 0), score)
+    return terms
+
+
+def index_items(contributor_id, fields):
+    """Return the search index entries of a title, by their table key.
+
+    Each entry holds the fields returned in search results and the title's
+    words, which are used to match the other words of a query.
+
+    :param dict fields: Fields from ``search_fields()``
+
+    :rtype: dict
+    """
+    title = {"contributor_id": contributor_id, **fields}
+    tokens = sorted({i for field in SEARCH_FIELDS for i in tokenize(fields[field])})
+
+    items = dict()
+    for term, score in index_terms(fields).items():
+        key = (
+            f"{SEARCH_PARTITION_PREFIX}{term}",
+            f"{MATCH_PREFIX}{MAX_SCORE - score}#{contributor_id}#{fields['id'].lower()}",
+        )
+        items[key] = {
+            "contributor_id": key[0],
+            "type": key[1],
+            "title": title,
+            "tokens": tokens,
+            "score": score,
+        }
+    return items
+
+
+def query_terms(query):
+    """Split a search query into the term whose index partition is read and
+    the words that the titles read must also match.
+
+    The longest word is read from the index, as it matches the fewest titles.
+    Every word of a query matches the start of a word of a title.
+
+    :raises ValueError: No word of the query is long enough to be searched
+
+    :rtype: tuple
+    """
+    words = tokenize(query)
+    if not words or max(len(i) for i in words) < MIN_TERM_LENGTH:
+        raise ValueError(
+            f"'q' must contain a word of at least {MIN_TERM_LENGTH} characters"
+        )
+
+    longest = max(words, key=len)
+    return longest[:MAX_TERM_LENGTH], words
+
+
+def matches(index_item, words):
+    """Whether every word of a query starts a word of an indexed title."""
+    return all(
+        any(token.startswith(word) for token in index_item["tokens"]) for word in words
+    )
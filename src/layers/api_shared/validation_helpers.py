@@ -0,0 +1,108 @@
+import functools
+import json
+import os
+
+# Schemas used by several functions are shipped with the layer
+SHARED_SCHEMA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "schemas")
+
+
+@functools.lru_cache(maxsize=None)
+def get_validator(schema_name):
+    """Returns a validator for a JSON schema in the function's ``schemas``
+    directory, or in the layer's if the function does not have it.
+
+    The schema is checked and the validator built only once per container;
+    subsequent calls return the same validator. ``jsonschema`` is imported by
+    the first call rather than with this module. Nested ``$id`` values in schemas
+    without any ``$ref`` are dropped: they only change the resolution scope,
+    which is costly to track for every element of a large instance.
+
+    :param str schema_name: Name of the schema file without the extension
+
+    :rtype: jsonschema.protocols.Validator
+    """
+    from jsonschema.validators import validator_for
+
+    with open(schema_path(schema_name), "r") as f_obj:
+        schema = json.load(f_obj)
+
+    if "$ref" not in json.dumps(schema):
+        schema = _strip_nested_ids(schema)
+
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+@functools.lru_cache(maxsize=None)
+def get_array_validator(schema_name):
+    """Returns a validator for a non-empty JSON array of instances of a schema
+    found by ``get_validator()``. Errors in the items are reported with
+    the index of the item in their path.
+
+    :param str schema_name: Name of the item schema file without the extension
+
+    :rtype: jsonschema.protocols.Validator
+    """
+    from jsonschema.validators import validator_for
+
+    item_schema = get_validator(schema_name).schema
+
+    schema = {
+        "type": "array",
+        "minItems": 1,
+        "items": {k: v for k, v in item_schema.items() if k not in ("$id", "$schema")},
+    }
+    if "$schema" in item_schema:
+        schema["$schema"] = item_schema["$schema"]
+
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def schema_path(schema_name):
+    """The path of a schema file in the function's ``schemas`` directory, or in
+    the layer's if the function does not have it.
+
+    :param str schema_name: Name of the schema file without the extension
+
+    :rtype: str
+    """
+    path = os.path.join("schemas", f"{schema_name}.json")
+    if os.path.exists(path):
+        return path
+    return os.path.join(SHARED_SCHEMA_DIR, f"{schema_name}.json")
+
+
+def _strip_nested_ids(schema, root=True):
+    if isinstance(schema, dict):
+        return {
+            k: _strip_nested_ids(v, root=False)
+            for k, v in schema.items()
+            if root or not (k == "$id" and isinstance(v, str))
+        }
+    elif isinstance(schema, list):
+        return [_strip_nested_ids(i, root=False) for i in schema]
+    return schema
+
+
+def validation_errors(validator, instance):
+    """Validates an instance and returns a message for every error found,
+    ordered by the location of the error in the instance.
+
+    :param validator: A validator from ``get_validator()``
+    :param instance: The deserialized JSON to validate
+
+    :returns: Error messages; an empty list if the instance is valid
+    :rtype: list
+    """
+    # Paths that share a prefix continue in the same object or array, so their
+    # elements compare as strings or as indexes, never a mix of the two
+    errors = sorted(
+        validator.iter_errors(instance), key=lambda e: tuple(e.absolute_path)
+    )
+    return [
+        f"{error.message} for item: {'/'.join([str(i) for i in error.absolute_path])}"
+        for error in errors
+    ]
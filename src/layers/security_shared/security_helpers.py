@@ -1,21 +1,33 @@
 import base64
+import functools
 import os
 import time
 import uuid
 
 import boto3
-from cryptography.fernet import Fernet
-import jwt
 
 PARAM_STORE_PATH = os.getenv('PARAM_STORE_PATH')
 
-ssm_client = boto3.client('ssm')
+# Parameters are read on first use and again once they are older than
+# PARAMETER_CACHE_TTL seconds, so warm containers pick up rotated keys
+PARAMETER_CACHE_TTL = int(os.getenv('PARAMETER_CACHE_TTL', 300))
+
+PARAMETER_NAMES = (
+    'database_key', 'legacy_api_key', 'token_private_key', 'token_public_key'
+)
+
+_parameter_cache = {'expires': 0, 'values': None}
+
+
+@functools.lru_cache(maxsize=None)
+def get_ssm_client():
+    return boto3.client('ssm')
 
 
 def get_parameters(param_names):
     return_params = dict()
 
-    resp = ssm_client.get_parameters(
+    resp = get_ssm_client().get_parameters(
         Names=[os.path.join(PARAM_STORE_PATH, i) for i in param_names],
         WithDecryption=True
     )
@@ -33,17 +45,59 @@ def get_parameters(param_names):
     return return_params
 
 
-parameters = get_parameters(
-    ('database_key', 'legacy_api_key', 'token_private_key', 'token_public_key')
-)
+def get_parameter(name):
+    """Returns a parameter, reading all of the parameters in one request if they
+    have not been read yet or the cached values have expired.
+    """
+    if time.monotonic() >= _parameter_cache['expires']:
+        _parameter_cache['values'] = get_parameters(PARAMETER_NAMES)
+        _parameter_cache['expires'] = time.monotonic() + PARAMETER_CACHE_TTL
+
+    return _parameter_cache['values'][name]
+
+
+def __getattr__(name):
+    # ``parameters`` was previously read when the module was imported
+    if name == 'parameters':
+        return {i: get_parameter(i) for i in PARAMETER_NAMES}
+    raise AttributeError(f"module '{__name__}' has no attribute '{name}'")
+
+
+# Key objects are cached by the parameter value: each key is only parsed once,
+# and a rotated key is parsed when the parameters are next read
+
+
+@functools.lru_cache(maxsize=2)
+def _load_fernet(key):
+    from cryptography.fernet import Fernet
+    return Fernet(key)
+
+
+@functools.lru_cache(maxsize=2)
+def _load_private_key(pem):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.serialization import load_pem_private_key
+    return load_pem_private_key(pem, password=None, backend=default_backend())
+
+
+@functools.lru_cache(maxsize=2)
+def _load_public_key(pem):
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives.serialization import load_pem_public_key
+    return load_pem_public_key(pem, backend=default_backend())
 
 
 def get_fernet():
-    return Fernet(parameters['database_key'])
+    return _load_fernet(get_parameter('database_key'))
 
 
-def create_token(contributor_id):
-    token_id = uuid.uuid4().hex
+def create_token(contributor_id, **claims):
+    """Returns a token signed with the service's private key, and its ID.
+    Claims are added to the token, replacing the defaults.
+    """
+    import jwt
+
+    token_id = claims.get('jti') or uuid.uuid4().hex
     now = int(time.time())
 
     api_token = jwt.encode(
@@ -51,43 +105,53 @@ def create_token(contributor_id):
             'jti': token_id,
             'sub': contributor_id,
             'iat': now,
-            'exp': now + 31536000  # one year
+            'exp': now + 31536000,  # one year
+            **claims
         },
-        parameters['token_private_key'],
+        _load_private_key(get_parameter('token_private_key')),
         algorithm='RS256'
     ).decode()
     return api_token, token_id
 
 
 def create_legacy_token(contributor_id):
+    import jwt
+
     token_id = uuid.uuid4().hex
     api_token = jwt.encode(
         {
             'jti': token_id,
             'sub': contributor_id
         },
-        parameters['legacy_api_key'],
+        get_parameter('legacy_api_key'),
         algorithm='HS256'
     ).decode()
     return api_token, token_id
 
 
-def validate_token(token):
+def validate_token(token, **options):
+    """Returns the claims of a verified token. Options, such as ``issuer`` and
+    ``audience``, are passed to ``jwt.decode``.
+    """
+    import jwt
+
     headers = jwt.get_unverified_header(token)
 
     if headers['alg'] == 'HS256':
         algorithm = 'HS256'
-        signing_secret = parameters['legacy_api_key']
+        signing_secret = get_parameter('legacy_api_key')
 
     elif headers['alg'] == 'RS256':
         algorithm = 'RS256'
-        signing_secret = parameters['token_public_key']
+        signing_secret = _load_public_key(get_parameter('token_public_key'))
 
     else:
         raise Exception('Unauthorized')
 
     try:
-        decoded_token = jwt.decode(token, signing_secret, algorithms=algorithm)
+        decoded_token = jwt.decode(
+            token, signing_secret, algorithms=algorithm, **options
+        )
     except jwt.InvalidTokenError:
         raise Exception('Unauthorized')
 